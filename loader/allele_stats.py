@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Compute the allele counts and frequencies of a VCF file from its genotypes, with NumPy.
+
+The AC and AF of KG_VARIANT_MULT_VAL are copied from the INFO column. This script
+recomputes them from the GT columns instead, for all the samples or a subset, together
+with the counts that the INFO column does not have. It writes one tab-separated line per
+alternate allele of every variant, in the layout of the KG_ALLELE_STATS_BUF buffer:
+  nvid  order_nbr  ac  an  af  het  hom_alt  missing
+where
+  - nvid and order_nbr number the variants and their alternate alleles from 0, as vcfstreamer does;
+  - ac is the number of copies of the allele, and an the number of called alleles of the variant;
+  - af is ac / an, empty if no allele was called;
+  - het and hom_alt are the samples with one copy of the allele, and only copies of it;
+  - missing is the samples with a missing call ('.') at the variant.
+
+The GT columns are parsed a block of variants at a time: the lines whose genotypes are
+all of the form 'a|b' or 'a/b' with single-digit alleles (or all haploid) are decoded
+by one NumPy view over their bytes, the others one genotype at a time.
+
+With ALLELE_STATS=1, stream_vcf_1d.sh runs it next to vcfstreamer and loads its output
+into ${PREFIX}_KG_ALLELE_STATS_BUF; redim_with_prefix.sh then stores it in
+KG_VARIANT_ALLELE_STATS, so that frequency queries read one cell per allele instead of
+scanning KG_GENOTYPE.
+
+Examples:
+  - Write the statistics of a file:
+      ./allele_stats.py ALL.chr21.vcf.gz > chr21_stats.tsv
+  - Check the AC and AF of the INFO column against the genotypes:
+      ./allele_stats.py --check -o /dev/null ALL.chr21.vcf.gz
+  - Compute the frequencies within a population:
+      ./allele_stats.py --samples gbr_samples.txt ALL.chr21.vcf.gz > chr21_gbr.tsv
+"""
+
+import argparse
+import sys
+import scidblib
+import vcf_reader
+
+# Allele codes besides the allele numbers: a missing call, and no allele (the second allele of a haploid call).
+MISSING = -1
+ABSENT = -2
+
+def import_numpy():
+    """@return the numpy module.
+    @exception AppError if NumPy is not installed.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise scidblib.AppError('The allele statistics need NumPy; please install it.')
+    return numpy
+
+def parse_genotype(gt):
+    """Decode one genotype, e.g. '0|1', '1/2', '.', or '1' for a haploid call.
+
+    @param gt  the genotype, possibly followed by ':' and other FORMAT fields.
+    @return a pair of allele codes.
+    @exception ValueError if the genotype has more than two alleles or a bad allele.
+    """
+    alleles = gt.split(':', 1)[0].replace('/', '|').split('|')
+    if len(alleles) > 2:
+        raise ValueError('Genotype %s has more than two alleles.' % gt)
+    codes = [MISSING if a == '.' else int(a) for a in alleles]
+    return codes[0], codes[1] if len(codes) == 2 else ABSENT
+
+class GenotypeBlock:
+    """The allele codes of a block of variants, as an int16 array of shape (variants, samples, 2)."""
+    def __init__(self, numpy, num_samples, max_variants):
+        """
+        @param numpy         the numpy module.
+        @param num_samples   the number of GT columns.
+        @param max_variants  the number of variants of a full block.
+        """
+        self._numpy = numpy
+        self._num_samples = num_samples
+        self._diploid_len = 4 * num_samples - 1   # 'a|b' and a tab per sample.
+        self._haploid_len = 2 * num_samples - 1
+        self.codes = numpy.empty((max_variants, num_samples, 2), dtype=numpy.int16)
+        self.num_alts = []
+        self._fast = {self._diploid_len: ([], []), self._haploid_len: ([], [])}   # length -> (rows, texts)
+
+    def __len__(self):
+        return len(self.num_alts)
+
+    def add(self, fields, line_gt):
+        """Add a variant.
+
+        @param fields   the first columns of the VCF line, up to FORMAT.
+        @param line_gt  the rest of the line: the tab-separated genotypes.
+        @exception ValueError if the line does not have one genotype per sample.
+        """
+        row = len(self.num_alts)
+        alt = fields[vcf_reader.ALT]
+        self.num_alts.append(0 if alt == '.' else alt.count(',') + 1)
+        if len(line_gt) in self._fast:
+            rows, texts = self._fast[len(line_gt)]
+            rows.append(row)
+            texts.append(line_gt)
+            return
+        self._decode_slowly(row, line_gt)
+
+    def _decode_slowly(self, row, line_gt):
+        gts = line_gt.split('\t')
+        if len(gts) != self._num_samples:
+            raise ValueError('Variant %d has %d genotypes for %d samples.' % (row, len(gts), self._num_samples))
+        self.codes[row] = [parse_genotype(gt) for gt in gts]
+
+    def finish(self):
+        """Decode the genotypes of the lines of the fast layouts.
+
+        @return the allele codes of the variants of the block.
+        """
+        numpy = self._numpy
+        for length, (rows, texts) in self._fast.iteritems():
+            if not rows:
+                continue
+            width = 4 if length == self._diploid_len else 2
+            raw = numpy.frombuffer('\t'.join(texts) + '\t', dtype=numpy.uint8).reshape(len(rows), self._num_samples, width)
+            alleles = raw[:, :, ::2]   # The allele characters; the odd ones are separators.
+            valid = ((raw[:, :, -1] == ord('\t')).all() and
+                     (((alleles >= ord('0')) & (alleles <= ord('9'))) | (alleles == ord('.'))).all())
+            if width == 4:
+                valid = valid and ((raw[:, :, 1] == ord('|')) | (raw[:, :, 1] == ord('/'))).all()
+            if valid:
+                codes = alleles.astype(numpy.int16) - ord('0')
+                codes[alleles == ord('.')] = MISSING
+                self.codes[rows, :, :alleles.shape[2]] = codes
+                if width == 2:
+                    self.codes[rows, :, 1] = ABSENT
+            else:
+                # A genotype like '10|1' next to a missing '.' can have the right length by chance.
+                for row, text in zip(rows, texts):
+                    self._decode_slowly(row, text)
+            del rows[:], texts[:]
+        return self.codes[:len(self.num_alts)]
+
+def allele_stats(numpy, codes, num_alts, samples=None):
+    """Compute the statistics of every alternate allele of a block of variants.
+
+    @param numpy     the numpy module.
+    @param codes     the allele codes, an integer array of shape (variants, samples, 2).
+    @param num_alts  the number of alternate alleles of every variant.
+    @param samples   the indexes of the samples to count, or None for all of them.
+    @return an int64 array of shape (variants, max(num_alts, 1), 5) holding
+            ac, het, hom_alt for every allele, then an and missing for every variant;
+            the alleles beyond the num_alts of a variant have zero counts.
+    """
+    if samples is not None:
+        codes = codes[:, samples, :]
+    first, second = codes[:, :, 0], codes[:, :, 1]
+    diploid = second != ABSENT
+    called = (first != MISSING) & (second != MISSING)
+    count = numpy.count_nonzero
+    an = count(first >= 0, axis=1) + count(second >= 0, axis=1)
+    missing = codes.shape[1] - count(called, axis=1)
+    width = max(max(num_alts) if num_alts else 0, 1)
+    result = numpy.zeros((codes.shape[0], width, 5), dtype=numpy.int64)
+    for i in range(width):
+        in_first = first == i + 1
+        in_second = second == i + 1
+        result[:, i, 0] = count(in_first, axis=1) + count(in_second, axis=1)
+        result[:, i, 1] = count((in_first != in_second) & called & diploid, axis=1)
+        result[:, i, 2] = count(in_first & (in_second | ~diploid) & called, axis=1)
+        result[:, i, 3] = an
+        result[:, i, 4] = missing
+    return result
+
+def info_mismatches(fields, counts, num_alts):
+    """Compare the AC and AF of the INFO column of a variant with its computed statistics.
+
+    @param fields    the columns of the variant.
+    @param counts    its rows of allele_stats().
+    @param num_alts  its number of alternate alleles.
+    @return a list of messages, empty if they agree or the INFO column has no AC or AF.
+    """
+    info = vcf_reader.parse_info(fields[vcf_reader.INFO])
+    messages = []
+    an = counts[0][3]
+    for key in ('AC', 'AF'):
+        if key not in info or info[key] is True:
+            continue
+        values = info[key].split(',')
+        for i in range(min(num_alts, len(values))):
+            ac = counts[i][0]
+            if key == 'AC' and values[i] != '.' and int(values[i]) != ac:
+                messages.append('AC %s, genotypes %d' % (values[i], ac))
+            elif key == 'AF' and values[i] != '.' and an:
+                af = ac * 1.0 / an
+                if abs(float(values[i]) - af) > max(1e-6, 1e-3 * af):
+                    messages.append('AF %s, genotypes %.6g' % (values[i], af))
+    return messages
+
+def read_sample_names(path):
+    """@return the sample names of a file, one per line, or separated by white space."""
+    with open(path) as f:
+        return f.read().split()
+
+def run(f, out, block_variants, sample_names=None, check=False, verbose=False):
+    """Write the allele statistics of a VCF file.
+
+    @param f               the VCF file object, at its start.
+    @param out             the file object to write the statistics to.
+    @param block_variants  the number of variants to decode at once.
+    @param sample_names    the samples to count, or None for all of them.
+    @param check           whether to compare them with the AC and AF of the INFO column.
+    @param verbose         whether to print totals to stderr.
+    @return the number of variants whose INFO column disagrees with the genotypes.
+    @exception AppError if the input is not a VCF file, or a sample is not in it.
+    """
+    numpy = import_numpy()
+    try:
+        meta, names = vcf_reader.read_header(f)
+    except ValueError as e:
+        raise scidblib.AppError(str(e))
+    samples = None
+    if sample_names is not None:
+        index = dict((name, i) for i, name in enumerate(names))
+        unknown = [name for name in sample_names if name not in index]
+        if unknown:
+            raise scidblib.AppError('The input has no sample %s.' % ', '.join(unknown[:5]))
+        samples = numpy.array([index[name] for name in sample_names], dtype=numpy.intp)
+
+    block = GenotypeBlock(numpy, len(names), block_variants)
+    variants = []
+    state = {'nvid': 0, 'alleles': 0, 'mismatches': 0}
+
+    def flush():
+        codes = block.finish()
+        stats = allele_stats(numpy, codes, block.num_alts, samples)
+        lines = []
+        for fields, num_alts, counts in zip(variants, block.num_alts, stats):
+            for i in range(max(num_alts, 1)):
+                ac, het, hom_alt, an, missing = counts[i]
+                af = '%.6g' % (ac * 1.0 / an) if an else ''
+                lines.append('%d\t%d\t%d\t%d\t%s\t%d\t%d\t%d\n' % (state['nvid'], i, ac, an, af, het, hom_alt, missing))
+            if check:
+                messages = info_mismatches(fields, counts, num_alts)
+                if messages:
+                    state['mismatches'] += 1
+                    if state['mismatches'] <= 10:
+                        print >> sys.stderr, '%s: %s.' % (vcf_reader.signature(fields), '; '.join(messages))
+            state['nvid'] += 1
+            state['alleles'] += max(num_alts, 1)
+        out.write(''.join(lines))
+        del variants[:], block.num_alts[:]
+
+    for line in f:
+        if len(line) <= 1:
+            continue
+        fields = line.rstrip('\n').split('\t', vcf_reader.NUM_FIXED_COLUMNS)
+        if len(fields) <= vcf_reader.NUM_FIXED_COLUMNS:
+            raise scidblib.AppError('Variant %d has no genotypes.' % (state['nvid'] + len(variants)))
+        try:
+            block.add(fields, fields.pop())
+        except ValueError as e:
+            raise scidblib.AppError('Variant %d: %s' % (state['nvid'] + len(variants), e))
+        variants.append(fields)
+        if len(variants) == block_variants:
+            flush()
+    if variants:
+        flush()
+
+    if verbose:
+        print >> sys.stderr, 'Counted %d alleles of %d variants over %d samples.' % (
+            state['alleles'], state['nvid'], len(names) if samples is None else len(samples))
+    if check:
+        print >> sys.stderr, '%d of %d variants disagree with the AC or AF of their INFO column.' % (
+            state['mismatches'], state['nvid'])
+    return state['mismatches']
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Compute the allele counts and frequencies of a VCF file from its genotypes.')
+    parser.add_argument('-o', '--output', help='The file to write the statistics to. Default is stdout.')
+    parser.add_argument('-s', '--samples', metavar='FILE',
+                        help='Only count the samples named in FILE, one per line. Default is all samples.')
+    parser.add_argument('-b', '--block-variants', type=int, default=1024,
+                        help='The number of variants to decode at once. Default is 1024.')
+    parser.add_argument('--check', action='store_true',
+                        help='Compare the AC and AF of the INFO column with the genotypes; exit with status 2 if they disagree.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the totals to stderr.')
+    parser.add_argument('input', help='The VCF file, gzipped or not, or - for stdin.')
+    args = parser.parse_args(argv[1:])
+
+    if args.check and args.samples:
+        parser.error('The INFO column counts all the samples; --check cannot be combined with --samples.')
+    if args.block_variants < 1:
+        parser.error('The block must have at least one variant.')
+
+    try:
+        sample_names = read_sample_names(args.samples) if args.samples else None
+        f = sys.stdin if args.input == '-' else vcf_reader.open_vcf(args.input)
+        out = open(args.output, 'w') if args.output else sys.stdout
+        mismatches = run(f, out, args.block_variants, sample_names, args.check, args.verbose)
+        out.close()
+    except (IOError, scidblib.AppError) as e:
+        print >> sys.stderr, e
+        return 1
+    return 2 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Benchmark the ingest pipeline stage by stage on synthetic inputs of several sizes.
+
+For every size, a synthetic VCF is generated with gen_synthetic_vcf.py (and kept in the
+work directory for the next runs), then these stages are timed one at a time:
+  - decompress: zcat of the input.
+  - parse:      vcfstreamer, from the decompressed VCF into the VAR, GT, MV and sample files.
+  - pyparse:    the Python parser, vcf_reader.py, over the decompressed VCF.
+  - split:      osplitcsv of the GT file into one fragment per instance.
+  - convert:    tsv2scidb of every fragment.
+  - load:       stream_vcf_1d.sh, the whole streaming load into the buffer arrays.
+  - redim:      redim_with_prefix.sh, from the buffer arrays into the target arrays.
+The load and redim stages need a database, and only run with --db. They write into the
+target arrays, so point them at a scratch database or at the stand-in (. localdb/env.sh).
+
+Every stage records its wall time, CPU time, peak resident memory (of the largest process
+of the stage, from wait4) and throughput in bytes of input per second, under the key
+'<stage>/<samples>x<variants>' of the history file. The first run of a key becomes its
+baseline; later runs fail with exit status 1 when the throughput of a stage dropped, or
+its peak memory grew, by more than the threshold.
+
+Usage:
+  ./bench_ingest.py --sizes 1000,10000 --samples 2504
+  . localdb/env.sh && ./bench_ingest.py --db --reset --sizes 20000
+  ./bench_ingest.py --sizes 20000 --update-baseline --label after-chunk-change
+"""
+
+import argparse
+import os
+import sys
+import gen_synthetic_vcf
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_bench
+from scidblib import statistics
+
+STAGES = ['decompress', 'parse', 'pyparse', 'split', 'convert', 'load', 'redim']
+DB_STAGES = ['load', 'redim']
+
+PYPARSE_SCRIPT = ('import sys, vcf_reader\n'
+                  'f = vcf_reader.open_vcf(sys.argv[1])\n'
+                  'vcf_reader.read_header(f)\n'
+                  'for r in vcf_reader.records(f):\n'
+                  '    vcf_reader.parse_info(r[vcf_reader.INFO])\n')
+
+def synthetic_input(work_dir, num_samples, num_variants, seed):
+    """Generate a BGZF synthetic VCF, unless the work directory already has it.
+
+    @return the path of the file.
+    """
+    path = os.path.join(work_dir, 'synth_%dx%d_%d.vcf.gz' % (num_samples, num_variants, seed))
+    if not os.path.exists(path):
+        print 'Generating %s.' % path
+        tmp = path + '.tmp'
+        out = gen_synthetic_vcf.BgzfWriter(open(tmp, 'wb'))
+        try:
+            gen_synthetic_vcf.SyntheticVcf(num_samples=num_samples, num_variants=num_variants, seed=seed).write(out)
+        finally:
+            out.close()
+        os.rename(tmp, path)
+    return path
+
+class IngestBench:
+    """Run the stages on one input and collect their metrics."""
+    def __init__(self, args, loader_dir, input_path, num_samples, num_variants):
+        self._args = args
+        self._loader_dir = loader_dir
+        self._input = input_path
+        self._size = '%dx%d' % (num_samples, num_variants)
+        self._cells = num_samples * num_variants
+        d = os.path.join(args.work_dir, self._size)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        self._plain = os.path.join(d, 'plain.vcf')
+        self._samples = os.path.join(d, 'samples.tsv')
+        self._var = os.path.join(d, 'var.tsv')
+        self._gt = os.path.join(d, 'gt.tsv')
+        self._mv = os.path.join(d, 'mv.tsv')
+        self._fragments = os.path.join(d, 'gt_fragment')
+        self._bin = os.path.join(args.scidb_root, 'bin')
+        self._prefix = 'BENCH_%d' % num_variants
+        self._log = os.path.join(d, 'db_stages.log')
+        self._env = dict(os.environ, LOAD_MANIFEST='none')
+
+    def _run(self, cmd, num_bytes):
+        """Run a stage --repeat times and keep the fastest.
+
+        @return the metrics of the stage, as a dict; with --repeat, seconds_mean and
+                seconds_stdev give the spread of the runs.
+        """
+        best = None
+        runs = statistics.RunningStats()
+        for i in range(self._args.repeat):
+            m = scidb_bench.measure(cmd, cwd=self._loader_dir, env=self._env)
+            runs.add(m.seconds)
+            if best is None or m.seconds < best.seconds:
+                best = m
+        seconds = max(best.seconds, 1e-6)
+        metrics = {'seconds': best.seconds, 'user': best.user, 'sys': best.sys,
+                   'max_rss_kb': best.max_rss_kb, 'bytes': num_bytes, 'cells': self._cells,
+                   'throughput': num_bytes / seconds, 'cells_per_second': self._cells / seconds}
+        if runs.count > 1:
+            metrics['seconds_mean'] = runs.mean()
+            metrics['seconds_stdev'] = runs.stdev()
+        return metrics
+
+    def _fragment_paths(self):
+        return ['%s_%04d' % (self._fragments, n) for n in range(self._args.instances)]
+
+    def decompress(self):
+        m = self._run('zcat "%s" > "%s"' % (self._input, self._plain), 0)
+        # The bytes produced are only known afterwards.
+        size = os.path.getsize(self._plain)
+        m['bytes'] = size
+        m['throughput'] = size / max(m['seconds'], 1e-6)
+        return m
+
+    def parse(self):
+        streamer = os.path.join(self._loader_dir, 'vcfstreamer', 'vcfstreamer')
+        if not os.path.exists(streamer):
+            raise scidblib.AppError('Please build %s first (make -C vcfstreamer).' % streamer)
+        cmd = '"%s" "%s" "%s" "%s" "%s" < "%s"' % (streamer, self._samples, self._var, self._gt, self._mv, self._plain)
+        return self._run(cmd, os.path.getsize(self._plain))
+
+    def pyparse(self):
+        cmd = '"%s" -c "%s" "%s"' % (sys.executable, PYPARSE_SCRIPT.replace('"', '\\"'), self._plain)
+        return self._run(cmd, os.path.getsize(self._plain))
+
+    def split(self):
+        cmd = '"%s" -n %d -c %d -s 0 -o "%s" -d "\\t" --format=tsv < "%s"' % (
+            os.path.join(self._bin, 'osplitcsv'), self._args.instances, self._args.chunk_size,
+            self._fragments, self._gt)
+        return self._run(cmd, os.path.getsize(self._gt))
+
+    def convert(self):
+        cmds = []
+        for n, fragment in enumerate(self._fragment_paths()):
+            cmds.append('"%s" -c %d -f %d -n %d -d "\\t" -o "%s.dlf" < "%s"' % (
+                os.path.join(self._bin, 'tsv2scidb'), self._args.chunk_size, n * self._args.chunk_size,
+                self._args.instances, fragment, fragment))
+        num_bytes = sum(os.path.getsize(f) for f in self._fragment_paths())
+        return self._run(' && '.join(cmds), num_bytes)
+
+    def load(self):
+        if self._args.reset:
+            scidb_bench.measure('./reset_db.sh', cwd=self._loader_dir, env=self._env)
+        return self._run('./stream_vcf_1d.sh "%s" %s > "%s" 2>&1' % (self._input, self._prefix, self._log),
+                         os.path.getsize(self._plain))
+
+    def redim(self):
+        return self._run('./redim_with_prefix.sh %s > "%s" 2>&1' % (self._prefix, self._log),
+                         os.path.getsize(self._plain))
+
+    def run(self, stages):
+        """Run the stages, in pipeline order.
+
+        @return a dict mapping '<stage>/<size>' to the metrics of the stage.
+        """
+        results = {}
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            # A stage run on its own still needs the output of the stages before it.
+            if stage != 'decompress' and not os.path.exists(self._plain):
+                self.decompress()
+            if stage in ('split', 'convert') and not os.path.exists(self._gt):
+                self.parse()
+            if stage == 'convert' and not all(os.path.exists(f) for f in self._fragment_paths()):
+                self.split()
+            results['%s/%s' % (stage, self._size)] = getattr(self, stage)()
+        return results
+
+def print_results(results, baselines):
+    print '%-24s %10s %10s %12s %10s' % ('stage/size', 'seconds', 'MB/s', 'peak RSS MB', 'vs base')
+    def order(key):
+        stage, size = key.split('/')
+        return [int(n) for n in size.split('x')], STAGES.index(stage)
+    for key in sorted(results, key=order):
+        r = results[key]
+        change = ''
+        if key in baselines and baselines[key].get('throughput'):
+            change = '%+.1f%%' % ((r['throughput'] / baselines[key]['throughput'] - 1) * 100)
+        print '%-24s %10.2f %10.2f %12.1f %10s' % (key, r['seconds'], r['throughput'] / 1e6,
+                                                    r['max_rss_kb'] / 1024.0, change)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Benchmark the ingest stages on synthetic inputs, against stored baselines.')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='A comma-separated list of the numbers of variants to benchmark. Default is 1000,10000.')
+    parser.add_argument('-n', '--samples', type=int, default=2504, help='The number of samples. Default is 2504.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed of the synthetic inputs. Default is 0.')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='A comma-separated list of the stages to run. Default is all of them; load and redim also need --db.')
+    parser.add_argument('--db', action='store_true', help='Run the load and redim stages against the database iquery reaches.')
+    parser.add_argument('--reset', action='store_true',
+                        help='Run reset_db.sh before every load, so that every redim starts from empty target arrays.')
+    parser.add_argument('--instances', type=int, default=2, help='The number of fragments to split into. Default is 2.')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='The chunk size of split and convert. Default is 1000000.')
+    parser.add_argument('--repeat', type=int, default=1, help='Run every stage this many times and keep the fastest. Default is 1.')
+    parser.add_argument('-r', '--scidb-root', default=os.getenv('SCIDB_INSTALL_PATH', '/opt/scidb/14.8'),
+                        help='Where to find osplitcsv and tsv2scidb (in the bin directory). Default is $SCIDB_INSTALL_PATH or /opt/scidb/14.8.')
+    parser.add_argument('-w', '--work-dir', default='bench_work',
+                        help='Where to keep the synthetic inputs and intermediate files. Default is bench_work.')
+    parser.add_argument('--history', default='bench_history.json', help='The history file. Default is bench_history.json.')
+    parser.add_argument('--label', default='', help='A name for this run in the history, e.g. a git revision.')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='The tolerated drop in throughput, as a fraction of the baseline. Default is 0.2.')
+    parser.add_argument('--memory-threshold', type=float, default=0.25,
+                        help='The tolerated growth in peak memory, as a fraction of the baseline. Default is 0.25.')
+    parser.add_argument('--update-baseline', action='store_true', help='Make this run the baseline of every stage it ran.')
+    args = parser.parse_args(argv[1:])
+
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error('Unknown stage %s; the stages are %s.' % (stage, ', '.join(STAGES)))
+    if not args.db:
+        stages = [stage for stage in stages if stage not in DB_STAGES]
+
+    loader_dir = os.path.dirname(os.path.abspath(__file__))
+    args.work_dir = os.path.abspath(args.work_dir)
+    if not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+
+    try:
+        history = scidb_bench.BenchHistory(args.history)
+        meta = {'samples': args.samples, 'seed': args.seed, 'instances': args.instances,
+                'chunk_size': args.chunk_size, 'repeat': args.repeat}
+        if args.db:
+            # The instances the load and redim ran on, which plan_load.py scales from.
+            meta['db_instances'] = scidb_afl.get_num_instances(scidb_afl.get_iquery_cmd())
+        results = {}
+        for num_variants in [int(s) for s in args.sizes.split(',')]:
+            path = synthetic_input(args.work_dir, args.samples, num_variants, args.seed)
+            bench = IngestBench(args, loader_dir, path, args.samples, num_variants)
+            results.update(bench.run(stages))
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+
+    baselines = history.baselines()
+    print_results(results, baselines)
+    regressions = []
+    if not args.update_baseline:
+        regressions = (scidb_bench.find_regressions(results, baselines, args.threshold, 'throughput') +
+                       scidb_bench.find_regressions(results, baselines, args.memory_threshold, 'max_rss_kb',
+                                                    higher_is_better=False))
+    history.add_run(args.label, results, meta)
+    new_keys = history.set_baselines(results, only_missing=not args.update_baseline)
+    history.save()
+    if new_keys:
+        print 'New baselines: %s.' % ', '.join(new_keys)
+    for r in regressions:
+        print >> sys.stderr, 'REGRESSION: %s %s went from %.6g to %.6g (%.1f%% worse).' % (
+            r.key, r.metric, r.baseline, r.current, r.change * 100)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
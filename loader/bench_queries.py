@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Benchmark the latency of the queries behind the workloads of vcf_toolkit.R.
+
+Every workload is the AFL that the R function of the same purpose sends to SciDB:
+  - signature:  all_instances_of_variant(), the carriers of one variant, by signature.
+  - genes:      all_variants_in_genes(), the variants of a gene list; it needs GENE_36 and
+                VARIANT_GENE_36 (see align_variants_to_genes() in vcf_toolkit.R), and is
+                skipped without them.
+  - freq_pos:   lookup_by_freq_pos(), the carriers of the frequent alternates in a range of
+                positions of one chromosome.
+  - covar:      generate_covar_matrix(), the dense variant by sample matrix of the frequent
+                variants, stored into BENCH_COVAR_MATRIX, which is removed after every run.
+With the partitioned layout, the arrays are the views of kg_layout.view_afl(), and freq_pos
+only reads the partition of its chromosome, as in R. The queries that return cells to R are
+wrapped in op_count() here, so that every cell is computed but none is sent to the client.
+
+Every workload runs --warmup times untimed, then --repeat times timed with
+scidb_afl.time_afl(). Through iquery, the times include the start of iquery, and have the
+resolution of /usr/bin/time, 10 ms; with --shim, they are the wall times of the requests
+to shim, over a kept-alive connection. The results of a workload go under its name in the
+history file: the median as 'seconds', and the mean, standard deviation, minimum, maximum
+and every --percentiles, e.g. 'p90'; 'geomean' holds the geometric mean of the medians of
+all the workloads run, as a single figure for a schema or chunking change. Every result also
+holds the options its query was built with, e.g. --chrom, --start and --end for freq_pos, and
+is only compared with a baseline built with the same ones. With --shim,
+the keys start with 'shim/', so that they have baselines of their own. The first run of a
+key becomes its baseline; later runs fail with exit status 1 when a median grew by more
+than the threshold.
+
+Usage:
+  ./bench_queries.py --repeat 10 --label chunk-10000
+  ./bench_queries.py --queries signature,freq_pos --chrom 22 --start 16000000 --end 17000000
+  ./bench_queries.py --update-baseline --label after-partitioning
+  ./bench_queries.py --shim http://coordinator:8080 --repeat 50
+"""
+
+import argparse
+import sys
+import kg_layout
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_bench
+from scidblib import scidb_math
+from scidblib import scidb_transport
+from scidblib import statistics
+
+COVAR_MATRIX = 'BENCH_COVAR_MATRIX'
+
+def quote(value):
+    """@return value as an AFL string literal."""
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def signature_afl(args, view):
+    variants = "filter(%s, signature = %s)" % (view('KG_VARIANT'), quote(args.signature))
+    carriers = ("cross_join(filter(%s, gt <> '0|0') as G, %s as V, G.variant_id, V.variant_id)"
+                % (view('KG_GENOTYPE'), variants))
+    result = "cross_join(KG_SAMPLE as S, %s as C, S.sample_id, C.sample_id)" % carriers
+    return 'op_count(project(%s, signature, sample_name, gt))' % result
+
+def genes_afl(args, view):
+    condition = ' or '.join('gene_symbol = %s' % quote(g) for g in args.genes.split(','))
+    genes = 'project(filter(GENE_36, %s), gene_symbol, genomic_start, genomic_end)' % condition
+    result = 'cross_join(VARIANT_GENE_36 as VG, %s as GS, VG.gene_id_36, GS.gene_id_36)' % genes
+    result = 'cross_join(%s as V, %s as R, V.variant_id, R.variant_id)' % (view('KG_VARIANT'), result)
+    return 'op_count(project(%s, gene_symbol, signature))' % result
+
+def freq_pos_afl(args, view):
+    chrom = args.chrom
+    positions = ('between(%s, null, %d, null, null, %d, null)'
+                 % (view('KG_VARIANT_POSITION_MASK', chrom), args.start, args.end))
+    positions = ('cross_join(%s as M, filter(KG_CHROMOSOME, chrom = %s) as C, M.chrom_id, C.chrom_id)'
+                 % (positions, quote(chrom)))
+    alternates = ('filter(cross_join(%s as MV, %s as P, MV.variant_id, P.variant_id), af > %g)'
+                  % (view('KG_VARIANT_MULT_VAL', chrom), positions, args.min_freq))
+    alternates = ('apply(redimension(%s, <af:double null> [variant_id=0:*,10000,0, order_nbr=0:*,5,0]), '
+                  'alternate_no, string(order_nbr + 1))' % alternates)
+    alternates = ('project(cross_join(%s as V, %s as A, V.variant_id, A.variant_id), signature, alternate_no)'
+                  % (view('KG_VARIANT', chrom), alternates))
+    carriers = ('filter(cross_join(%s as G, %s as A, G.variant_id, A.variant_id), '
+                'substr(gt, 2, 1) = alternate_no or substr(gt, 0, 1) = alternate_no)'
+                % (view('KG_GENOTYPE', chrom), alternates))
+    return 'op_count(cross_join(KG_SAMPLE as S, %s as C, S.sample_id, C.sample_id))' % carriers
+
+def covar_afl(args, view):
+    selected = ('redimension(cross_join(project(%s, signature) as V, filter(%s, af >= %g) as MV, '
+                'V.variant_id, MV.variant_id), <signature:string> [variant_id=0:*,10000,0])'
+                % (view('KG_VARIANT'), view('KG_VARIANT_MULT_VAL'), args.covar_min_freq))
+    dense = 'uniq(sort(%s))' % selected
+    matrix = ("apply(%s, variant_present, double(iif(gt = '0|0', 0.0, 1.0)))" % view('KG_GENOTYPE'))
+    matrix = 'cross_join(%s as G, %s as SV, G.variant_id, SV.variant_id)' % (matrix, selected)
+    matrix = 'index_lookup(%s, %s, signature, dense_variant_id)' % (matrix, dense)
+    matrix = ('redimension(%s, <variant_present:double null> [dense_variant_id=0:*,10000,0, sample_id=0:*,313,0])'
+              % matrix)
+    return 'store(%s, %s)' % (matrix, COVAR_MATRIX)
+
+class Workload(object):
+    """A named query, the options its AFL depends on, the arrays it needs besides the KG_* ones,
+    and the arrays it leaves behind."""
+    def __init__(self, name, build, params=(), requires=(), leaves=()):
+        self.name = name
+        self.build = build
+        self.params = params
+        self.requires = requires
+        self.leaves = leaves
+
+    def param_values(self, args):
+        """@return a dict mapping the options of the workload to their values in args."""
+        return dict((p, getattr(args, p)) for p in self.params)
+
+WORKLOADS = [Workload('signature', signature_afl, params=('signature',)),
+             Workload('genes', genes_afl, params=('genes',), requires=('GENE_36', 'VARIANT_GENE_36')),
+             Workload('freq_pos', freq_pos_afl, params=('chrom', 'start', 'end', 'min_freq')),
+             Workload('covar', covar_afl, params=('covar_min_freq',), leaves=(COVAR_MATRIX,))]
+
+def make_view(prefixes):
+    """@param prefixes  the partition prefixes in SciDB, as kg_layout.list_partitions() returns them.
+    @return a function of an array name and an optional chromosome, returning the AFL of the array,
+            as vcf_toolkit.R's kg_view() does.
+    """
+    def view(base, chrom=None):
+        if chrom is not None and prefixes:
+            return kg_layout.view_afl(base, [kg_layout.partition_prefix(chrom)])
+        return kg_layout.view_afl(base, prefixes)
+    return view
+
+def remove_arrays(iquery_cmd, names):
+    for name in names:
+        scidb_afl.afl(iquery_cmd, 'remove(%s)' % name, tolerate_error=True)
+
+def run_workload(pool, iquery_cmd, workload, query, warmup, repeat):
+    """Time a workload.
+
+    @return the list of the times of the timed runs, in seconds.
+    @exception AppError if a run fails or times out.
+    """
+    times = []
+    for i in range(warmup + repeat):
+        remove_arrays(iquery_cmd, workload.leaves)
+        seconds = pool.time_afl(iquery_cmd, query).result()
+        if i >= warmup:
+            times.append(seconds)
+    remove_arrays(iquery_cmd, workload.leaves)
+    return times
+
+def percentile(sorted_values, p):
+    """The p-th percentile, interpolated between the two closest ranks.
+
+    @param sorted_values  a non-empty sorted list.
+    @param p              the percentile, between 0 and 100.
+    @return the percentile.
+    """
+    rank = (len(sorted_values) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def summarize(times, percentiles):
+    """@param times  the times of the timed runs of a workload.
+    @return the metrics of the workload, as a dict.
+    """
+    # There are few runs, so the percentiles are exact rather than from a histogram.
+    stats = statistics.RunningStats(times)
+    ordered = sorted(times)
+    metrics = {'seconds': percentile(ordered, 50), 'mean': stats.mean(), 'min': stats.min, 'max': stats.max,
+               'runs': stats.count}
+    metrics['stdev'] = stats.stdev() if stats.count > 1 else 0.0
+    for p in percentiles:
+        metrics['p%g' % p] = percentile(ordered, p)
+    return metrics
+
+def comparable(result, baseline):
+    """@return whether a result may be compared with its baseline: only when the queries were built
+               with the same options, and for the geomean, over the same workloads.
+    """
+    return (bool(baseline.get('seconds')) and result.get('params') == baseline.get('params') and
+            result.get('workloads') == baseline.get('workloads'))
+
+def print_results(results, baselines, percentiles, prefix):
+    columns = ['median', 'mean', 'stdev'] + ['p%g' % p for p in percentiles]
+    print '%-16s %6s' % ('workload', 'runs') + ''.join(' %9s' % c for c in columns) + ' %10s' % 'vs base'
+    for name in [prefix + w.name for w in WORKLOADS] + [prefix + 'geomean']:
+        if name not in results:
+            continue
+        r = results[name]
+        change = ''
+        if name in baselines and comparable(r, baselines[name]):
+            change = '%+.1f%%' % ((r['seconds'] / baselines[name]['seconds'] - 1) * 100)
+        elif name in baselines:
+            change = 'differs'
+        values = [r['seconds']] + [r.get(c) for c in columns[1:]]
+        print '%-16s %6s' % (name, r.get('runs', '')) + ''.join(
+            ' %9.3f' % v if v is not None else ' %9s' % '' for v in values) + ' %10s' % change
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    names = [w.name for w in WORKLOADS]
+    parser = argparse.ArgumentParser(description='Benchmark the latency of the vcf_toolkit.R queries, against stored baselines.')
+    parser.add_argument('-c', '--host', help='Host name to be passed to iquery.')
+    parser.add_argument('-p', '--port', help='Port number to be passed to iquery.')
+    scidb_transport.add_arguments(parser)
+    parser.add_argument('--queries', default=','.join(names),
+                        help='A comma-separated list of the workloads to run, among %s. Default is all of them.' % ', '.join(names))
+    parser.add_argument('--warmup', type=int, default=1, help='The untimed runs of every workload. Default is 1.')
+    parser.add_argument('--repeat', type=int, default=5, help='The timed runs of every workload. Default is 5.')
+    parser.add_argument('--percentiles', default='90,99',
+                        help='A comma-separated list of the percentiles to report, besides the median. Default is 90,99.')
+    parser.add_argument('--timeout', type=float, help='Give up on a workload when one of its runs takes more seconds than this.')
+    parser.add_argument('--signature', default='21:10435894 C>T', help='The variant of the signature workload.')
+    parser.add_argument('--genes', default='MRAP,SOD1', help='The comma-separated gene symbols of the genes workload.')
+    parser.add_argument('--chrom', default='21', help='The chromosome of the freq_pos workload. Default is 21.')
+    parser.add_argument('--start', type=int, default=11000000, help='The first position of the freq_pos workload.')
+    parser.add_argument('--end', type=int, default=12000000, help='The last position of the freq_pos workload.')
+    parser.add_argument('--min-freq', type=float, default=0.9,
+                        help='The allele frequency the freq_pos workload must exceed. Default is 0.9.')
+    parser.add_argument('--covar-min-freq', type=float, default=0.5,
+                        help='The minimum allele frequency of the variants of the covar workload. Default is 0.5.')
+    parser.add_argument('--history', default='query_bench_history.json',
+                        help='The history file. Default is query_bench_history.json.')
+    parser.add_argument('--label', default='', help='A name for this run in the history, e.g. a git revision.')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='The tolerated growth of a median, as a fraction of the baseline. Default is 0.2.')
+    parser.add_argument('--update-baseline', action='store_true', help='Make this run the baseline of every workload it ran.')
+    args = parser.parse_args(argv[1:])
+
+    queries = args.queries.split(',')
+    for name in queries:
+        if name not in names:
+            parser.error('Unknown workload %s; the workloads are %s.' % (name, ', '.join(names)))
+    if args.warmup < 0 or args.repeat < 1:
+        parser.error('--warmup must be at least 0 and --repeat at least 1.')
+    try:
+        percentiles = [float(p) for p in args.percentiles.split(',') if p]
+    except ValueError:
+        parser.error('--percentiles must be a comma-separated list of numbers.')
+    if any(not 0 <= p <= 100 for p in percentiles):
+        parser.error('Every percentile must be between 0 and 100.')
+
+    iquery_cmd = scidb_transport.get_transport(args)
+    results = {}
+    failed = []
+    try:
+        history = scidb_bench.BenchHistory(args.history)
+        arrays = set(scidb_afl.get_array_names(iquery_cmd))
+        prefixes = kg_layout.list_partitions(iquery_cmd)
+        view = make_view(prefixes)
+        with scidb_afl.QueryPool(max_per_coordinator=1, timeout=args.timeout) as pool:
+            for workload in WORKLOADS:
+                if workload.name not in queries:
+                    continue
+                missing = [name for name in workload.requires if name not in arrays]
+                if missing:
+                    print 'Skipping %s: there is no %s.' % (workload.name, ', '.join(missing))
+                    continue
+                try:
+                    times = run_workload(pool, iquery_cmd, workload, workload.build(args, view),
+                                         args.warmup, args.repeat)
+                except scidblib.AppError as e:
+                    print >> sys.stderr, 'The %s workload failed: %s' % (workload.name, e)
+                    failed.append(workload.name)
+                    continue
+                results[workload.name] = summarize(times, percentiles)
+                results[workload.name]['params'] = workload.param_values(args)
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+
+    medians = [r['seconds'] for r in results.values()]
+    if medians:
+        params = {}
+        for r in results.values():
+            params.update(r['params'])
+        # A query faster than the resolution of the timer would zero the product.
+        results['geomean'] = {'seconds': scidb_math.geomean([max(m, 0.001) for m in medians]),
+                              'workloads': sorted(results), 'params': params}
+    # The times through shim leave out the start of iquery: they get baselines of their own.
+    prefix = 'shim/' if args.shim else ''
+    results = dict((prefix + name, r) for name, r in results.items())
+
+    baselines = history.baselines()
+    print_results(results, baselines, percentiles, prefix)
+    regressions = []
+    if not args.update_baseline:
+        checked = dict((k, r) for k, r in results.items() if k in baselines and comparable(r, baselines[k]))
+        regressions = scidb_bench.find_regressions(checked, baselines, args.threshold, 'seconds',
+                                                   higher_is_better=False)
+    history.add_run(args.label, results, {'warmup': args.warmup, 'repeat': args.repeat, 'chrom': args.chrom,
+                                          'start': args.start, 'end': args.end, 'min_freq': args.min_freq,
+                                          'covar_min_freq': args.covar_min_freq, 'signature': args.signature,
+                                          'genes': args.genes, 'partitions': prefixes,
+                                          'transport': str(iquery_cmd).strip()})
+    new_keys = history.set_baselines(results, only_missing=not args.update_baseline)
+    history.save()
+    if new_keys:
+        print 'New baselines: %s.' % ', '.join(new_keys)
+    differing = [k for k in sorted(results) if k in baselines and k not in new_keys and
+                 not comparable(results[k], baselines[k])]
+    if differing:
+        print ('Not compared, as their baselines ran other workloads or options: %s; '
+               'use --update-baseline to replace them.' % ', '.join(differing))
+    for r in regressions:
+        print >> sys.stderr, 'REGRESSION: %s %s went from %.6g to %.6g (%.1f%% worse).' % (
+            r.key, r.metric, r.baseline, r.current, r.change * 100)
+    return 1 if regressions or failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
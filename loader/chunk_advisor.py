@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Recommend chunk lengths for the KG_* arrays from a sample of the input VCF files.
+
+The chunk lengths in kgenomes_schema.afl suit one dataset shape only. This tool reads
+the first records of each input file, measures the number of samples, variants per
+chromosome, genotype density and string widths, and picks chunk lengths so that a
+chunk holds about --target-cells cells and its widest attribute about --target-bytes bytes.
+It writes the arrays of kgenomes_schema.afl, or of --schema, with only their chunk lengths
+replaced. It then estimates the size of the KG_GENOTYPE and KG_VARIANT chunks, per instance
+with --instances, and warns when a redimension into them may need more memory than
+--memory-limit (see scidb_schema.estimate_footprint()).
+
+Examples:
+  ./chunk_advisor.py -o kgenomes_schema.afl ALL.chr21.vcf.gz ALL.chr22.vcf.gz
+  ./chunk_advisor.py --position-ids --print variant_chunk ALL.chr21.vcf.gz   # only the variant_id chunk length
+"""
+
+import argparse
+import os
+import sys
+import kg_layout
+import scidblib
+import vcf_reader
+from scidblib import scidb_ddl
+from scidblib import scidb_math
+from scidblib import scidb_schema
+
+# Keep at least this many variants per KG_GENOTYPE chunk, so that by-variant lookups stay cheap.
+MIN_VARIANTS_PER_CHUNK = 1000
+# The INFO keys that vcfstreamer moves out of the 'misc' attribute.
+EXTRACTED_INFO_KEYS = set(['NS', 'AN', 'AC', 'AF'])
+
+# The schema file whose chunk lengths are replaced, by default.
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kgenomes_schema.afl')
+# The recommend() result that sizes each dimension; the other dimensions, e.g. chrom_id, keep the
+# chunk length of the schema file.
+DIMENSION_CHUNKS = {'variant_id': 'variant_chunk', 'sample_id': 'sample_chunk', 'order_nbr': 'order_chunk',
+                    'pos': 'pos_chunk'}
+# The exceptions to DIMENSION_CHUNKS, by array and dimension; None keeps the chunk length of the schema file.
+ARRAY_DIMENSION_CHUNKS = {('KG_SAMPLE', 'sample_id'): 'sample_array_chunk',
+                          ('KG_VARIANT_ID_SIDE', 'variant_id'): None}
+
+class InputStats:
+    """Statistics gathered from a sample of one or more VCF files.
+
+    Details of public attributes:
+      - num_samples:     the largest number of samples in any file.
+      - variants:        a dict mapping chromosome to its estimated number of variants.
+      - sampled:         a dict mapping chromosome to the number of variants actually read.
+      - pos_range:       a dict mapping chromosome to the (min, max) position seen.
+      - max_alleles:     the largest number of ALT alleles at one site.
+      - nonref_fraction: the fraction of sampled genotypes that are not homozygous reference.
+      - widths:          a dict mapping a field name to its average width in characters.
+    """
+    def __init__(self):
+        self.num_samples = 0
+        self.variants = {}
+        self.sampled = {}
+        self.pos_range = {}
+        self.max_alleles = 1
+        self.nonref_fraction = 0.0
+        self.widths = {}
+        self._width_sums = {}
+        self._width_counts = {}
+        self._gt_total = 0
+        self._gt_nonref = 0
+
+    def add_width(self, field, value):
+        self._width_sums[field] = self._width_sums.get(field, 0) + len(value)
+        self._width_counts[field] = self._width_counts.get(field, 0) + 1
+
+    def finish(self):
+        for field in self._width_sums:
+            self.widths[field] = self._width_sums[field] * 1.0 / self._width_counts[field]
+        if self._gt_total:
+            self.nonref_fraction = self._gt_nonref * 1.0 / self._gt_total
+
+    def total_variants(self):
+        return sum(self.variants.values())
+
+def sample_file(stats, path, max_records, gt_columns):
+    """Accumulate statistics from the first records of one VCF file.
+
+    @param stats        an InputStats to add to.
+    @param path         the VCF file.
+    @param max_records  how many data lines to read.
+    @param gt_columns   how many genotype columns per line to inspect.
+    """
+    f = vcf_reader.open_vcf(path)
+    try:
+        meta, samples = vcf_reader.read_header(f)
+        stats.num_samples = max(stats.num_samples, len(samples))
+        for name in samples:
+            stats.add_width('sample_name', name)
+        counts = {}
+        n = 0
+        for fields in vcf_reader.records(f, max_records):
+            n += 1
+            chrom = fields[vcf_reader.CHROM]
+            pos = long(fields[vcf_reader.POS])
+            counts[chrom] = counts.get(chrom, 0) + 1
+            lo, hi = stats.pos_range.get(chrom, (pos, pos))
+            stats.pos_range[chrom] = (min(lo, pos), max(hi, pos))
+            alts = fields[vcf_reader.ALT]
+            stats.max_alleles = max(stats.max_alleles, alts.count(',') + 1)
+            stats.add_width('signature', vcf_reader.signature(fields))
+            stats.add_width('ref', fields[vcf_reader.REF])
+            stats.add_width('alt', alts)
+            stats.add_width('id', fields[vcf_reader.ID])
+            stats.add_width('filter', fields[vcf_reader.FILTER])
+            stats.add_width('chrom', chrom)
+            info = fields[vcf_reader.INFO]
+            misc = [item for item in info.split(';') if item.partition('=')[0] not in EXTRACTED_INFO_KEYS]
+            stats.add_width('misc', ';'.join(misc) + ';')
+            for gt in fields[vcf_reader.NUM_FIXED_COLUMNS:vcf_reader.NUM_FIXED_COLUMNS + gt_columns]:
+                stats.add_width('gt', gt)
+                stats._gt_total += 1
+                if gt not in ('0|0', '0/0', '0'):
+                    stats._gt_nonref += 1
+        # Extrapolate to the whole file if we stopped early.
+        scale = 1.0
+        if n == max_records:
+            scale = 1.0 / vcf_reader.compressed_fraction_read(f, path)
+        for chrom, count in counts.iteritems():
+            stats.sampled[chrom] = stats.sampled.get(chrom, 0) + count
+            stats.variants[chrom] = stats.variants.get(chrom, 0) + int(count * scale)
+    finally:
+        f.close()
+
+def string_cell_bytes(width):
+    """@return the approximate stored size of a string cell of the given average width."""
+    return int(width) + scidb_schema.STRING_OVERHEAD
+
+def grid(n):
+    """Snap a chunk length to a round decimal number, within 10%.
+
+    @param n  a positive number.
+    @return a positive integer.
+    """
+    return scidb_math.snap_to_grid(max(1, int(n)), 0.1, use_binary=False)
+
+def coarse(n):
+    """Round a chunk length up to one significant decimal digit, e.g. 3140 -> 4000.
+
+    @param n  a positive number.
+    @return a positive integer.
+    """
+    n = max(1, int(n))
+    digits = len(str(n))
+    if digits < 2:
+        return n
+    return scidb_math.round_up(n, digits - 1)
+
+def position_spacing(stats):
+    """@return the average distance between the positions of consecutive variants, per sampled chromosome."""
+    spacing = []
+    for chrom, (lo, hi) in stats.pos_range.iteritems():
+        if stats.sampled.get(chrom, 0) > 1:
+            spacing.append((hi - lo) * 1.0 / stats.sampled[chrom])
+    return spacing
+
+def id_spread(stats):
+    """@return how many position-derived variant ids there are per variant, i.e. 1 / their density along variant_id."""
+    spacing = position_spacing(stats)
+    return max(min(spacing), 1.0) * kg_layout.NUM_SLOTS if spacing else kg_layout.NUM_SLOTS
+
+def recommend(stats, target_cells, target_bytes, density, position_ids=False):
+    """Compute chunk lengths for the KG_* arrays.
+
+    @param stats         an InputStats.
+    @param target_cells  the desired number of cells per chunk.
+    @param target_bytes  the desired size of the widest attribute chunk, in bytes.
+    @param density       the expected fraction of (variant, sample) cells of KG_GENOTYPE that are present.
+    @param position_ids  whether variant ids are position-derived (vcfstreamer -d), i.e. sparse along variant_id.
+    @return a dict mapping the names of DIMENSION_CHUNKS and ARRAY_DIMENSION_CHUNKS (and 'buffer_chunk')
+            to chunk lengths.
+    """
+    width = lambda field: stats.widths.get(field, 1)
+
+    # KG_GENOTYPE drives the variant_id chunk length, which all variant-side arrays must share
+    # for the joins in vcf_toolkit.R to work.
+    gt_cells = min(target_cells, target_bytes // string_cell_bytes(width('gt')))
+    sample_chunk = grid(min(stats.num_samples, max(1, gt_cells // MIN_VARIANTS_PER_CHUNK)))
+    variant_chunk = gt_cells * 1.0 / (sample_chunk * density)
+
+    # The widest KG_VARIANT attribute must fit the byte budget too.
+    widest_variant = max(string_cell_bytes(width(f)) for f in ('signature', 'ref', 'alt', 'id', 'filter', 'misc'))
+    variant_chunk = grid(min(variant_chunk, target_bytes // widest_variant))
+
+    # Make a position chunk cover about as many variants as a variant_id chunk does.
+    spacing = position_spacing(stats)
+    pos_chunk = coarse(variant_chunk * max(spacing)) if spacing else 10000000
+
+    # Position-derived ids spread the variants of one base pair over NUM_SLOTS ids,
+    # so the same number of cells per chunk needs a proportionally longer chunk.
+    variant_id_chunk = variant_chunk
+    if position_ids:
+        variant_id_chunk = coarse(variant_chunk * id_spread(stats)) if spacing else variant_chunk * kg_layout.NUM_SLOTS
+
+    sample_array_chunk = grid(min(target_cells, target_bytes // string_cell_bytes(width('sample_name'))))
+
+    # The 1-D load buffers hold one row per line of the widest stream (the VAR stream's misc).
+    buffer_chunk = grid(min(target_cells, target_bytes // string_cell_bytes(width('misc'))))
+
+    return {'sample_array_chunk': sample_array_chunk,
+            'variant_chunk': variant_id_chunk,
+            'sample_chunk': sample_chunk,
+            'order_chunk': grid(stats.max_alleles),
+            'pos_chunk': pos_chunk,
+            'buffer_chunk': buffer_chunk}
+
+def make_schema(schema_text, chunks):
+    """Replace the chunk lengths of a schema file with recommended ones.
+
+    @param schema_text  an AFL script of create array statements, e.g. kgenomes_schema.afl.
+    @param chunks       the chunk lengths, as recommend() returns them.
+    @return the script, with the attributes, dimension ranges and overlaps of schema_text.
+    @exception AppError on a statement other than create array and remove() (see scidb_ddl.parse_script()).
+    @exception ValueError on a malformed schema.
+    """
+    statements = []
+    for desired in scidb_ddl.parse_script(schema_text):
+        if desired.schema is None:
+            statements.append('remove(%s);\n' % desired.name)
+            continue
+        attrs, dims = scidb_schema.parse(desired.schema)
+        sized = []
+        for dim in dims:
+            key = ARRAY_DIMENSION_CHUNKS.get((desired.name, dim.name), DIMENSION_CHUNKS.get(dim.name))
+            chunk = chunks[key] if key else dim.chunk
+            sized.append(type(dim)(dim.name, dim.lo, dim.hi, chunk, dim.overlap))
+        desired.schema = scidb_schema.unparse(attrs, sized)
+        statements.append(desired.create_statement() + ';\n')
+    return '\n'.join(statements)
+
+def check_schema(schema_text, stats, density, num_instances, memory_limit, max_chunk_bytes, position_ids=False):
+    """Estimate the footprint of the KG_GENOTYPE and KG_VARIANT arrays of a schema file.
+
+    @param schema_text      the text of a schema file like kgenomes_schema.afl.
+    @param stats            an InputStats.
+    @param density          the expected fraction of KG_GENOTYPE cells present.
+    @param num_instances    the number of SciDB instances.
+    @param memory_limit     the memory a query may use per instance, in bytes, or None.
+    @param max_chunk_bytes  the largest acceptable attribute chunk, in bytes, or None.
+    @param position_ids     whether variant ids are position-derived, i.e. sparse along variant_id.
+    @return a list of (array name, Footprint, list of warnings).
+    """
+    schemas = dict((d.name, d.schema) for d in scidb_ddl.parse_script(schema_text) if d.schema)
+    num_variants = stats.total_variants()
+    # Position-derived ids leave most of a variant_id chunk interval empty.
+    variant_density = 1.0 / id_spread(stats) if position_ids else 1.0
+    shapes = [('KG_GENOTYPE', num_variants * stats.num_samples * density, variant_density * density,
+               {'sample_id': stats.num_samples}),
+              ('KG_VARIANT', num_variants, variant_density, {'chrom_id': 1})]
+    results = []
+    for name, num_cells, array_density, extents in shapes:
+        if name not in schemas:
+            continue
+        footprint = scidb_schema.estimate_footprint(schemas[name], int(num_cells), stats.widths, array_density,
+                                                    num_instances, extents)
+        results.append((name, footprint, scidb_schema.check_footprint(footprint, memory_limit, max_chunk_bytes)))
+    return results
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Recommend KG_* chunk lengths from a sample of the input VCF files.')
+    parser.add_argument('files', nargs='+', help='The VCF files that will be loaded (plain or gzipped).')
+    parser.add_argument('-o', '--output', default='-', help='Where to write the schema file. Default is stdout.')
+    parser.add_argument('-s', '--schema', default=SCHEMA_FILE,
+                        help='The schema file whose chunk lengths to replace. Default is kgenomes_schema.afl.')
+    parser.add_argument('-n', '--records', type=int, default=20000, help='Data lines to sample per file. Default is 20000.')
+    parser.add_argument('-g', '--gt-columns', type=int, default=200, help='Genotype columns to sample per line. Default is 200.')
+    parser.add_argument('--target-cells', type=int, default=1000000, help='Desired cells per chunk. Default is 1000000.')
+    parser.add_argument('--target-bytes', type=int, default=64*1024*1024, help='Desired bytes per attribute chunk. Default is 64 MiB.')
+    parser.add_argument('--density', type=float, default=1.0,
+                        help='Expected fraction of KG_GENOTYPE cells present, e.g. lower it when cohorts cover disjoint sites. Default is 1.')
+    parser.add_argument('--position-ids', action='store_true',
+                        help='Size variant_id chunks for the position-derived ids of stream_vcf_1d.sh ID_MODE=position.')
+    parser.add_argument('--instances', type=int, default=1,
+                        help='The number of SciDB instances, to estimate the footprint per instance. Default is 1.')
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help='The memory a query may use per instance, e.g. mem-array-threshold; warn when a '
+                        'redimension may need more.')
+    parser.add_argument('--print', dest='print_chunk', metavar='NAME',
+                        choices=['sample_array_chunk', 'variant_chunk', 'sample_chunk', 'order_chunk', 'pos_chunk',
+                                 'buffer_chunk'],
+                        help='Only print one recommended chunk length, e.g. variant_chunk, rather than the schema.')
+    args = parser.parse_args(argv[1:])
+
+    stats = InputStats()
+    for path in args.files:
+        sample_file(stats, path, args.records, args.gt_columns)
+    stats.finish()
+    if stats.num_samples == 0 or not stats.variants:
+        print >> sys.stderr, 'The input has no samples or no variants; cannot recommend chunk lengths.'
+        return 1
+
+    chunks = recommend(stats, args.target_cells, args.target_bytes, args.density, args.position_ids)
+    if args.print_chunk:
+        print chunks[args.print_chunk]
+        return 0
+
+    print >> sys.stderr, 'Samples: %d; estimated variants: %s in %d chromosome(s); non-reference genotypes: %.1f%%.' % (
+        stats.num_samples, scidb_math.comma_separated_number(stats.total_variants()),
+        len(stats.variants), stats.nonref_fraction * 100)
+    print >> sys.stderr, 'Average widths: ' + ', '.join('%s=%.1f' % (k, v) for k, v in sorted(stats.widths.iteritems()))
+    print >> sys.stderr, 'Chunk lengths: variant_id %d, sample_id %d, pos %d, order_nbr %d.' % (
+        chunks['variant_chunk'], chunks['sample_chunk'], chunks['pos_chunk'], chunks['order_chunk'])
+    print >> sys.stderr, 'For stream_vcf_1d.sh: BUF_CHUNK=%d' % chunks['buffer_chunk']
+
+    try:
+        with open(args.schema) as f:
+            schema = make_schema(f.read(), chunks)
+    except (IOError, ValueError, scidblib.AppError) as e:
+        print >> sys.stderr, 'Cannot read the schema file %s: %s' % (args.schema, e)
+        return 1
+    memory_limit = args.memory_limit * 1048576 if args.memory_limit else None
+    # The chunk lengths are rounded, so an attribute chunk may exceed --target-bytes a little, but not twice.
+    for name, footprint, warnings in check_schema(schema, stats, args.density, args.instances, memory_limit,
+                                                  args.target_bytes * 2, args.position_ids):
+        print >> sys.stderr, ('%s: %s chunks of %s cells and %.1f MB, %.1f MB per instance; '
+                              'a redimension may need %.1f MB per instance.') % (
+            name, scidb_math.comma_separated_number(footprint.num_chunks),
+            scidb_math.comma_separated_number(footprint.cells_per_chunk), footprint.chunk_bytes / 1048576.0,
+            footprint.bytes_per_instance / 1048576.0, footprint.redim_bytes_per_instance / 1048576.0)
+        for warning in warnings:
+            print >> sys.stderr, 'Warning: %s: %s.' % (name, warning)
+    if args.output == '-':
+        sys.stdout.write(schema)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(schema)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Create, remove and trim arrays as declared, with one probe and one iquery script (see scidblib/scidb_ddl.py).
+
+The declarations are create array and remove() statements, read from files or standard input;
+an array declared more than once takes its last declaration.
+
+Examples:
+  - Create the target arrays that do not exist yet:
+      ./ensure_arrays.py kgenomes_schema.afl
+  - Empty the target arrays and drop the partitions (what reset_db.sh does):
+      (cat kgenomes_drop.afl; ./kg_layout.py drop; cat kgenomes_schema.afl) | ./ensure_arrays.py --fresh -
+  - Remove two buffers if they exist, and keep only the latest version of KG_GENOTYPE:
+      ./ensure_arrays.py -r P_KG_VAR_BUF -r P_KG_GT_BUF --trim KG_GENOTYPE
+"""
+
+import argparse
+import sys
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_ddl
+from scidblib import scidb_transport
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Create, remove and trim arrays as declared, in one batch.')
+    parser.add_argument('-c', '--host', help='Host name to be passed to iquery.')
+    parser.add_argument('-p', '--port', help='Port number to be passed to iquery.')
+    scidb_transport.add_arguments(parser)
+    parser.add_argument('--fresh', action='store_true',
+                        help='Remove the declared arrays that exist and create them again, empty. '
+                        'By default, an existing array is kept.')
+    parser.add_argument('-r', '--remove', action='append', default=[], metavar='ARRAY',
+                        help='An array to remove if it exists. May be repeated.')
+    parser.add_argument('--trim', action='append', default=[], metavar='ARRAY',
+                        help='An existing array whose old versions to remove. May be repeated.')
+    parser.add_argument('--keep-versions', type=int, default=1,
+                        help='How many of the latest versions --trim keeps. Default is 1.')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only print the statements that would run.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the statements run.')
+    parser.add_argument('files', nargs='*', help='AFL files of create array and remove() statements; - for standard input.')
+    args = parser.parse_args(argv[1:])
+    if args.keep_versions < 1:
+        parser.error('--keep-versions must be at least 1.')
+
+    try:
+        iquery_cmd = scidb_transport.get_transport(args)
+        desired = []
+        for name in args.files:
+            if name == '-':
+                text = sys.stdin.read()
+            else:
+                with open(name) as f:
+                    text = f.read()
+            desired.extend(scidb_ddl.parse_script(text, args.fresh))
+        desired.extend(scidb_ddl.DesiredArray(name) for name in args.remove)
+        existing = scidb_ddl.probe_arrays(iquery_cmd)
+        declared = dict((array.name, array) for array in desired)
+        for name in args.trim:
+            if name in declared and declared[name].schema is not None:
+                declared[name].keep_versions = args.keep_versions
+            elif name not in declared and name in existing:
+                desired.append(scidb_ddl.DesiredArray(name, existing[name].schema, existing[name].temporary,
+                                                      keep_versions=args.keep_versions))
+        plan = scidb_ddl.plan(existing, desired)
+        statements = plan.removes + plan.creates + plan.trims
+        if args.dry_run or args.verbose:
+            for statement in statements:
+                print statement + ';'
+        for name in plan.mismatched:
+            print >> sys.stderr, 'Warning: %s exists with another schema than declared; kept as is.' % name
+        if not args.dry_run:
+            scidb_afl.afl_script(iquery_cmd, statements)
+    except (scidblib.AppError, IOError) as e:
+        print >> sys.stderr, e
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
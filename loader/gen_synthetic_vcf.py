@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Generate synthetic VCF files shaped like the 1000 Genomes ones, for scale testing.
+
+The output is a deterministic function of the options and the seed. Every site gets
+phased GT calls for all samples; the alternate allele frequencies follow a power-law
+spectrum, like the site frequency spectrum of real populations, so most sites are rare.
+AC, AF, AN and NS are computed from the calls, as vcfstreamer expects.
+
+Examples:
+  - 10x the example file, compressed like the 1000 Genomes files:
+      ./gen_synthetic_vcf.py --variants 200000 -o synth_10x.vcf.gz
+  - A small plain-text file with 5% missing calls and wide INFO columns:
+      ./gen_synthetic_vcf.py --samples 100 --variants 1000 --missing 0.05 --info-width 200 -o small.vcf
+"""
+
+import argparse
+import math
+import random
+import struct
+import sys
+import zlib
+
+BASES = 'ACGT'
+
+class BgzfWriter:
+    """Write a BGZF file: a series of gzip members of at most 64 KiB each, as bgzip and tabix expect.
+
+    Any gzip reader, e.g. zcat or vcf_reader.open_vcf(), reads the result as one stream.
+    """
+    BLOCK_SIZE = 65280  # the uncompressed bytes per block that bgzip uses.
+    EOF_BLOCK = '1f8b08040000000000ff0600424302001b0003000000000000000000'.decode('hex')
+
+    def __init__(self, f, level=6):
+        """
+        @param f      a file object opened for binary writing.
+        @param level  the zlib compression level.
+        """
+        self._f = f
+        self._level = level
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.BLOCK_SIZE:
+            data = ''.join(self._buffer)
+            while len(data) >= self.BLOCK_SIZE:
+                self._write_block(data[:self.BLOCK_SIZE])
+                data = data[self.BLOCK_SIZE:]
+            self._buffer = [data]
+            self._buffered = len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        # 18 bytes of header with the 'BC' extra field holding the block size - 1, then 8 bytes of trailer.
+        bsize = 18 + len(cdata) + 8
+        header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, bsize - 1)
+        trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+        self._f.write(header + cdata + trailer)
+
+    def close(self):
+        data = ''.join(self._buffer)
+        if data:
+            self._write_block(data)
+        self._buffer = []
+        self._buffered = 0
+        self._f.write(self.EOF_BLOCK)
+        self._f.close()
+
+def binomial(rng, n, p):
+    """Draw from Binomial(n, p): by inversion for small means, by the normal approximation otherwise."""
+    mean = n * p
+    if mean < 30:
+        # Poisson approximation, by inversion of its CDF.
+        u = rng.random()
+        k = 0
+        term = math.exp(-mean)
+        cdf = term
+        while u > cdf and k < n:
+            k += 1
+            term *= mean / k
+            cdf += term
+        return k
+    k = int(round(rng.gauss(mean, math.sqrt(mean * (1 - p)))))
+    return max(0, min(n, k))
+
+def allele_frequency(rng, num_haplotypes, alpha):
+    """Draw an alternate allele frequency in [1/num_haplotypes, 0.5] from a density proportional to f^-alpha.
+
+    alpha=1 gives the neutral site frequency spectrum; larger values mean more rare variants.
+    """
+    lo = 1.0 / num_haplotypes
+    hi = 0.5
+    u = rng.random()
+    if abs(alpha - 1.0) < 1e-9:
+        return lo * math.pow(hi / lo, u)
+    e = 1.0 - alpha
+    return math.pow(math.pow(lo, e) + u * (math.pow(hi, e) - math.pow(lo, e)), 1.0 / e)
+
+def random_allele(rng, length, exclude=None):
+    while True:
+        allele = ''.join(rng.choice(BASES) for i in range(length))
+        if allele != exclude:
+            return allele
+
+class SyntheticVcf:
+    """The generator of one synthetic VCF; see the module documentation."""
+    def __init__(self, num_samples=2504, num_variants=20000, chrom='10', start_pos=60000, pos_step=50,
+                 multiallelic=0.03, max_alts=3, alpha=1.0, missing=0.0, indels=0.05, rsids=0.3,
+                 info_width=0, seed=0):
+        """
+        @param num_samples   the number of samples.
+        @param num_variants  the number of data lines.
+        @param chrom         the chromosome of all sites.
+        @param start_pos     the position of the first site.
+        @param pos_step      the mean distance between two sites.
+        @param multiallelic  the fraction of sites with more than one ALT allele.
+        @param max_alts      the maximum number of ALT alleles of a multi-allelic site.
+        @param alpha         the exponent of the allele frequency spectrum.
+        @param missing       the fraction of missing ('.|.') calls.
+        @param indels        the fraction of sites whose REF or ALT is longer than one base.
+        @param rsids         the fraction of sites with an rs ID.
+        @param info_width    the number of filler bytes to add to every INFO column.
+        @param seed          the random seed.
+        """
+        self.num_samples = num_samples
+        self.num_variants = num_variants
+        self.chrom = chrom
+        self.start_pos = start_pos
+        self.pos_step = pos_step
+        self.multiallelic = multiallelic
+        self.max_alts = max_alts
+        self.alpha = alpha
+        self.missing = missing
+        self.indels = indels
+        self.rsids = rsids
+        self.info_width = info_width
+        self.seed = seed
+
+    def header(self):
+        lines = ['##fileformat=VCFv4.1',
+                 '##FILTER=<ID=PASS,Description="All filters passed">',
+                 '##fileDate=20140730',
+                 '##source=gen_synthetic_vcf.py --seed %d' % self.seed,
+                 '##contig=<ID=%s,assembly=b37>' % self.chrom,
+                 '##INFO=<ID=AC,Number=A,Type=Integer,Description="Total number of alternate alleles in called genotypes">',
+                 '##INFO=<ID=AF,Number=A,Type=Float,Description="Estimated allele frequency in the range (0,1]">',
+                 '##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of samples with data">',
+                 '##INFO=<ID=AN,Number=1,Type=Integer,Description="Total number of alleles in called genotypes">']
+        if self.info_width:
+            lines.append('##INFO=<ID=CS,Number=1,Type=String,Description="Synthetic payload">')
+        lines.append('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">')
+        samples = ['HG%05d' % i for i in range(self.num_samples)]
+        lines.append('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT'] + samples))
+        return '\n'.join(lines) + '\n'
+
+    def records(self):
+        """@return a generator of the data lines, each ending with a newline."""
+        rng = random.Random(self.seed)
+        n = self.num_samples
+        num_haplotypes = 2 * n
+        pos = self.start_pos
+        for i in xrange(self.num_variants):
+            pos += 1 + int(rng.expovariate(1.0 / self.pos_step))
+
+            num_alts = 1
+            if rng.random() < self.multiallelic:
+                num_alts = rng.randint(2, max(2, self.max_alts))
+            if rng.random() < self.indels:
+                ref = random_allele(rng, rng.randint(1, 6))
+                alts = [random_allele(rng, rng.randint(1, 6), ref) for a in range(num_alts)]
+            else:
+                ref = rng.choice(BASES)
+                alts = rng.sample([b for b in BASES if b != ref], min(num_alts, 3))
+                num_alts = len(alts)
+
+            # The missing calls, then the carriers of every ALT allele among the other haplotypes.
+            num_missing = binomial(rng, n, self.missing) if self.missing else 0
+            missing = rng.sample(xrange(n), num_missing) if num_missing else []
+            counts = [max(1, binomial(rng, num_haplotypes, allele_frequency(rng, num_haplotypes, self.alpha)))
+                      for a in range(num_alts)]
+            haplotypes = ['0'] * num_haplotypes
+            for s in missing:
+                haplotypes[2 * s] = haplotypes[2 * s + 1] = '.'
+            called = num_haplotypes - 2 * num_missing
+            total = min(sum(counts), called)
+            if total:
+                missing_set = set(missing)
+                candidates = rng.sample(xrange(num_haplotypes), min(num_haplotypes, total + 2 * num_missing))
+                carriers = [h for h in candidates if h / 2 not in missing_set][:total]
+                start = 0
+                for a, count in enumerate(counts):
+                    for h in carriers[start:start + count]:
+                        haplotypes[h] = str(a + 1)
+                    start += count
+                counts = [haplotypes.count(str(a + 1)) for a in range(num_alts)]
+            calls = [haplotypes[2 * s] + '|' + haplotypes[2 * s + 1] for s in xrange(n)]
+
+            info = 'AC=%s;AF=%s;AN=%d;NS=%d' % (
+                ','.join(str(c) for c in counts),
+                ','.join('%g' % (c * 1.0 / called) if called else '0' for c in counts),
+                called, n - num_missing)
+            if self.info_width:
+                info += ';CS=' + ''.join(rng.choice(BASES) for b in range(self.info_width))
+            rsid = 'rs%d' % rng.randint(1, 400000000) if rng.random() < self.rsids else '.'
+            yield '\t'.join([self.chrom, str(pos), rsid, ref, ','.join(alts), '100', 'PASS', info, 'GT']
+                            + calls) + '\n'
+
+    def write(self, out):
+        """Write the whole VCF to a file-like object."""
+        out.write(self.header())
+        for line in self.records():
+            out.write(line)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic 1000 Genomes-shaped VCF file.')
+    parser.add_argument('-o', '--output', help='The output file; a .gz name means BGZF. Default is stdout.')
+    parser.add_argument('-n', '--samples', type=int, default=2504, help='The number of samples. Default is 2504.')
+    parser.add_argument('-v', '--variants', type=int, default=20000, help='The number of variants. Default is 20000.')
+    parser.add_argument('--chrom', default='10', help='The chromosome. Default is 10.')
+    parser.add_argument('--start-pos', type=int, default=60000, help='The position before the first site. Default is 60000.')
+    parser.add_argument('--pos-step', type=float, default=50, help='The mean distance between sites. Default is 50.')
+    parser.add_argument('--multiallelic', type=float, default=0.03, help='The fraction of multi-allelic sites. Default is 0.03.')
+    parser.add_argument('--max-alts', type=int, default=3, help='The maximum number of ALT alleles of a site. Default is 3.')
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help='The exponent of the allele frequency spectrum f^-alpha. Default is 1, the neutral spectrum.')
+    parser.add_argument('--missing', type=float, default=0.0, help='The fraction of missing calls. Default is 0.')
+    parser.add_argument('--indels', type=float, default=0.05, help='The fraction of indel sites. Default is 0.05.')
+    parser.add_argument('--rsids', type=float, default=0.3, help='The fraction of sites with an rs ID. Default is 0.3.')
+    parser.add_argument('--info-width', type=int, default=0, help='Filler bytes to add to every INFO column. Default is 0.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed. Default is 0.')
+    parser.add_argument('--bgzf', action='store_true', help='Write BGZF even if the output name does not end with .gz.')
+    args = parser.parse_args(argv[1:])
+
+    generator = SyntheticVcf(args.samples, args.variants, args.chrom, args.start_pos, args.pos_step,
+                             args.multiallelic, args.max_alts, args.alpha, args.missing, args.indels,
+                             args.rsids, args.info_width, args.seed)
+    out = open(args.output, 'wb') if args.output else sys.stdout
+    if args.bgzf or (args.output and args.output.endswith('.gz')):
+        out = BgzfWriter(out)
+    try:
+        generator.write(out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
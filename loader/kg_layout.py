@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Naming and id ranges of the optional per-chromosome layout of the KG_* arrays.
+
+In the default layout every file is redimensioned into the same KG_VARIANT,
+KG_GENOTYPE, KG_VARIANT_MULT_VAL, KG_VARIANT_ALLELE_STATS and KG_VARIANT_POSITION_MASK
+arrays, so the redims of different files serialize on the array locks. In the
+partitioned layout each chromosome gets its own set of these arrays, e.g.
+KG_CHR21_GENOTYPE, and the variant ids of a chromosome live in their own range
+[code << 40, (code+1) << 40).
+KG_SAMPLE and KG_CHROMOSOME stay shared.
+
+The same ranges hold the position-derived ids that vcfstreamer -d computes:
+  vid = code << 40 | pos << 8 | slot
+where slot is a hash of 'ref>alt'. Range 0 is not a chromosome; its upper part
+[OVERFLOW_BASE, 2 * OVERFLOW_BASE) takes the rare alleles whose position-derived id
+was already taken by another allele, as recorded in KG_VARIANT_ID_SIDE.
+
+The code of a well-known chromosome is fixed (M and MT are the same chromosome, with
+the same partition); any other contig hashes its partition name into a range of
+millions of codes. A hash may still collide: check_partition() refuses to create a
+partition whose code another partition already has, so that the id ranges of the
+partitions are disjoint, and the union of all partitions of an array is a plain
+merge(), which is what view_afl() builds for the queries that span chromosomes.
+
+Usage from the shell:
+  ./kg_layout.py code 21            # prints the chromosome code, 21
+  ./kg_layout.py prefix 21          # prints KG_CHR21_
+  ./kg_layout.py check GL000191.1   # fails if another partition has the code of this one
+  ./kg_layout.py schema 21          # prints the AFL to create the partition arrays
+  ./kg_layout.py drop               # prints the AFL to remove all partition arrays
+  ./kg_layout.py overflow           # prints OVERFLOW_BASE, the first id of the overflow range
+  ./kg_layout.py slots              # prints NUM_SLOTS, the number of ids of one position
+  ./kg_layout.py view KG_VARIANT    # prints the AFL for the union of all partitions
+"""
+
+import argparse
+import re
+import sys
+import scidblib
+from scidblib import scidb_afl
+
+# Number of low bits of a variant id available within one chromosome.
+VARIANT_ID_SHIFT = 40
+# Layout of position-derived ids within a chromosome's range; must agree with vcfstreamer.cpp.
+POSITION_SHIFT = 8
+NUM_SLOTS = 1 << POSITION_SHIFT
+MAX_POSITION = (1 << (VARIANT_ID_SHIFT - POSITION_SHIFT)) - 1
+OVERFLOW_BASE = 1 << 36
+
+# The arrays that get one instance per chromosome.
+PARTITIONED_ARRAYS = ['KG_VARIANT', 'KG_VARIANT_MULT_VAL', 'KG_VARIANT_ALLELE_STATS', 'KG_GENOTYPE',
+                      'KG_VARIANT_POSITION_MASK']
+
+# Well-known chromosome names; anything else gets a code from OTHER_CODE_BASE up.
+CHROM_CODES = dict([(str(i), i) for i in range(1, 23)] + [('X', 23), ('Y', 24), ('MT', 25), ('M', 25)])
+OTHER_CODE_BASE = 26
+# The largest code whose range still fits in a positive int64.
+MAX_CODE = (1 << (63 - VARIANT_ID_SHIFT)) - 1
+
+def _partition_name(chrom):
+    """@return the name of a chromosome in its partition: no 'chr', only letters, digits and '_', upper case, MT for M."""
+    name = chrom[3:] if chrom.lower().startswith('chr') else chrom
+    name = re.sub(r'[^A-Za-z0-9]', '_', name).upper()
+    return 'MT' if name == 'M' else name
+
+def chrom_code(chrom):
+    """Map a chromosome name to a positive integer.
+
+    @param chrom  the chromosome name, with or without a 'chr' prefix.
+    @return 1-22 for autosomes, 23 for X, 24 for Y, 25 for MT and M;
+            other contigs hash their partition name deterministically into [26, MAX_CODE],
+            so that the code of a partition follows from its prefix.
+    """
+    name = _partition_name(chrom)
+    if name in CHROM_CODES:
+        return CHROM_CODES[name]
+    # A stable (not Python-version-dependent) string hash.
+    h = 0
+    for ch in name:
+        h = (h * 31 + ord(ch)) & 0xffffffff
+    return OTHER_CODE_BASE + h % (MAX_CODE - OTHER_CODE_BASE + 1)
+
+def partition_prefix(chrom=None):
+    """@return the array name prefix of a partition, e.g. 'KG_CHR21_', or 'KG_' for the default layout."""
+    if chrom is None:
+        return 'KG_'
+    return 'KG_CHR%s_' % _partition_name(chrom)
+
+def array_name(base, chrom=None):
+    """Get the name of an array in a given partition.
+
+    @param base   the default-layout name, e.g. 'KG_GENOTYPE'.
+    @param chrom  the chromosome, or None for the default layout.
+    @return e.g. 'KG_CHR21_GENOTYPE'; shared arrays keep their name.
+    """
+    if chrom is None or base not in PARTITIONED_ARRAYS:
+        return base
+    return partition_prefix(chrom) + base[len('KG_'):]
+
+def variant_id_base(chrom):
+    """@return the first variant id of a chromosome's partition."""
+    return chrom_code(chrom) << VARIANT_ID_SHIFT
+
+def allele_slot(ref, alt):
+    """The home slot of an allele in a position-derived id: FNV-1a of 'ref>alt', folded to 8 bits.
+
+    @param ref  the REF column.
+    @param alt  the ALT column.
+    @return an integer in [0, NUM_SLOTS).
+    """
+    h = 2166136261
+    for ch in ref + '>' + alt:
+        h = ((h ^ ord(ch)) * 16777619) & 0xffffffff
+    return (h ^ (h >> 8) ^ (h >> 16) ^ (h >> 24)) & (NUM_SLOTS - 1)
+
+def position_variant_id(chrom, pos, slot):
+    """Compose a position-derived variant id, as vcfstreamer -d does.
+
+    @param chrom  the chromosome name.
+    @param pos    the 1-based position.
+    @param slot   the allele slot, usually allele_slot(ref, alt).
+    @return the variant id.
+    @exception ValueError if the position is out of range.
+    """
+    if pos < 0 or pos > MAX_POSITION:
+        raise ValueError('position %d does not fit in a position-derived variant id' % pos)
+    return (chrom_code(chrom) << VARIANT_ID_SHIFT) | (pos << POSITION_SHIFT) | slot
+
+def partition_schema(schema_text, chrom):
+    """Rewrite the create statements of kgenomes_schema.afl for one partition.
+
+    @param schema_text  the content of kgenomes_schema.afl.
+    @param chrom        the chromosome.
+    @return the AFL creating the partitioned arrays of that chromosome.
+    """
+    statements = [s.strip() for s in schema_text.split(';') if s.strip()]
+    result = []
+    for statement in statements:
+        m = re.match(r'create\s+array\s+(\w+)', statement, re.I)
+        if m and m.group(1) in PARTITIONED_ARRAYS:
+            result.append(statement.replace(m.group(1), array_name(m.group(1), chrom), 1) + ';')
+    return '\n\n'.join(result) + '\n'
+
+def list_partitions(iquery_cmd):
+    """Find the chromosomes that have a partition in SciDB.
+
+    @param iquery_cmd  the iquery command.
+    @return a sorted list of partition prefixes, e.g. ['KG_CHR21_', 'KG_CHR22_'].
+    """
+    prefixes = set()
+    for name in scidb_afl.get_array_names(iquery_cmd):
+        m = re.match(r'^(KG_CHR\w+?_)VARIANT$', name)
+        if m:
+            prefixes.add(m.group(1))
+    return sorted(prefixes)
+
+def check_partition(iquery_cmd, chrom):
+    """Make sure that the partition of a chromosome would not share its id range with another partition.
+
+    @param iquery_cmd  the iquery command.
+    @param chrom       the chromosome.
+    @exception AppError if another existing partition has the code of the chromosome.
+    """
+    prefix = partition_prefix(chrom)
+    code = chrom_code(chrom)
+    for other in list_partitions(iquery_cmd):
+        if other != prefix and chrom_code(other[len('KG_CHR'):-1]) == code:
+            raise scidblib.AppError('Chromosome %s has code %d, as the partition %s already has; their variant ids '
+                                    'would overlap. Load it with the default layout.' % (chrom, code, other))
+
+def view_afl(base, prefixes):
+    """Build the AFL for the logical union of an array over a set of partitions.
+
+    @param base      the default-layout name, e.g. 'KG_VARIANT'.
+    @param prefixes  partition prefixes as returned by list_partitions(); empty means the default layout.
+    @return an AFL expression.
+    """
+    if not prefixes or base not in PARTITIONED_ARRAYS:
+        return base
+    names = [p + base[len('KG_'):] for p in prefixes]
+    expr = names[0]
+    for name in names[1:]:
+        expr = 'merge(%s, %s)' % (expr, name)
+    return expr
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Helpers for the per-chromosome layout of the KG_* arrays.')
+    parser.add_argument('-c', '--host', help='Host name to be passed to iquery.')
+    parser.add_argument('-p', '--port', help='Port number to be passed to iquery.')
+    parser.add_argument('--schema-file', default='kgenomes_schema.afl', help='The default-layout schema file.')
+    parser.add_argument('command', choices=['code', 'prefix', 'idbase', 'check', 'schema', 'drop', 'view', 'overflow',
+                                            'slots'])
+    parser.add_argument('arg', nargs='?', help='A chromosome, or an array name for "view".')
+    args = parser.parse_args(argv[1:])
+
+    if args.command in ('code', 'prefix', 'idbase', 'check', 'schema', 'view') and not args.arg:
+        parser.error('%s needs an argument.' % args.command)
+
+    try:
+        if args.command == 'code':
+            print chrom_code(args.arg)
+        elif args.command == 'prefix':
+            print partition_prefix(args.arg)
+        elif args.command == 'idbase':
+            print variant_id_base(args.arg)
+        elif args.command == 'check':
+            check_partition(scidb_afl.get_iquery_cmd(args), args.arg)
+        elif args.command == 'schema':
+            with open(args.schema_file) as f:
+                sys.stdout.write(partition_schema(f.read(), args.arg))
+        elif args.command == 'drop':
+            for prefix in list_partitions(scidb_afl.get_iquery_cmd(args)):
+                for base in PARTITIONED_ARRAYS + ['KG_SIG_INDEX']:
+                    print 'remove(%s%s);' % (prefix, base[len('KG_'):])
+        elif args.command == 'view':
+            print view_afl(args.arg, list_partitions(scidb_afl.get_iquery_cmd(args)))
+        elif args.command == 'overflow':
+            print OVERFLOW_BASE
+        elif args.command == 'slots':
+            print NUM_SLOTS
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
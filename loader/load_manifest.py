@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""A persistent record of the VCF files already ingested, keyed by their content.
+
+Loading the same content again adds no data to the KG_* arrays, but costs a full
+stream and redim. The manifest (a JSON file, load_manifest.json by default) maps the
+fingerprint of every input file to what it contributed: the prefix of its buffers,
+its samples, chromosomes and positions, the variant id range it was redimensioned
+into, and how far it got:
+  - loaded:    stream_vcf_1d.sh filled the ${PREFIX}_KG_*_BUF arrays.
+  - redimmed:  redim_with_prefix.sh moved them into the target arrays.
+
+The fingerprint is by default the SHA-1 of the whole file. A sampled one, the SHA-1 of
+the file size and of a few blocks spread over the file, reads only about 1 MB regardless
+of the file size, but two files that differ elsewhere get the same fingerprint, and the
+second one is then silently skipped; only use it when the inputs are known to differ in
+size or near the sampled blocks. The method is fixed when the manifest is created.
+
+Usage from the shell:
+  ./load_manifest.py stage FILE PREFIX         # prints new, loaded or redimmed
+  ./load_manifest.py loaded FILE PREFIX        # records a finished load
+  ./load_manifest.py prefix-stage PREFIX       # prints the stage of the file loaded as PREFIX
+  ./load_manifest.py redimmed PREFIX [GUIDE]   # records a finished redim
+  ./load_manifest.py show                      # prints the manifest
+  ./load_manifest.py forget FILE               # drops a file from the manifest
+Setting LOAD_MANIFEST=none turns the manifest off: every file is then 'new'.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sys
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_progress
+import vcf_reader
+
+MANIFEST_FILE = os.environ.get('LOAD_MANIFEST', 'load_manifest.json')
+
+# The sampled fingerprint reads NUM_SAMPLED_BLOCKS blocks of SAMPLED_BLOCK_SIZE bytes,
+# evenly spaced and including the first and the last block.
+NUM_SAMPLED_BLOCKS = 16
+SAMPLED_BLOCK_SIZE = 1 << 16
+
+def fingerprint(path, method='sha1'):
+    """Compute the content fingerprint of a file.
+
+    @param path    the file path.
+    @param method  'sha1' to hash the whole file, or 'sampled' to hash its size and a few blocks.
+    @return a string like 'sha1:<hex digest>'.
+    @exception AppError if the method is unknown.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if method == 'sha1':
+            for block in iter(lambda: f.read(1 << 20), ''):
+                h.update(block)
+        elif method == 'sampled':
+            size = os.fstat(f.fileno()).st_size
+            h.update(str(size))
+            last = max(size - SAMPLED_BLOCK_SIZE, 0)
+            for i in range(NUM_SAMPLED_BLOCKS):
+                f.seek(last * i / (NUM_SAMPLED_BLOCKS - 1))
+                h.update(f.read(SAMPLED_BLOCK_SIZE))
+        else:
+            raise scidblib.AppError('Unknown fingerprint method %s.' % method)
+    return method + ':' + h.hexdigest()
+
+def buffers_exist(iquery_cmd, prefix):
+    """@return whether the load buffers of a prefix are in SciDB."""
+    out_data, err_data = scidb_afl.afl(iquery_cmd, 'show(%s_KG_GT_BUF)' % prefix, tolerate_error=True)
+    return len(err_data) == 0
+
+class LoadManifest:
+    """The load manifest.
+
+    Every method reads the file afresh under an exclusive lock, so that the
+    stream and redim scripts of concurrent loads can share one manifest.
+    A manifest whose path is 'none' is always empty and never written.
+    """
+    def __init__(self, path=MANIFEST_FILE, method='sha1'):
+        """
+        @param path    the JSON file; it is created on the first update.
+        @param method  the fingerprint method of a new manifest; an existing one keeps its own.
+        """
+        self._path = path
+        self._method = method
+        self._fingerprints = {}  # a dict mapping (path, size, mtime) to a fingerprint, for this process.
+
+    def enabled(self):
+        return self._path != 'none'
+
+    @contextlib.contextmanager
+    def _locked(self, write):
+        """Yield the manifest content, and write it back if write is true."""
+        with open(self._path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = {'fingerprint': self._method, 'files': {}}
+            if os.path.exists(self._path):
+                with open(self._path) as f:
+                    data = json.load(f)
+            self._method = data['fingerprint']
+            yield data
+            if write:
+                tmp = self._path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(data, f, indent=1, sort_keys=True)
+                os.rename(tmp, self._path)
+
+    def fingerprint(self, path):
+        """@return the fingerprint of a file, using the method of this manifest."""
+        if os.path.exists(self._path):
+            # The rename in _locked() is atomic, so there is no need for the lock here.
+            with open(self._path) as f:
+                self._method = json.load(f)['fingerprint']
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime)
+        if key not in self._fingerprints:
+            self._fingerprints[key] = fingerprint(path, self._method)
+        return self._fingerprints[key]
+
+    def entry(self, path):
+        """@return the manifest entry of a file's content, or None if it was never loaded."""
+        if not self.enabled():
+            return None
+        fp = self.fingerprint(path)
+        with self._locked(write=False) as data:
+            return data['files'].get(fp)
+
+    @staticmethod
+    def _bind_prefix(data, fp, prefix):
+        """Make prefix refer to the entry fp only, or to no entry if fp is None.
+
+        Prefixes such as FILE_1 get reused across runs for different files.
+        """
+        for other_fp, entry in data['files'].iteritems():
+            if other_fp != fp and prefix in entry['prefixes']:
+                entry['prefixes'].remove(prefix)
+        if fp is not None and prefix not in data['files'][fp]['prefixes']:
+            data['files'][fp]['prefixes'].append(prefix)
+
+    def stage(self, path, prefix, has_buffers):
+        """Decide how much of the ingestion of a file can be skipped.
+
+        @param path         the VCF file.
+        @param prefix       the prefix it is about to be loaded as.
+        @param has_buffers  a function telling whether the load buffers of a prefix exist.
+        @return 'redimmed' if the content is already in the target arrays; prefix then refers to it,
+                so that the redim of prefix is skipped too.
+                'loaded' if it was loaded as the same prefix and the buffers are still there,
+                so that only the redim is needed.
+                'new' otherwise.
+        """
+        if not self.enabled():
+            return 'new'
+        fp = self.fingerprint(path)
+        with self._locked(write=True) as data:
+            entry = data['files'].get(fp)
+            if entry is not None and entry['stage'] == 'redimmed':
+                self._bind_prefix(data, fp, prefix)
+                return 'redimmed'
+            if entry is not None and entry['prefix'] == prefix and has_buffers(prefix):
+                return 'loaded'
+            # The prefix is about to be reloaded: until then, it refers to nothing.
+            self._bind_prefix(data, None, prefix)
+            return 'new'
+
+    def prefix_stage(self, prefix):
+        """@return the stage of the file the prefix refers to, or 'new' if none."""
+        if not self.enabled():
+            return 'new'
+        with self._locked(write=False) as data:
+            for entry in data['files'].itervalues():
+                if prefix in entry['prefixes']:
+                    return entry['stage']
+        return 'new'
+
+    def mark_loaded(self, path, prefix, info=None):
+        """Record that a file was loaded into the buffers of a prefix.
+
+        @param path    the VCF file.
+        @param prefix  the prefix of the buffers.
+        @param info    a dict of facts about the content, e.g. from describe_load().
+        """
+        if not self.enabled():
+            return
+        fp = self.fingerprint(path)
+        with self._locked(write=True) as data:
+            entry = data['files'].setdefault(fp, {'paths': [], 'prefixes': []})
+            entry.update(info or {})
+            entry['size'] = os.path.getsize(path)
+            entry['prefix'] = prefix
+            entry['stage'] = 'loaded'
+            entry['loaded_at'] = scidb_progress.datetime_as_str()
+            if path not in entry['paths']:
+                entry['paths'].append(path)
+            self._bind_prefix(data, fp, prefix)
+
+    def mark_redimmed(self, prefix, info=None):
+        """Record that the buffers of a prefix were redimensioned into the target arrays.
+
+        @param prefix  the prefix.
+        @param info    a dict of facts about the redim, e.g. from describe_redim().
+        @return whether a loaded file refers to this prefix.
+        """
+        if not self.enabled():
+            return False
+        with self._locked(write=True) as data:
+            for entry in data['files'].itervalues():
+                if entry['stage'] == 'loaded' and prefix in entry['prefixes']:
+                    entry.update(info or {})
+                    entry['stage'] = 'redimmed'
+                    entry['redimmed_at'] = scidb_progress.datetime_as_str()
+                    return True
+        return False
+
+    def forget(self, path):
+        """Drop a file's content from the manifest, so that it is loaded again.
+
+        @return whether it was in the manifest.
+        """
+        if not self.enabled():
+            return False
+        fp = self.fingerprint(path)
+        with self._locked(write=True) as data:
+            return data['files'].pop(fp, None) is not None
+
+    def dump(self, out):
+        with self._locked(write=False) as data:
+            json.dump(data, out, indent=1, sort_keys=True)
+            out.write('\n')
+
+def describe_load(iquery_cmd, path, prefix):
+    """Collect what a loaded file contributes: its samples, chromosomes and positions.
+
+    @param iquery_cmd  the iquery command.
+    @param path        the VCF file.
+    @param prefix      the prefix of its buffers.
+    @return a dict to pass to LoadManifest.mark_loaded().
+    """
+    f = vcf_reader.open_vcf(path)
+    try:
+        meta, samples = vcf_reader.read_header(f)
+    finally:
+        f.close()
+    count, min_pos, max_pos = scidb_afl.single_cell_afl(
+        iquery_cmd, 'aggregate(%s_KG_VAR_BUF, count(*), min(pos), max(pos))' % prefix, 3)
+    out_data, err_data = scidb_afl.afl(
+        iquery_cmd, 'uniq(sort(project(%s_KG_VAR_BUF, chrom)))' % prefix, want_output=True)
+    chromosomes = [m.group(1) for m in re.finditer(r"^\{\d+\}\s'(.*)'$", out_data, re.M)]
+    info = {'samples': samples, 'num_variants': long(count), 'chromosomes': chromosomes}
+    if min_pos != 'null':
+        info['pos_range'] = [long(min_pos), long(max_pos)]
+    return info
+
+def describe_redim(iquery_cmd, guide_array):
+    """Collect the variant id range a file was redimensioned into.
+
+    @param iquery_cmd   the iquery command.
+    @param guide_array  the VAR_GUIDE_BUF array left behind by redim_with_prefix.sh, e.g. 'KG_CHR21_VAR_GUIDE_BUF'.
+    @return a dict to pass to LoadManifest.mark_redimmed().
+    """
+    min_id, max_id = scidb_afl.single_cell_afl(
+        iquery_cmd, 'aggregate(apply(%s, vid, variant_id), min(vid), max(vid))' % guide_array, 2)
+    info = {'partition': guide_array[:-len('VAR_GUIDE_BUF')]}
+    if min_id != 'null':
+        info['variant_id_range'] = [long(min_id), long(max_id)]
+    return info
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Query and update the manifest of ingested VCF files.')
+    parser.add_argument('-c', '--host', help='Host name to be passed to iquery.')
+    parser.add_argument('-p', '--port', help='Port number to be passed to iquery.')
+    parser.add_argument('-f', '--manifest-file', default=MANIFEST_FILE,
+                        help='The manifest. Default is $LOAD_MANIFEST, or load_manifest.json.')
+    parser.add_argument('--fingerprint', choices=['sampled', 'sha1'], default='sha1',
+                        help='The fingerprint method of a new manifest. Default is sha1; sampled is faster, '
+                        'but may take a different file for one already ingested.')
+    parser.add_argument('command', choices=['fingerprint', 'stage', 'loaded', 'prefix-stage', 'redimmed', 'show', 'forget'])
+    parser.add_argument('args', nargs='*', help='FILE and/or PREFIX, depending on the command.')
+    args = parser.parse_args(argv[1:])
+
+    num_args = {'fingerprint': [1], 'stage': [2], 'loaded': [2], 'prefix-stage': [1],
+                'redimmed': [1, 2], 'show': [0], 'forget': [1]}[args.command]
+    if len(args.args) not in num_args:
+        parser.error('Wrong number of arguments for %s.' % args.command)
+
+    try:
+        iquery_cmd = scidb_afl.get_iquery_cmd(args)
+        manifest = LoadManifest(args.manifest_file, args.fingerprint)
+        if args.command == 'fingerprint':
+            print manifest.fingerprint(args.args[0])
+        elif args.command == 'stage':
+            print manifest.stage(args.args[0], args.args[1], lambda prefix: buffers_exist(iquery_cmd, prefix))
+        elif args.command == 'loaded':
+            info = describe_load(iquery_cmd, args.args[0], args.args[1]) if manifest.enabled() else None
+            manifest.mark_loaded(args.args[0], args.args[1], info)
+        elif args.command == 'prefix-stage':
+            print manifest.prefix_stage(args.args[0])
+        elif args.command == 'redimmed':
+            info = describe_redim(iquery_cmd, args.args[1]) if len(args.args) > 1 and manifest.enabled() else None
+            if not manifest.mark_redimmed(args.args[0], info) and manifest.enabled():
+                print >> sys.stderr, 'No file of the manifest is loaded as %s.' % args.args[0]
+        elif args.command == 'show':
+            manifest.dump(sys.stdout)
+        elif args.command == 'forget':
+            if not manifest.forget(args.args[0]):
+                print >> sys.stderr, '%s is not in the manifest.' % args.args[0]
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,39 +13,24 @@ FILES="example20k.vcf.gz \
 	   example20k.vcf.gz \
 	   example20k.vcf.gz"
 
-echo "Launching the lost children..."
-N=1
-for FILE in $FILES; do
-    PREFIX="FILE_${N}"	
-	N=$((N+1))
-    time ./stream_vcf_1d.sh $FILE $PREFIX > ${PREFIX}_child_stream.log 2>&1 &
-done
-
-echo "Waiting..."
-FAILURES=0
-for job in `jobs -p`
-do
-	wait $job || let "FAILURES+=1"
-done
-
-if [ "$FAILURES" == "0" ];
-    then
-		echo "Loads succeeded"
-	else
-		echo "Some of the children failed"
-		exit 1
+#Set PARTITIONED=1 to redim each file into its own chromosome's KG_CHR<n>_* arrays (see kg_layout.py).
+#Every file must then hold a single chromosome, and the redims run in parallel.
+PARTITIONED=${PARTITIONED:-0}
+
+#load_scheduler.py runs the loads under limits on cores, memory and in-flight SciDB loads,
+#and redims every file as soon as its load is done. Extra arguments are passed on, e.g. --max-loads 2
+if [ "$PARTITIONED" == "1" ]; then
+	SCHEDULER_ARGS="--partitioned"
+else
+	SCHEDULER_ARGS="--restart $DBNAME"
 fi
 
-rm -rf redim.log
-N=1
-for FILE in $FILES; do
-	PREFIX="FILE_${N}"
-    N=$((N+1))
-	echo "Redimming $PREFIX"
-    time ./redim_with_prefix.sh $PREFIX >> redim.log 2>&1
-	scidb.py stopall $DBNAME > /dev/null
-	scidb.py startall $DBNAME > /dev/null
-done
-
-
+#The example loads the same file 6 times on purpose, as a benchmark: the load manifest would skip the 5 copies.
+#Remove --no-load-manifest for real inputs, so that a rerun skips the files already ingested.
+SCHEDULER_ARGS="$SCHEDULER_ARGS --no-load-manifest"
 
+rm -rf redim.log
+time ./load_scheduler.py $SCHEDULER_ARGS "$@" $FILES
+STATUS=$?
+cat FILE_*_redim.log >> redim.log 2> /dev/null
+exit $STATUS
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Load a set of VCF files into the KG_* arrays under resource limits.
+
+Every file goes through two phases:
+  - load:  stream_vcf_1d.sh parses the file and loads the ${PREFIX}_KG_*_BUF arrays.
+           One load runs zcat, vcfstreamer and three loaders, i.e. several cores
+           and four concurrent SciDB queries.
+  - redim: redim_with_prefix.sh moves the buffers into the target arrays.
+
+Loads are admitted largest file first, as long as the cores, memory and number
+of in-flight SciDB loads stay within the limits. A file's redim is queued as soon
+as its own load is done, so redims overlap with the loads of the other files.
+In the default layout redims run one at a time, since they write the same arrays;
+with --partitioned the redims of different chromosomes run in parallel.
+
+The manifest has one file per line, optionally followed by the prefix to use:
+  # path                  [prefix]
+  chr21.vcf.gz            CHR21
+  chr22.vcf.gz
+Files without a prefix get FILE_<n>, n being the line number among the files.
+
+Files whose content is already in the load manifest (see load_manifest.py) are
+skipped, or only redimensioned if their buffers are still loaded; so are files
+with the same content as an earlier file of the batch.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_profile
+from scidblib import scidb_progress
+from scidblib import scidb_trace
+import load_manifest
+import vcf_reader
+
+# The default resource needs of one load.
+LOAD_CORES = 3
+LOAD_MEMORY_MB = 1024
+
+class FileJob:
+    """The load and redim of one input file.
+
+    Details of public attributes:
+      - path:   the VCF file.
+      - prefix: the prefix of its buffer arrays.
+      - size:   the file size in bytes.
+      - chrom:  the chromosome of the file, only set in partitioned mode.
+      - state:  'queued', 'loading', 'loaded', 'redimming', 'done' or 'failed'.
+    """
+    def __init__(self, path, prefix):
+        self.path = path
+        self.prefix = prefix
+        self.size = os.path.getsize(path)
+        self.chrom = None
+        self.state = 'queued'
+        self.proc = None
+        self.start_time = None
+
+def read_manifest(manifest_file):
+    """Read a manifest of input files.
+
+    @param manifest_file  the path of the manifest.
+    @return a list of (path, prefix) pairs; prefix is None when not given.
+    @exception AppError if a line has more than two fields.
+    """
+    entries = []
+    with open(manifest_file) as f:
+        for line_nbr, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) > 2:
+                raise scidblib.AppError('%s:%d: expected "path [prefix]".' % (manifest_file, line_nbr))
+            entries.append((fields[0], fields[1] if len(fields) > 1 else None))
+    return entries
+
+def make_jobs(entries):
+    """Create the jobs of a list of manifest entries, assigning the default prefixes.
+
+    @param entries  (path, prefix) pairs as returned by read_manifest().
+    @return a list of FileJob objects, in manifest order.
+    @exception AppError if a file does not exist or two files share a prefix.
+    """
+    jobs = []
+    prefixes = set()
+    for n, (path, prefix) in enumerate(entries, 1):
+        if not os.path.isfile(path):
+            raise scidblib.AppError('Cannot find input file %s.' % path)
+        if prefix is None:
+            prefix = 'FILE_%d' % n
+        if prefix in prefixes:
+            raise scidblib.AppError('Prefix %s is used by more than one file.' % prefix)
+        prefixes.add(prefix)
+        jobs.append(FileJob(path, prefix))
+    return jobs
+
+def first_chromosome(path):
+    """@return the CHROM column of the first record of a VCF file, or None if it has no records."""
+    f = vcf_reader.open_vcf(path)
+    try:
+        vcf_reader.read_header(f)
+        for fields in vcf_reader.records(f, limit=1):
+            return fields[vcf_reader.CHROM]
+    finally:
+        f.close()
+    return None
+
+def available_memory_mb():
+    """@return the MemAvailable of /proc/meminfo in MB, or None if unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except IOError:
+        pass
+    return None
+
+class LoadScheduler:
+    """Run the load and redim phases of a set of files under resource limits.
+
+    A typical usage pattern is:
+      - Create the jobs with make_jobs().
+      - scheduler = LoadScheduler(jobs, cores=16, memory_mb=32768, max_loads=4)
+      - num_failures = scheduler.run()
+    """
+    def __init__(self, jobs, cores, memory_mb=None, max_loads=None,
+                 load_cores=LOAD_CORES, load_memory_mb=LOAD_MEMORY_MB,
+                 partitioned=False, max_redims=None, restart_db=None,
+                 manifest=None, iquery_cmd=None, poll_interval=1.0, out=sys.stdout):
+        """
+        @param jobs            the FileJob objects.
+        @param cores           the number of cores the loads may use together.
+        @param memory_mb       the memory the loads may use together; None means unlimited.
+        @param max_loads       the maximum number of in-flight loads; None means unlimited.
+        @param load_cores      the cores one load is assumed to use.
+        @param load_memory_mb  the memory one load is assumed to use.
+        @param partitioned     whether to redim into per-chromosome arrays (see kg_layout.py).
+        @param max_redims      the maximum number of concurrent redims in partitioned mode.
+                               Default is one per chromosome. In the default layout it is always 1.
+        @param restart_db      the name of a SciDB database to restart after redims, at the first moment
+                               no load or redim is running; None means no restart. Loads and redims are
+                               not held back for it, so the redims done meanwhile share one restart.
+        @param manifest        a LoadManifest to skip the content already ingested; None means no skipping.
+        @param iquery_cmd      the iquery command, to check whether the buffers of a loaded file still exist.
+        @param poll_interval   seconds between two checks of the running jobs.
+        @param out             where to print the progress messages to.
+        """
+        # Largest first: the big files dominate the makespan, the small ones fill the gaps.
+        self._jobs = sorted(jobs, key=lambda job: job.size, reverse=True)
+        self._cores = cores
+        self._memory_mb = memory_mb
+        self._max_loads = max_loads
+        self._load_cores = load_cores
+        self._load_memory_mb = load_memory_mb
+        self._partitioned = partitioned
+        self._max_redims = (max_redims or len(jobs)) if partitioned else 1
+        self._restart_db = restart_db
+        self._manifest = manifest
+        self._iquery_cmd = iquery_cmd
+        self._poll_interval = poll_interval
+        self._out = out
+        self._redim_queue = []   # jobs whose load is done, in load completion order.
+        self._restart_pending = False
+
+    def _log(self, message):
+        print >> self._out, '[%s] %s' % (scidb_progress.datetime_as_str(), message)
+        self._out.flush()
+
+    def _in_state(self, state):
+        return [job for job in self._jobs if job.state == state]
+
+    def can_start_load(self):
+        """Whether the limits allow one more load now.
+
+        A load that alone exceeds the limits is still admitted when nothing else is loading,
+        so that a small machine makes progress on large files.
+        """
+        num_loading = len(self._in_state('loading'))
+        if num_loading == 0:
+            return True
+        if self._max_loads is not None and num_loading >= self._max_loads:
+            return False
+        if (num_loading + 1) * self._load_cores > self._cores:
+            return False
+        if self._memory_mb is not None and (num_loading + 1) * self._load_memory_mb > self._memory_mb:
+            return False
+        return True
+
+    def can_start_redim(self, job):
+        """Whether a job whose load is done may be redimensioned now."""
+        redimming = self._in_state('redimming')
+        if len(redimming) >= self._max_redims:
+            return False
+        # Two redims into the same partition would only wait for each other's array locks.
+        return not any(other.chrom == job.chrom for other in redimming)
+
+    def _start(self, job, state, cmd, log_suffix):
+        job.state = state
+        job.start_time = time.time()
+        log = open('%s_%s.log' % (job.prefix, log_suffix), 'w')
+        try:
+            job.proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            log.close()
+        scidb_trace.begin_child(job.proc, '%s %s' % (state, job.prefix), 'job', cmd=' '.join(cmd),
+                                path=job.path, chrom=job.chrom, bytes=job.size)
+
+    def _start_load(self, job):
+        self._log('Loading %s (%d bytes) as %s' % (job.path, job.size, job.prefix))
+        self._start(job, 'loading', ['./stream_vcf_1d.sh', job.path, job.prefix], 'child_stream')
+
+    def _start_redim(self, job):
+        cmd = ['./redim_with_prefix.sh', job.prefix]
+        if self._partitioned:
+            cmd.append(job.chrom)
+            self._log('Redimming %s into the partition of chromosome %s' % (job.prefix, job.chrom))
+        else:
+            self._log('Redimming %s' % job.prefix)
+        self._start(job, 'redimming', cmd, 'redim')
+
+    def _restart(self):
+        self._log('Restarting %s' % self._restart_db)
+        with open(os.devnull, 'w') as devnull:
+            for command in ('stopall', 'startall'):
+                if subprocess.call(['scidb.py', command, self._restart_db], stdout=devnull) != 0:
+                    raise scidblib.AppError('scidb.py %s %s failed.' % (command, self._restart_db))
+        self._restart_pending = False
+
+    def _skip_ingested(self):
+        """Mark the jobs whose content is already ingested as done, and queue the redims of those already loaded."""
+        first_job = {}  # a dict mapping a fingerprint to the first job with that content.
+        has_buffers = lambda prefix: load_manifest.buffers_exist(self._iquery_cmd, prefix)
+        for job in self._jobs:
+            fp = self._manifest.fingerprint(job.path)
+            if fp in first_job:
+                self._log('%s (%s) has the same content as %s; skipping it' % (job.prefix, job.path, first_job[fp].prefix))
+                job.state = 'done'
+                continue
+            first_job[fp] = job
+            stage = self._manifest.stage(job.path, job.prefix, has_buffers)
+            if stage == 'redimmed':
+                self._log('%s is already ingested; skipping it' % job.path)
+                job.state = 'done'
+            elif stage == 'loaded':
+                self._log('%s is already loaded as %s; only redimming it' % (job.path, job.prefix))
+                job.state = 'loaded'
+                self._redim_queue.append(job)
+
+    def _reap(self):
+        """Collect the jobs whose process has exited, and advance them to their next state."""
+        for job in self._jobs:
+            if job.state not in ('loading', 'redimming') or scidb_profile.poll(job.proc, '%s %s' % (job.state, job.prefix)) is None:
+                continue
+            scidb_trace.end_child(job.proc)
+            code = job.proc.returncode
+            elapsed = time.time() - job.start_time
+            phase = 'Load' if job.state == 'loading' else 'Redim'
+            job.proc = None
+            if code != 0:
+                self._log('%s of %s failed with exit code %d after %.1f seconds' % (phase, job.prefix, code, elapsed))
+                job.state = 'failed'
+            elif job.state == 'loading':
+                self._log('Load of %s done in %.1f seconds' % (job.prefix, elapsed))
+                job.state = 'loaded'
+                self._redim_queue.append(job)
+            else:
+                self._log('Redim of %s done in %.1f seconds' % (job.prefix, elapsed))
+                job.state = 'done'
+                if self._restart_db:
+                    self._restart_pending = True
+
+    def run(self):
+        """Run all jobs to completion.
+
+        @return the number of files that failed to load or redim.
+        """
+        if self._manifest is not None and self._manifest.enabled():
+            self._skip_ingested()
+
+        if self._partitioned:
+            for job in self._jobs:
+                if job.state == 'done':
+                    continue
+                job.chrom = first_chromosome(job.path)
+                if job.chrom is None:
+                    raise scidblib.AppError('%s has no variants; cannot pick its partition.' % job.path)
+
+        while True:
+            self._reap()
+
+            if self._restart_pending and not self._in_state('loading') and not self._in_state('redimming'):
+                self._restart()
+
+            for job in list(self._redim_queue):
+                if self.can_start_redim(job):
+                    self._redim_queue.remove(job)
+                    self._start_redim(job)
+
+            for job in self._in_state('queued'):
+                if not self.can_start_load():
+                    break
+                self._start_load(job)
+
+            if not [job for job in self._jobs if job.state not in ('done', 'failed')]:
+                break
+            time.sleep(self._poll_interval)
+
+        failures = self._in_state('failed')
+        if failures:
+            self._log('Failed: %s' % ', '.join(job.prefix for job in failures))
+        else:
+            self._log('All %d files ingested' % len(self._jobs))
+        return len(failures)
+
+def default_cores():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Load VCF files into the KG_* arrays under resource limits.')
+    parser.add_argument('-m', '--manifest', help='A file listing the input files, one "path [prefix]" per line.')
+    parser.add_argument('--cores', type=int, default=default_cores(),
+                        help='The cores the loads may use together. Default is the number of cores of this machine.')
+    parser.add_argument('--memory', type=int, metavar='MB',
+                        help='The memory the loads may use together. Default is 80%% of the available memory.')
+    parser.add_argument('--max-loads', type=int, default=4,
+                        help='The maximum number of in-flight SciDB loads. Each one runs four queries. Default is 4.')
+    parser.add_argument('--load-cores', type=int, default=LOAD_CORES,
+                        help='The cores one load uses. Default is %d.' % LOAD_CORES)
+    parser.add_argument('--load-memory', type=int, metavar='MB', default=LOAD_MEMORY_MB,
+                        help='The memory one load uses. Default is %d.' % LOAD_MEMORY_MB)
+    parser.add_argument('--partitioned', action='store_true',
+                        help='Redim every file into its chromosome\'s KG_CHR<n>_* arrays, in parallel.')
+    parser.add_argument('--max-redims', type=int, help='The maximum number of concurrent redims with --partitioned.')
+    parser.add_argument('--restart', metavar='DBNAME',
+                        help='Restart this SciDB database after redims, whenever no load or redim is running.')
+    parser.add_argument('--load-manifest', default=load_manifest.MANIFEST_FILE,
+                        help='The load manifest. Default is $LOAD_MANIFEST, or load_manifest.json.')
+    parser.add_argument('--no-load-manifest', action='store_true',
+                        help='Load every file, even if its content was ingested before.')
+    parser.add_argument('-c', '--host', help='Host name to be passed to iquery.')
+    parser.add_argument('-p', '--port', help='Port number to be passed to iquery.')
+    parser.add_argument('files', nargs='*', help='Input files, in addition to those of the manifest.')
+    args = parser.parse_args(argv[1:])
+
+    memory_mb = args.memory
+    if memory_mb is None:
+        available = available_memory_mb()
+        if available is not None:
+            memory_mb = available * 8 / 10
+
+    # stream_vcf_1d.sh and redim_with_prefix.sh consult the same manifest, and query the same coordinator.
+    os.environ['LOAD_MANIFEST'] = 'none' if args.no_load_manifest else os.path.abspath(args.load_manifest)
+    if args.host:
+        os.environ['SCIDB_HOST'] = args.host
+    if args.port:
+        os.environ['SCIDB_PORT'] = args.port
+
+    try:
+        entries = read_manifest(args.manifest) if args.manifest else []
+        entries.extend((path, None) for path in args.files)
+        if not entries:
+            parser.error('No input files.')
+        scheduler = LoadScheduler(make_jobs(entries), args.cores, memory_mb, args.max_loads,
+                                  load_cores=args.load_cores, load_memory_mb=args.load_memory,
+                                  partitioned=args.partitioned, max_redims=args.max_redims,
+                                  restart_db=args.restart,
+                                  manifest=load_manifest.LoadManifest(os.environ['LOAD_MANIFEST']),
+                                  iquery_cmd=scidb_afl.get_iquery_cmd(args))
+        if scheduler.run():
+            return 1
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(scidb_profile.run(main, 'load_scheduler'))
@@ -32,6 +32,7 @@ import signal
 import os
 import re
 import shutil
+import stat
 import sys
 import tempfile
 import time
@@ -39,11 +40,15 @@ import traceback
 import socket
 import select
 
+from scidblib import scidb_profile
 from scidblib import scidb_schema
+from scidblib import scidb_trace
 
 ####################
 # Module Variables #
 ####################
+RETRY_DELAY = 1    # seconds before the first retry of a failed instance task; doubled for every next retry.
+SSH_FAILURE = 255
 opts = None
 inputFile = sys.stdin
 childProcesses = []
@@ -132,6 +137,26 @@ def getHostAddresses():
         addresses.append(socket.gethostname())
     return addresses
 
+#################
+# Child process #
+#################
+def addChild(p, label, **traceArgs):
+    """Keep track of a child process, for the cleanup, the profile and the trace."""
+    childProcesses.append(p)
+    scidb_profile.name_child(p, label)
+    scidb_trace.begin_child(p, label, **traceArgs)
+
+def waitChild(p, **traceArgs):
+    retCode = scidb_profile.wait(p)
+    scidb_trace.end_child(p, **traceArgs)
+    return retCode
+
+def pollChild(p):
+    retCode = scidb_profile.poll(p)
+    if retCode is not None:
+        scidb_trace.end_child(p)
+    return retCode
+
 ###############
 # showVersion #
 ###############
@@ -139,8 +164,8 @@ def showVersion():
     if opts.show_version:
         cmd = sciDbBinFolder + "scidb --version"
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-        childProcesses.append(p)
-        retVal = p.wait()
+        addChild(p, 'showVersion', cmd=cmd)
+        retVal = waitChild(p)
         if retVal != 0:
             err = "Failed to obtain SciDB version information."
             if p and p.stderr:
@@ -162,8 +187,8 @@ def getLoadSchema():
             sciDbBinFolder, opts.db_address, opts.db_port, opts.load_name)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE,stderr=subprocess.PIPE,
                              shell=True, close_fds=True, preexec_fn=os.setsid)
-        childProcesses.append(p)
-        retVal = p.wait()
+        addChild(p, 'getLoadSchema', cmd=cmd)
+        retVal = waitChild(p)
         if retVal != 0:
             err = "Failed to obtain schema for load array."
             if p and p.stderr:
@@ -238,6 +263,51 @@ def getSshCommand(username, keyfile, host, port, bypass_key_check, command):
         sshCommand += " %s" % command
     return sshCommand.replace("\\", "\\\\").replace("\"", "\\\"")
 
+##################
+# Instance tasks #
+##################
+# A task is a command to run for one instance, on the host of that instance, which may be
+# retried on its own when it fails.
+def newInstanceTask(instance, label, cmd, inputPath=None):
+    if instance["name"] not in hostAddresses:
+        cmd = getSshCommand(opts.ssh_username, opts.ssh_keyfile, instance["name"], opts.ssh_port, opts.ssh_bypass_key_check, cmd)
+    task = {"cmd": cmd, "label": label, "instance": instance, "attempt": 0, "stderr": subprocess.PIPE}
+    if inputPath:
+        # The input is read on this host, and piped to the command.
+        task["cmd"] = "cat \"%s\" | %s" % (inputPath, cmd)
+        task["csv_fragment"] = inputPath
+    return task
+
+def startTask(task):
+    logVerbose(task["cmd"])
+    p = subprocess.Popen(task["cmd"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=task["stderr"],
+                         shell=True, close_fds=True, preexec_fn=os.setsid)
+    instance = task["instance"]
+    inputBytes = None
+    if "csv_fragment" in task and opts.use_csv_files:
+        inputBytes = os.path.getsize(task["csv_fragment"])
+    addChild(p, task["label"], cmd=task["cmd"], host=instance["name"], instance=instance["instance_id"],
+             attempt=task["attempt"], bytes=inputBytes)
+    task["process"] = p
+
+def waitTask(task, retryable):
+    """Wait for a task; while retryable(exit status) says so, run it again, at most opts.retries times."""
+    while True:
+        retCode = waitChild(task["process"])
+        if retCode == 0 or task["attempt"] >= opts.retries or not retryable(retCode):
+            return retCode
+        task["attempt"] += 1
+        delay = RETRY_DELAY * 2 ** (task["attempt"] - 1)
+        logNormal("%s failed for instance %s on %s with exit status %d; retry %d of %d in %d second(s)." % (
+            task["label"], task["instance"]["instance_id"], task["instance"]["name"], retCode,
+            task["attempt"], opts.retries, delay))
+        time.sleep(delay)
+        startTask(task)
+
+def isSshFailure(retCode):
+    # ssh exits with 255 for its own errors, e.g. a connection that failed or dropped.
+    return retCode == SSH_FAILURE
+
 #############
 # logNormal #
 #############
@@ -272,8 +342,8 @@ def getInstances():
     cmd = "\"%siquery\" -c %s -p %d -o csv -aq \"list('instances')\"" % (sciDbBinFolder, opts.db_address, opts.db_port)
     logVerbose(cmd)
     p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-    childProcesses.append(p)
-    retVal = p.wait()
+    addChild(p, 'getInstances', cmd=cmd)
+    retVal = waitChild(p)
     if retVal != 0:
         err = "Failed to obtain SciDB configuration information."
         if p and p.stderr:
@@ -301,22 +371,16 @@ def removeDlfFragments(raiseExceptions=True):
         # Start a process to remove the specified DLF fragment file/FIFO on each instance.
         tasks = []
         for instance in instances:
-            cmd = "rm -f \"%s\"" % instance["dlf_fragment"]
-            if instance["name"] in hostAddresses:
-                logVerbose(cmd)
-                p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-            else:
-                sshCmd = getSshCommand(opts.ssh_username, opts.ssh_keyfile, instance["name"], opts.ssh_port, opts.ssh_bypass_key_check, cmd)
-                logVerbose(sshCmd)
-                p = subprocess.Popen(sshCmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-            childProcesses.append(p)
-            tasks.append({"process": p, "dlf_fragment": instance["dlf_fragment"]})
+            task = newInstanceTask(instance, 'removeDlfFragments', "rm -f \"%s\"" % instance["dlf_fragment"])
+            task["dlf_fragment"] = instance["dlf_fragment"]
+            startTask(task)
+            tasks.append(task)
 
         # Wait for all of the processes to finish.
         for task in tasks:
-            p = task["process"]
-            retCode = p.wait()
+            retCode = waitTask(task, isSshFailure)
             if retCode != 0:
+                p = task["process"]
                 err = "Failed to remove DLF fragment: \"%s\"." % task["dlf_fragment"]
                 if p and p.stderr:
                     err = "%s\n%s" % (err, p.stderr.read())
@@ -332,22 +396,18 @@ def createDlfFragments():
         logNormal("Creating DLF fragment FIFOs.")
         tasks = []
         for instance in instances:
-            cmd = "mkfifo \"%s\"" % instance["dlf_fragment"]
-            if instance["name"] in hostAddresses:
-                logVerbose(cmd)
-                p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-            else:
-                sshCmd = getSshCommand(opts.ssh_username, opts.ssh_keyfile, instance["name"], opts.ssh_port, opts.ssh_bypass_key_check, cmd)
-                logVerbose(sshCmd)
-                p = subprocess.Popen(sshCmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-            childProcesses.append(p)
-            tasks.append({"process": p, "dlf_fragment": instance["dlf_fragment"]})
+            # A retry after an ssh failure may find the FIFO the first attempt created.
+            task = newInstanceTask(instance, 'createDlfFragments',
+                                   "test -p \"%s\" || mkfifo \"%s\"" % (instance["dlf_fragment"], instance["dlf_fragment"]))
+            task["dlf_fragment"] = instance["dlf_fragment"]
+            startTask(task)
+            tasks.append(task)
 
         # Wait for all of the processes to finish.
         for task in tasks:
-            p = task["process"]
-            retCode = p.wait()
+            retCode = waitTask(task, isSshFailure)
             if retCode != 0:
+                p = task["process"]
                 err = "Failed to create DLF fragment: \"%s\"." % task["dlf_fragment"]
                 if p and p.stderr:
                     err = "%s\n%s" % (err, p.stderr.read())
@@ -381,6 +441,16 @@ def createCsvFragments():
             os.mkfifo(instance["csv_fragment"])
             logVerbose("\"%s\" created." % instance["csv_fragment"])
 
+##############
+# inputBytes #
+##############
+def inputBytes():
+    """Return the size of the input, or None if it is a pipe."""
+    if isinstance(inputFile, pyStringIO.StringIO):
+        return len(inputFile.getvalue())
+    st = os.fstat(inputFile.fileno())
+    return st.st_size if stat.S_ISREG(st.st_mode) else None
+
 #########
 # split #
 #########
@@ -410,7 +480,7 @@ def split():
     p = subprocess.Popen(cmd, stdin=stdin, stdout=devNull,
                          stderr=sys.stderr, close_fds=True,
                          preexec_fn=os.setsid)
-    childProcesses.append(p)
+    addChild(p, 'split', cmd=' '.join(cmd), bytes=inputBytes())
 
     # If we made a new pipe, we need to feed it!  (Since stdout above
     # is /dev/null we need not worry about deadlocks.)
@@ -424,7 +494,7 @@ def split():
 
     # If we are using files, wait until the split is complete.
     if opts.use_csv_files:
-        retCode = p.wait()
+        retCode = waitChild(p)
         if retCode != 0:
             err = "Failed to split input CSV file."
             raise Exception(err)
@@ -451,24 +521,19 @@ def distributeAndConvert():
         cmd = "%s -c %d -f %d -n %d -d \"%s\" -o \"%s\"" % (
             cmd, opts.chunk_size, startingCoordinate, len(instances),
             local_delim, instance["dlf_fragment"])
-        if instance["name"] in hostAddresses:
-            pipedCmd = "cat \"%s\" | %s" % (instance["csv_fragment"], cmd)
-        else:
-            sshCmd = getSshCommand(opts.ssh_username, opts.ssh_keyfile,
-                                   instance["name"], opts.ssh_port, opts.ssh_bypass_key_check, cmd)
-            pipedCmd = "cat \"%s\" | %s" % (instance["csv_fragment"], sshCmd)
-        logVerbose(pipedCmd)
-        p = subprocess.Popen(pipedCmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                             stderr=sys.stderr, shell=True, close_fds=True, preexec_fn=os.setsid)
-        childProcesses.append(p)
-        tasks.append({"process": p, "csv_fragment": instance["csv_fragment"]})
+        task = newInstanceTask(instance, 'convert', cmd, instance["csv_fragment"])
+        task["stderr"] = sys.stderr
+        startTask(task)
+        tasks.append(task)
         startingCoordinate += opts.chunk_size
     if opts.use_dlf_files:
-        # If we are using files, wait until they are converted.
+        # If we are using files, wait until they are converted. A fragment that is a file can be
+        # converted again: retry it alone, whatever failed, the converter or the ssh session.
+        retryable = lambda retCode: opts.use_csv_files
         for task in tasks:
-            p = task["process"]
-            retCode = p.wait()
+            retCode = waitTask(task, retryable)
             if retCode != 0:
+                p = task["process"]
                 err = "Failed to distribute and convert the CSV fragment: \"%s\"." % (task["csv_fragment"])
                 if p and p.stderr:
                     err = "%s\n%s" % (err, p.stderr.read())
@@ -482,8 +547,8 @@ def createArray(arrayName, arraySchema):
     cmd = "\"%siquery\" -c %s -p %d -nq \"CREATE ARRAY %s %s\"" % (sciDbBinFolder, opts.db_address, opts.db_port, arrayName, arraySchema)
     logVerbose(cmd)
     p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-    childProcesses.append(p)
-    retCode = p.wait()
+    addChild(p, 'createArray', cmd=cmd)
+    retCode = waitChild(p)
     if retCode != 0:
         err = "Failed to create array: \"%s\"." % arrayName
         if p and p.stderr:
@@ -499,8 +564,8 @@ def removeArray(arrayName, raiseExceptions=True):
         cmd = "\"%siquery\" -c %s -p %d -anq \"remove(%s)\"" % (sciDbBinFolder, opts.db_address, opts.db_port, arrayName)
         logVerbose(cmd)
         p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-        childProcesses.append(p)
-        retCode = p.wait()
+        addChild(p, 'removeArray', cmd=cmd)
+        retCode = waitChild(p)
         if retCode != 0:
             err = "Failed to remove array: \"%s\"." % arrayName
             if p and p.stderr:
@@ -551,8 +616,8 @@ def load():
                 cmd = "\"%siquery\" -c %s -p %d -anq \"%s\"" % (sciDbBinFolder, opts.db_address, opts.db_port, redimCmd)
                 logVerbose(cmd)
                 p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-                childProcesses.append(p)
-                retCode = p.wait()
+                addChild(p, 'load', cmd=cmd)
+                retCode = waitChild(p)
                 if retCode != 0:
                     err = "Load failed."
                     if p and p.stderr:
@@ -576,8 +641,8 @@ def load():
                 cmd = "\"%siquery\" -c %s -p %d -anq \"%s\"" % (sciDbBinFolder, opts.db_address, opts.db_port, redimCmd)
                 logVerbose(cmd)
                 p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-                childProcesses.append(p)
-                retCode = p.wait()
+                addChild(p, 'load', cmd=cmd)
+                retCode = waitChild(p)
                 if retCode != 0:
                     err = "Load failed."
                     if p and p.stderr:
@@ -601,8 +666,8 @@ def load():
                 cmd = "\"%siquery\" -c %s -p %d -anq \"%s\"" % (sciDbBinFolder, opts.db_address, opts.db_port, insertCmd)
                 logVerbose(cmd)
                 p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-                childProcesses.append(p)
-                retCode = p.wait()
+                addChild(p, 'load', cmd=cmd)
+                retCode = waitChild(p)
                 if retCode != 0:
                     err = "Load failed."
                     if p and p.stderr:
@@ -626,8 +691,8 @@ def load():
                 cmd = "\"%siquery\" -c %s -p %d -anq \"%s\"" % (sciDbBinFolder, opts.db_address, opts.db_port, insertCmd)
                 logVerbose(cmd)
                 p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-                childProcesses.append(p)
-                retCode = p.wait()
+                addChild(p, 'load', cmd=cmd)
+                retCode = waitChild(p)
                 if retCode != 0:
                     err = "Load failed."
                     if p and p.stderr:
@@ -646,8 +711,8 @@ def load():
                 cmd = "%s)\"" % cmd
             logVerbose(cmd)
             p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
-            childProcesses.append(p)
-            retCode = p.wait()
+            addChild(p, 'load', cmd=cmd)
+            retCode = waitChild(p)
             if retCode != 0:
                 err = "Load failed."
                 if p and p.stderr:
@@ -655,6 +720,41 @@ def load():
                 raise Exception(err)
 
 
+#####################
+# reportShadowArray #
+#####################
+def reportShadowArray():
+    if not opts.shadow_name:
+        return
+    cmd = "\"%siquery\" -c %s -p %d -ocsv -aq \"op_count(%s)\"" % (sciDbBinFolder, opts.db_address, opts.db_port, opts.shadow_name)
+    logVerbose(cmd)
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
+    addChild(p, 'reportShadowArray', cmd=cmd)
+    retCode = waitChild(p)
+    if retCode != 0:
+        logNormal("Could not count the bad cells in the shadow array \"%s\"." % opts.shadow_name)
+        return
+    try:
+        numBad = long(p.stdout.read().strip().split('\n')[-1])
+    except ValueError:
+        logNormal("Could not count the bad cells in the shadow array \"%s\"." % opts.shadow_name)
+        return
+    if numBad == 0 or not opts.shadow_report:
+        logNormal("%d bad cell(s) recorded in the shadow array \"%s\"." % (numBad, opts.shadow_name))
+        return
+    cmd = "\"%siquery\" -c %s -p %d -ocsv -aq \"scan(%s)\" > \"%s\"" % (
+        sciDbBinFolder, opts.db_address, opts.db_port, opts.shadow_name, opts.shadow_report)
+    logVerbose(cmd)
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, close_fds=True, preexec_fn=os.setsid)
+    addChild(p, 'reportShadowArray', cmd=cmd)
+    retCode = waitChild(p)
+    if retCode != 0:
+        logNormal("%d bad cell(s) recorded in the shadow array \"%s\"; could not write them to \"%s\"." % (
+            numBad, opts.shadow_name, opts.shadow_report))
+    else:
+        logNormal("%d bad cell(s) recorded in the shadow array \"%s\"; see \"%s\"." % (
+            numBad, opts.shadow_name, opts.shadow_report))
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv
@@ -666,9 +766,9 @@ def main(argv=None):
     # Note that changes here may need to be reflected in
     # loadpipe.py's DISALLOWED_LOADCSV_OPTIONS list.
     parser = optparse.OptionParser(description="SciDB Parallel CSV Loader")
-    parser.add_option("-d", help="SciDB Coordinator Hostname or IP Address (Default = \"localhost\")", action="store", dest="db_address", default="localhost")
-    parser.add_option("-p", help="SciDB Coordinator Port (Default = 1239)", action="store", dest="db_port", type=int, default=1239)
-    parser.add_option("-r", help="SciDB Installation Root Folder (Default = \"/opt/scidb/14.8\")", action="store", dest="db_root", default="/opt/scidb/14.8")
+    parser.add_option("-d", help="SciDB Coordinator Hostname or IP Address (Default = $SCIDB_HOST, or \"localhost\")", action="store", dest="db_address", default=os.getenv("SCIDB_HOST", "localhost"))
+    parser.add_option("-p", help="SciDB Coordinator Port (Default = $SCIDB_PORT, or 1239)", action="store", dest="db_port", type=int, default=int(os.getenv("SCIDB_PORT", "1239")))
+    parser.add_option("-r", help="SciDB Installation Root Folder (Default = $SCIDB_INSTALL_PATH or \"/opt/scidb/14.8\")", action="store", dest="db_root", default=os.getenv("SCIDB_INSTALL_PATH", "/opt/scidb/14.8"))
     parser.add_option("-i", help="CSV Input File (Default = stdin)", action="store", dest="input_file")
     parser.add_option("-n", help="# Lines to Skip (Default = 0)", action="store", dest="skip", type=int, default=0)
     parser.add_option("-t", action="store", dest="type_pattern",
@@ -691,12 +791,14 @@ def main(argv=None):
     parser.add_option("-s", help="Load Array Schema", action="store", dest="load_schema")
     parser.add_option("-w", help="Shadow Array Name", action="store", dest="shadow_name")
     parser.add_option("-e", help="# Load Errors Allowed per Instance (Default = 0)", action="store", dest="errors_allowed", type=int, default=0)
+    parser.add_option("-W", help="Shadow Array Report File: where to write the bad cells the shadow array recorded", action="store", dest="shadow_report")
     parser.add_option("-x", help="Remove Load and Shadow Arrays Before Loading (if they exist)", action="store_true", dest="remove_load_arrays")
     parser.add_option("-A", help="Target Array Name", action="store", dest="target_name")
     parser.add_option("-S", help="Target Array Schema", action="store", dest="target_schema")
     parser.add_option("-T", help="Directory for temporary files", action="store", dest="temp_dir")
     parser.add_option("-X", help="Remove Target Array Before Loading (if it exists)", action="store_true", dest="remove_target_array")
     parser.add_option("-z", help=optparse.SUPPRESS_HELP, action="store", type="choice", choices=["RSL", "RSI", "IRL", "IRI"], default="RSL", dest="transform")
+    parser.add_option("-R", help="# Retries of a Failed Instance Command or Conversion (Default = 2)", action="store", dest="retries", type=int, default=2)
     parser.add_option("-v", help="Display Verbose Messages", action="store_true", dest="verbose")
     parser.add_option("-V", help="Display SciDB Version Information", action="store_true", dest="show_version")
     parser.add_option("-q", help="Quiet Mode", action="store_true", dest="quiet")
@@ -743,7 +845,14 @@ def main(argv=None):
                 dlfFragmentsCreated = True
                 split()
                 distributeAndConvert()
-                load()
+                try:
+                    load()
+                except Exception:
+                    if not opts.shadow_name or opts.errors_allowed == 0:
+                        logNormal("Hint: with -e <errors allowed> and -w <shadow array>, the load goes on past bad cells and records them.")
+                    raise
+                finally:
+                    reportShadowArray()
                 dataLoaded = True
             else:
                 print("Warning: No input data was found.")
@@ -760,11 +869,11 @@ def main(argv=None):
 
         # Kill any child processes that might be running... just in case.
         for p in childProcesses:
-            retCode = p.poll()
+            retCode = pollChild(p)
             if retCode == None:
                 logVerbose("Terminating child process with pid = %d." % p.pid)
                 os.killpg(p.pid, signal.SIGTERM)
-                p.wait()
+                waitChild(p, killed=True)
 
         # Remove temporary fragment files/FIFOs.
         if csvFragmentsCreated:
@@ -798,4 +907,4 @@ def main(argv=None):
 
 
 if __name__ == '__main__':
-    sys.exit(main())
+    sys.exit(scidb_profile.run(main, 'loadcsv_express'))
@@ -0,0 +1,10 @@
+#Source this file to run the loader against the local SciDB stand-in (see localdb.py):
+#  . localdb/env.sh
+#iquery, loadcsv.py, scidb.py, shim and the converters of loadcsv_express.py then come from localdb/bin.
+
+LOCALDB=$(cd $(dirname ${BASH_SOURCE[0]}) && pwd)
+export PATH=$LOCALDB/bin:$PATH
+export SCIDB_INSTALL_PATH=$LOCALDB
+#The state goes to the temporary directory, where localdb.py puts it by default.
+export LOCALDB_DIR=${LOCALDB_DIR:-${TMPDIR:-/tmp}/localdb-$(id -un)}
+export LOCALDB_INSTANCES=${LOCALDB_INSTANCES:-2}
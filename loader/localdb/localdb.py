@@ -0,0 +1,584 @@
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""A local stand-in for SciDB, to run the load pipeline on one box without a cluster.
+
+It emulates the few SciDB client programs the loader calls:
+  - iquery:     list('instances'), list('arrays'), show(), create array, remove(),
+                load() and op_count() of an array; aggregate() with count(*).
+  - osplitcsv:  splits the input into one CSV fragment per instance, chunk by chunk.
+  - tsv2scidb:  converts a fragment into a simple DLF text format.
+  - loadcsv.py: runs loadcsv_express.py against the stand-in.
+  - scidb.py:   stopall/startall are no-ops.
+  - shim:       the HTTP API of shim, for scidb_transport.ShimTransport; see ShimHandler.
+No data is stored: an array only keeps its schema and the number of cells loaded into
+it. load() reads the DLF fragments from the instance paths that list('instances')
+reports, counts their cells and records the timing. Every other query succeeds
+without doing anything; it is only recorded, as unsupported.
+
+The state lives in $LOCALDB_DIR (default localdb-<user> in the temporary directory):
+  - arrays/<name>.json   the schema, temp flag and cell count of every array.
+  - instance_<i>/        the instance paths; $LOCALDB_INSTANCES sets how many (default 2).
+  - queries.log          one JSON line per query: the query, whether it was supported,
+                         the elapsed time, and for load() the cells of every fragment.
+Source localdb/env.sh to put the stand-in first on the PATH.
+"""
+
+import BaseHTTPServer
+import contextlib
+import csv
+import fcntl
+import getpass
+import json
+import os
+import re
+import SocketServer
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+STATE_DIR = os.environ.get('LOCALDB_DIR', os.path.join(tempfile.gettempdir(), 'localdb-' + getpass.getuser()))
+NUM_INSTANCES = int(os.environ.get('LOCALDB_INSTANCES', '2'))
+PORT = 1239
+
+class QueryError(Exception):
+    """A query that SciDB would reject; the message mimics a SciDB error code."""
+    pass
+
+#########
+# State #
+#########
+
+def _array_file(name):
+    return os.path.join(STATE_DIR, 'arrays', name.lower() + '.json')
+
+def instance_path(instance_id):
+    """@return the data directory of an instance, created on demand."""
+    path = os.path.join(STATE_DIR, 'instance_%d' % instance_id)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+@contextlib.contextmanager
+def locked_state():
+    """Serialize the updates of the state between concurrent iquery processes."""
+    if not os.path.isdir(os.path.join(STATE_DIR, 'arrays')):
+        os.makedirs(os.path.join(STATE_DIR, 'arrays'))
+    with open(os.path.join(STATE_DIR, 'lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def get_array(name):
+    """@return the state of an array, or None if it does not exist."""
+    try:
+        with open(_array_file(name)) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+def put_array(array):
+    tmp = _array_file(array['name']) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(array, f, sort_keys=True)
+    os.rename(tmp, _array_file(array['name']))
+
+def list_arrays():
+    """@return the states of all arrays, sorted by name."""
+    arrays_dir = os.path.join(STATE_DIR, 'arrays')
+    if not os.path.isdir(arrays_dir):
+        return []
+    result = []
+    for file_name in sorted(os.listdir(arrays_dir)):
+        if file_name.endswith('.json'):
+            with open(os.path.join(arrays_dir, file_name)) as f:
+                result.append(json.load(f))
+    return result
+
+def log_query(record):
+    """Append one JSON line to queries.log."""
+    if not os.path.isdir(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    with open(os.path.join(STATE_DIR, 'queries.log'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+###########
+# Queries #
+###########
+
+def split_args(text):
+    """Split the arguments of an operator at the top-level commas.
+
+    @param text  e.g. "A, filter(B, x = 1), 'a,b'".
+    @return a list of stripped argument strings.
+    """
+    args = []
+    depth = 0
+    quoted = False
+    start = 0
+    for i, ch in enumerate(text):
+        if ch == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif ch in '(<[':
+            depth += 1
+        elif ch in ')>]':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            args.append(text[start:i].strip())
+            start = i + 1
+    args.append(text[start:].strip())
+    return args
+
+def split_statements(text):
+    """Split a script into statements at the top-level semicolons."""
+    statements = []
+    quoted = False
+    start = 0
+    for i, ch in enumerate(text):
+        if ch == "'":
+            quoted = not quoted
+        elif ch == ';' and not quoted:
+            statements.append(text[start:i])
+            start = i + 1
+    statements.append(text[start:])
+    return [s.strip() for s in statements if s.strip()]
+
+def _operator(query):
+    """@return (name, argument text) of a query like 'name(args)', or (None, None)."""
+    m = re.match(r'^(\w+)\s*\((.*)\)$', query, re.S)
+    if not m:
+        return None, None
+    return m.group(1).lower(), m.group(2)
+
+def _existing(name):
+    array = get_array(name)
+    if array is None:
+        raise QueryError('SCIDB_SE_QPROC::SCIDB_LE_ARRAY_DOESNT_EXIST: Array \'%s\' does not exist.' % name)
+    return array
+
+def _is_name(text):
+    return re.match(r'^\w+$', text) is not None
+
+def _count_fragment(path, counts, index, errors):
+    """Count the cells of one DLF fragment; run in one thread per instance, as FIFOs must be read together."""
+    try:
+        n = 0
+        with open(path) as f:
+            for line in f:
+                if line.startswith('('):
+                    n += 1
+        counts[index] = n
+    except IOError as e:
+        errors.append('SCIDB_SE_IO::SCIDB_LE_CANT_OPEN_FILE: %s' % e)
+
+def run_load(args, record):
+    """load(ARRAY, 'fragment', -1, 'text', errors[, shadow]): count the cells of every instance's fragment."""
+    name = args[0]
+    _existing(name)
+    fragment = args[1].strip("'")
+    paths = [os.path.join(instance_path(i), fragment) if not os.path.isabs(fragment) else fragment
+             for i in range(NUM_INSTANCES)]
+    counts = [0] * len(paths)
+    errors = []
+    threads = [threading.Thread(target=_count_fragment, args=(path, counts, i, errors))
+               for i, path in enumerate(paths)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise QueryError(errors[0])
+    with locked_state():
+        array = _existing(name)
+        array['count'] += sum(counts)
+        put_array(array)
+    record['cells'] = counts
+    return None
+
+def run_query(query, record):
+    """Execute one query against the stand-in.
+
+    @param query   the AFL query.
+    @param record  a dict to add details of the execution to, for queries.log.
+    @return (header, rows) of the result, or None if the query returns no result.
+    @exception QueryError if SciDB would reject the query.
+    """
+    m = re.match(r'^create\s+(temp\s+)?array\s+(\w+)\s*(<.*)$', query, re.I | re.S)
+    if m:
+        schema = ' '.join(m.group(3).split())
+        with locked_state():
+            if get_array(m.group(2)) is not None:
+                raise QueryError('SCIDB_SE_SYSCAT::SCIDB_LE_ARRAY_ALREADY_EXIST: Array \'%s\' already exists.' % m.group(2))
+            put_array({'name': m.group(2), 'schema': schema, 'temp': bool(m.group(1)), 'count': 0})
+        return None
+
+    op, arg_text = _operator(query)
+    args = split_args(arg_text) if arg_text is not None else []
+    if op == 'list' and args == ["'instances'"]:
+        rows = [["'localhost'", str(PORT + i), str(i), "'2014-01-01 00:00:00'", "'%s'" % instance_path(i)]
+                for i in range(NUM_INSTANCES)]
+        return ['name', 'port', 'instance_id', 'online_since', 'instance_path'], rows
+    if op == 'list' and args in ([''], ["'arrays'"], ["'arrays'", 'true']):
+        return (['name', 'schema', 'temporary'],
+                [["'%s'" % a['name'], "'%s%s'" % (a['name'], a['schema']), str(a['temp']).lower()]
+                 for a in list_arrays()])
+    if op == 'project' and len(args) == 2 and args[0] == 'list()' and args[1] == 'name':
+        return ['name'], [["'%s'" % a['name']] for a in list_arrays()]
+    if op == 'show' and len(args) == 1 and _is_name(args[0]):
+        array = _existing(args[0])
+        return ['schema'], [["'%s%s'" % (array['name'], array['schema'])]]
+    if op == 'remove' and len(args) == 1:
+        with locked_state():
+            _existing(args[0])
+            os.remove(_array_file(args[0]))
+        return None
+    if op == 'load' and len(args) >= 2 and _is_name(args[0]):
+        return run_load(args, record)
+    if op == 'op_count' and len(args) == 1 and _is_name(args[0]):
+        return ['count'], [[str(_existing(args[0])['count'])]]
+    if op == 'aggregate' and len(args) >= 2:
+        # Only count(*) of an array is known; every other aggregate is null.
+        count = _existing(args[0])['count'] if _is_name(args[0]) else 0
+        record['supported'] = _is_name(args[0]) and all(a == 'count(*)' for a in args[1:])
+        return ([re.sub(r'\W.*', '', a) for a in args[1:]],
+                [[str(count) if a == 'count(*)' else 'null' for a in args[1:]]])
+
+    # Anything else, e.g. insert(redimension(...)), changes nothing here.
+    record['supported'] = False
+    if op == 'op_count':
+        return ['count'], [['0']]
+    return None
+
+def format_result(result, output_format):
+    """Render a result as iquery would, in csv, dcsv or the default text format."""
+    header, rows = result
+    lines = []
+    if output_format == 'csv':
+        lines.append(','.join(header))
+        lines.extend(','.join(row) for row in rows)
+    else:
+        lines.append('{i} ' + ','.join(header))
+        lines.extend('{%d} %s' % (i, ','.join(row)) for i, row in enumerate(rows))
+    return '\n'.join(lines) + '\n'
+
+def iquery_main(argv=None):
+    """The iquery stand-in. Understands -a, -n, -q QUERY, -o FORMAT, -f FILE, -c HOST and -p PORT."""
+    if argv is None:
+        argv = sys.argv
+    query_text = None
+    query_file = None
+    want_output = True
+    output_format = 'dcsv'
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if not arg.startswith('-') or len(arg) < 2:
+            continue
+        j = 1
+        while j < len(arg):
+            flag = arg[j]
+            j += 1
+            if flag in 'qofcp':
+                value = arg[j:] if j < len(arg) else (argv[i] if i < len(argv) else '')
+                if j >= len(arg):
+                    i += 1
+                j = len(arg)
+                if flag == 'q':
+                    query_text = value
+                elif flag == 'o':
+                    output_format = value
+                elif flag == 'f':
+                    query_file = value
+            elif flag == 'n':
+                want_output = False
+
+    if query_text is None:
+        query_text = open(query_file).read() if query_file else sys.stdin.read()
+
+    for query in split_statements(query_text):
+        record = {'query': ' '.join(query.split()), 'supported': True, 'pid': os.getpid()}
+        start = time.time()
+        try:
+            result = run_query(query, record)
+        except QueryError as e:
+            record['error'] = str(e)
+            log_query(record)
+            print >> sys.stderr, 'UserException in file: localdb.py\nError id: %s\nQuery: %s' % (e, query)
+            return 1
+        record['elapsed'] = time.time() - start
+        log_query(record)
+        if want_output and result is not None:
+            sys.stdout.write(format_result(result, output_format))
+        elif want_output:
+            sys.stdout.write('Query was executed successfully\n')
+    return 0
+
+########
+# Shim #
+########
+
+# The struct formats of the fixed-size types of the binary save formats.
+_BINARY_TYPES = {'int8': 'b', 'int16': 'h', 'int32': 'i', 'int64': 'q', 'uint8': 'B', 'uint16': 'H',
+                 'uint32': 'I', 'uint64': 'Q', 'double': 'd', 'float': 'f', 'bool': '?'}
+
+def _binary_value(text, scidb_type):
+    if scidb_type == 'bool':
+        return text == 'true'
+    if scidb_type in ('double', 'float'):
+        return float(text)
+    return long(text)
+
+def format_binary(result, save_format):
+    """Render a result in a binary save format, e.g. '(int64,double null,string)'.
+
+    As in SciDB, every attribute is a little-endian value, a string is its length with the
+    terminating NUL and its bytes, and a nullable attribute starts with a byte that is
+    0xff, or the missing reason (0) of a null.
+    """
+    header, rows = result
+    types = [t.strip().split() for t in save_format.strip('()').split(',')]
+    if len(types) != len(header):
+        raise QueryError('SCIDB_SE_IMPORT_ERROR::SCIDB_LE_WRONG_NUMBER_OF_TYPES: %d types for %d attributes.'
+                         % (len(types), len(header)))
+    out = []
+    for row in rows:
+        for text, t in zip(row, types):
+            nullable = len(t) > 1 and t[1] == 'null'
+            is_null = text == 'null'
+            if nullable:
+                out.append('\x00' if is_null else '\xff')
+            if t[0] == 'string':
+                value = '' if is_null else (text[1:-1] if text.startswith("'") else text) + '\0'
+                out.append(struct.pack('<I', len(value)) + value)
+            elif t[0] in _BINARY_TYPES:
+                fmt = '<' + _BINARY_TYPES[t[0]]
+                out.append(struct.pack(fmt, 0) if is_null else struct.pack(fmt, _binary_value(text, t[0])))
+            else:
+                raise QueryError('SCIDB_SE_IMPORT_ERROR::SCIDB_LE_UNSUPPORTED_FORMAT: %s' % t[0])
+    return ''.join(out)
+
+class ShimHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """The requests of shim's HTTP API that the loader uses, over keep-alive connections.
+
+    new_session, release_session, execute_query (with save), read_lines and read_bytes
+    (with n), cancel, login and logout. The queries go to run_query(), as from iquery.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass   # queries.log has the queries.
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _session(self, params):
+        session = self.server.sessions.get(params.get('id', ''))
+        if session is None:
+            self._reply(404, 'Session not found\n')
+        return session
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query, keep_blank_values=True).items())
+        name = url.path.strip('/')
+        server = self.server
+        server.requests += 1
+        if name == 'new_session':
+            with server.lock:
+                server.last_session += 1
+                session_id = str(server.last_session)
+                server.sessions[session_id] = {'output': None, 'offset': 0, 'cancelled': False}
+            self._reply(200, session_id + '\n')
+        elif name == 'release_session':
+            if self._session(params) is not None:
+                del server.sessions[params['id']]
+                self._reply(200, '')
+        elif name in ('login', 'logout'):
+            self._reply(200, 'localdb\n' if name == 'login' else '')
+        elif name == 'cancel':
+            session = self._session(params)
+            if session is not None:
+                session['cancelled'] = True
+                self._reply(200, '')
+        elif name == 'execute_query':
+            session = self._session(params)
+            if session is not None:
+                self._execute(session, params)
+        elif name in ('read_lines', 'read_bytes'):
+            session = self._session(params)
+            if session is not None:
+                self._read(session, name, int(params.get('n', '0')))
+        else:
+            self._reply(400, 'Unknown request %s\n' % name)
+
+    def _execute(self, session, params):
+        session.update(output=None, offset=0, cancelled=False)
+        save = params.get('save')
+        result = None
+        for query in split_statements(params.get('query', '')):
+            record = {'query': ' '.join(query.split()), 'supported': True, 'pid': os.getpid(),
+                      'shim_session': params['id'], 'client_port': self.client_address[1]}
+            start = time.time()
+            try:
+                result = run_query(query, record)
+                if save and result is not None:
+                    session['output'] = (format_binary(result, save) if save.startswith('(')
+                                         else format_result(result, save))
+            except QueryError as e:
+                record['error'] = str(e)
+                log_query(record)
+                self._reply(500, 'UserException in file: localdb.py\nError id: %s\nQuery: %s\n' % (e, query))
+                return
+            record['elapsed'] = time.time() - start
+            log_query(record)
+        if save and session['output'] is None:
+            session['output'] = ''
+        self._reply(200, params['id'] + '\n')
+
+    def _read(self, session, name, n):
+        output = session['output']
+        if output is None:
+            self._reply(410, 'Output not saved\n')
+            return
+        start = session['offset']
+        if n <= 0:
+            end = len(output)
+        elif name == 'read_bytes':
+            end = min(start + n, len(output))
+        else:
+            end = start
+            for i in range(n):
+                end = output.find('\n', end) + 1
+                if end == 0:
+                    end = len(output)
+                    break
+        session['offset'] = end
+        self._reply(200, output[start:end])
+
+class ShimServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ShimHandler)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.last_session = 0
+        self.requests = 0
+
+def shim_main(argv=None):
+    """The shim stand-in: [-p PORT] [--host HOST]; serves until killed. Default is localhost:8080."""
+    if argv is None:
+        argv = sys.argv
+    port = 8080
+    host = 'localhost'
+    i = 1
+    while i < len(argv):
+        if argv[i] == '-p':
+            port = int(argv[i + 1])
+        elif argv[i] == '--host':
+            host = argv[i + 1]
+        i += 2
+    server = ShimServer((host, port))
+    print 'localdb shim listening on http://%s:%d' % (host, server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+##############
+# Converters #
+##############
+
+def _unescape(delimiter):
+    return {'\\t': '\t', 'tab': '\t'}.get(delimiter, delimiter)
+
+def osplitcsv_main(argv=None):
+    """The osplitcsv stand-in: -n INSTANCES -c CHUNK -s SKIP -o BASE [-d DELIM] [-t PATTERN] [--format=tsv].
+
+    Chunk k of CHUNK lines goes to the fragment BASE_<k % INSTANCES>, as tab-separated lines.
+    """
+    if argv is None:
+        argv = sys.argv
+    opts = {'-n': '1', '-c': '500000', '-s': '0', '-o': 'stdin.csv', '-d': ',', '-t': ''}
+    i = 1
+    while i < len(argv):
+        if argv[i] in opts:
+            opts[argv[i]] = argv[i + 1]
+            i += 2
+        else:
+            i += 1
+    num_instances, chunk, skip = int(opts['-n']), int(opts['-c']), int(opts['-s'])
+    delimiter = _unescape(opts['-d'])
+    outputs = [open('%s_%04d' % (opts['-o'], n), 'w') for n in range(num_instances)]
+    reader = csv.reader(sys.stdin, delimiter=delimiter, quoting=csv.QUOTE_NONE if delimiter == '\t' else csv.QUOTE_MINIMAL)
+    for line_nbr, fields in enumerate(reader):
+        if line_nbr < skip:
+            continue
+        outputs[((line_nbr - skip) / chunk) % num_instances].write('\t'.join(fields) + '\n')
+    for f in outputs:
+        f.close()
+    return 0
+
+def tsv2scidb_main(argv=None):
+    """The tsv2scidb stand-in: [-p PATTERN] -c CHUNK -f START -n INSTANCES -d DELIM -o OUT.
+
+    Writes one '{coordinate}[' line per chunk, one '(fields)' line per cell and a ']' line.
+    The chunks of one instance start at START, START + INSTANCES * CHUNK, and so on.
+    """
+    if argv is None:
+        argv = sys.argv
+    opts = {'-p': '', '-c': '500000', '-f': '0', '-n': '1', '-d': '\\t', '-o': None}
+    i = 1
+    while i < len(argv):
+        if argv[i] in opts:
+            opts[argv[i]] = argv[i + 1]
+            i += 2
+        else:
+            i += 1
+    chunk, coordinate, num_instances = int(opts['-c']), long(opts['-f']), int(opts['-n'])
+    delimiter = _unescape(opts['-d'])
+    out = open(opts['-o'], 'w') if opts['-o'] else sys.stdout
+    in_chunk = 0
+    for line in sys.stdin:
+        if in_chunk == 0:
+            out.write('{%d}[\n' % coordinate)
+        out.write('(%s)\n' % ','.join(line.rstrip('\n').split(delimiter)))
+        in_chunk += 1
+        if in_chunk == chunk:
+            out.write(']\n')
+            in_chunk = 0
+            coordinate += num_instances * chunk
+    if in_chunk:
+        out.write(']\n')
+    out.close()
+    return 0
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Predict the wall time, disk use and bottleneck of a load from benchmark results.
+
+The throughput of every stage, in genotypes per second, comes from the runs of
+bench_ingest.py recorded in its history file, at the largest size each stage was run at;
+the spread between runs gives the error bars. The cluster shape is the number of instances,
+from list('instances') or --instances. The input files come from a load_scheduler.py
+manifest: every file is sampled as chunk_advisor.py does to estimate its samples and
+variants, unless its line gives them, e.g. for files that are not on this host yet:
+  # path                  [prefix]  [samples=N variants=N [chrom=C]]
+  chr21.vcf.gz            CHR21
+  /data/chr1.vcf.gz       CHR1      samples=2504 variants=6468094 chrom=1
+
+The model follows load_scheduler.py: loads are admitted largest file first under the same
+core and concurrency limits, and every file's redim is queued when its load is done, one
+at a time, or one per chromosome with --partitioned. A load streams through decompress,
+parse and split on the coordinator, then convert and load on every instance; it goes at
+the pace of its slowest stage. Every stage of a job goes at most at the rate the benchmark
+measured for one job alone. The coordinator stages slow down when the loads need more
+cores than --cores; convert, load and redim slow down when the loads and redims in flight
+need more cores of every instance than --instance-cores, a load one for convert and one
+for load, a redim one. Convert ran in one process in the benchmark and runs on every
+instance in a load; load and redim were measured on the instances of the benchmark's
+database. They are scaled to the instances of the cluster.
+
+The disk estimate counts the load buffers, which stay until reset_db.sh, and the target
+arrays, from the widths of the sampled fields; it ignores the old versions an insert leaves
+until it is reclaimed, and the savings of variants that are already loaded.
+
+Example:
+  ./plan_load.py -m files.txt --history bench_history.json --max-loads 1,2,4,8
+"""
+
+import argparse
+import os
+import sys
+import chunk_advisor
+import load_scheduler
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_bench
+from scidblib import scidb_storage
+from scidblib import statistics
+from scidblib.scidb_progress import format_bytes, format_seconds
+from scidblib.util import superTuple
+
+COORDINATOR_STAGES = ['decompress', 'parse', 'split']
+INSTANCE_STAGES = ['convert', 'load']
+LOAD_STAGES = COORDINATOR_STAGES + INSTANCE_STAGES
+
+# The widths of the fields, in characters, when no input file could be sampled.
+DEFAULT_WIDTHS = {'gt': 3, 'signature': 20, 'ref': 1, 'alt': 1, 'id': 11, 'filter': 4, 'misc': 120,
+                  'chrom': 2, 'sample_name': 7}
+# The bytes of a stored numeric cell.
+NUMBER_BYTES = 8
+
+StageRate = superTuple('StageRate', 'mean', 'stdev', 'runs')
+Plan = superTuple('Plan', 'seconds', 'bottleneck')
+
+class InputFile:
+    """The shape of one input file.
+
+    Details of public attributes:
+      - path:         the VCF file.
+      - prefix:       its prefix in the manifest, or None.
+      - chrom:        its (first) chromosome, or None if unknown.
+      - num_samples:  its number of samples.
+      - num_variants: its estimated number of variants.
+      - widths:       a dict mapping a field name to its average width, as chunk_advisor.InputStats has it.
+    """
+    def __init__(self, path, prefix, chrom, num_samples, num_variants, widths):
+        self.path = path
+        self.prefix = prefix
+        self.chrom = chrom
+        self.num_samples = num_samples
+        self.num_variants = num_variants
+        self.widths = widths
+
+    def cells(self):
+        return self.num_samples * self.num_variants
+
+    def _variant_row_bytes(self):
+        width = lambda field: self.widths.get(field, DEFAULT_WIDTHS[field])
+        return (sum(chunk_advisor.string_cell_bytes(width(f)) for f in ('ref', 'alt', 'id', 'filter', 'misc'))
+                + 4 * NUMBER_BYTES)
+
+    def buffer_bytes(self):
+        """@return the estimated size of the ${PREFIX}_KG_*_BUF arrays of the file."""
+        gt = chunk_advisor.string_cell_bytes(self.widths.get('gt', DEFAULT_WIDTHS['gt']))
+        chrom = chunk_advisor.string_cell_bytes(self.widths.get('chrom', DEFAULT_WIDTHS['chrom']))
+        return self.cells() * gt + self.num_variants * (self._variant_row_bytes() + chrom + 2 * NUMBER_BYTES)
+
+    def target_bytes(self):
+        """@return the estimated growth of the target arrays when the file is redimensioned."""
+        gt = chunk_advisor.string_cell_bytes(self.widths.get('gt', DEFAULT_WIDTHS['gt']))
+        signature = chunk_advisor.string_cell_bytes(self.widths.get('signature', DEFAULT_WIDTHS['signature']))
+        # KG_VARIANT, KG_VARIANT_MULT_VAL and KG_VARIANT_POSITION_MASK.
+        variant = self._variant_row_bytes() + signature + 2 * NUMBER_BYTES + 1
+        return self.cells() * gt + self.num_variants * variant
+
+def read_plan_manifest(manifest_file):
+    """Read a manifest of input files, with optional shapes.
+
+    @param manifest_file  the path of the manifest.
+    @return a list of (path, prefix, shape) tuples; prefix is None when not given, and shape
+            is a dict with the 'samples', 'variants' and 'chrom' of the line, possibly empty.
+    @exception AppError if a line is malformed.
+    """
+    entries = []
+    with open(manifest_file) as f:
+        for line_nbr, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            shape = {}
+            plain = []
+            for field in fields:
+                key, sep, value = field.partition('=')
+                if not sep:
+                    plain.append(field)
+                elif key in ('samples', 'variants') and value.isdigit():
+                    shape[key] = long(value)
+                elif key == 'chrom' and value:
+                    shape[key] = value
+                else:
+                    raise scidblib.AppError('%s:%d: unknown field %s.' % (manifest_file, line_nbr, field))
+            if not plain or len(plain) > 2 or (shape and not ('samples' in shape and 'variants' in shape)):
+                raise scidblib.AppError('%s:%d: expected "path [prefix] [samples=N variants=N [chrom=C]]".' % (
+                    manifest_file, line_nbr))
+            entries.append((plain[0], plain[1] if len(plain) > 1 else None, shape))
+    return entries
+
+def describe_files(entries, max_records):
+    """Sample the input files whose shape is not given.
+
+    The files whose shape is given borrow the field widths of the sampled ones.
+    @param entries      (path, prefix, shape) tuples, as read_plan_manifest() returns.
+    @param max_records  how many records of every file to sample.
+    @return a list of InputFile objects.
+    @exception AppError if a file without a given shape does not exist.
+    """
+    files = []
+    sampled = chunk_advisor.InputStats()
+    for path, prefix, shape in entries:
+        if shape:
+            files.append(InputFile(path, prefix, shape.get('chrom'), shape['samples'], shape['variants'], None))
+            continue
+        if not os.path.isfile(path):
+            raise scidblib.AppError('Cannot find input file %s; give its samples= and variants= in the manifest.' % path)
+        stats = chunk_advisor.InputStats()
+        chunk_advisor.sample_file(stats, path, max_records, 100)
+        chunk_advisor.sample_file(sampled, path, max_records, 100)
+        stats.finish()
+        chrom = max(stats.variants, key=stats.variants.get) if stats.variants else None
+        files.append(InputFile(path, prefix, chrom, stats.num_samples, stats.total_variants(), stats.widths))
+    sampled.finish()
+    for f in files:
+        if f.widths is None:
+            f.widths = sampled.widths
+    return files
+
+def stage_rates(history, instances):
+    """Get the throughput of every stage from the benchmark history.
+
+    Every stage is taken at the largest size it was run at. The stages that run on every
+    instance are scaled from the instances of their runs to the given instances: convert
+    ran all the fragments in one process, and load and redim ran on the database instances
+    recorded in the run, or on the given instances for runs that did not record them.
+    @param history    a scidb_bench.BenchHistory of bench_ingest.py.
+    @param instances  the number of instances of the cluster.
+    @return a dict mapping a stage to its StageRate, in genotypes per second.
+    """
+    samples = {}   # stage -> {cells: RunningStats of the genotypes per second on the cluster}
+    for run in history.runs():
+        # The 'instances' of the meta is the number of fragments, not of database instances.
+        db_instances = run.get('meta', {}).get('db_instances') or instances
+        for key, r in run['results'].iteritems():
+            stage = key.split('/')[0]
+            if not r.get('cells_per_second'):
+                continue
+            rate = r['cells_per_second']
+            if stage == 'convert':
+                rate = rate * instances
+            elif stage in ('load', 'redim'):
+                rate = rate * instances / db_instances
+            samples.setdefault(stage, {}).setdefault(r['cells'], statistics.RunningStats()).add(rate)
+    rates = {}
+    for stage, by_size in samples.iteritems():
+        stats = by_size[max(by_size)]
+        stdev = stats.stdev() if stats.count > 1 else 0.0
+        rates[stage] = StageRate(stats.mean(), stdev, stats.count)
+    return rates
+
+def scenario(rates, spread):
+    """@return the genotypes per second of every stage, spread standard deviations above their mean."""
+    return dict((stage, max(r.mean + spread * r.stdev, r.mean / 10)) for stage, r in rates.iteritems())
+
+def simulate(files, rates, cores, max_loads, load_cores, max_redims, instance_cores):
+    """Play the schedule of load_scheduler.py with fixed stage throughputs.
+
+    @param files           the InputFile objects.
+    @param rates           a dict mapping a stage to the genotypes per second of one job alone.
+    @param cores           the cores of the coordinator the loads may use together.
+    @param max_loads       the maximum number of in-flight loads.
+    @param load_cores      the cores one load uses.
+    @param max_redims      the maximum number of concurrent redims (of different chromosomes).
+    @param instance_cores  the cores of every instance the loads and redims may use together.
+    @return a Plan; its bottleneck is a dict mapping a stage to the seconds it set the pace of a job,
+            divided by the number of jobs in flight, so that they add up to the wall time.
+    """
+    queued = sorted(files, key=lambda f: f.cells(), reverse=True)
+    loading = {}     # InputFile -> genotypes left to load.
+    redim_queue = []
+    redimming = {}   # InputFile -> genotypes left to redim.
+    now = 0.0
+    bottleneck = {}
+    load_stages = [stage for stage in LOAD_STAGES if stage in rates]
+    while queued or loading or redim_queue or redimming:
+        # The admission rule of LoadScheduler.can_start_load(), without the memory limit.
+        while queued and (not loading or (len(loading) < max_loads and (len(loading) + 1) * load_cores <= cores)):
+            f = queued.pop(0)
+            loading[f] = f.cells()
+        for f in list(redim_queue):
+            if len(redimming) < max_redims and not any(other.chrom == f.chrom for other in redimming):
+                redim_queue.remove(f)
+                redimming[f] = f.cells()
+
+        num_jobs = len(loading) + len(redimming)
+        coordinator_share = min(1.0, cores * 1.0 / (len(loading) * load_cores)) if loading else 1.0
+        instance_demand = len(loading) * len([s for s in load_stages if s in INSTANCE_STAGES]) + len(redimming)
+        instance_share = min(1.0, instance_cores * 1.0 / instance_demand) if instance_demand else 1.0
+        paces = {}
+        for f in loading:
+            paces[f] = min((rates[stage] * (coordinator_share if stage in COORDINATOR_STAGES else instance_share),
+                            stage) for stage in load_stages)
+        for f in redimming:
+            paces[f] = (rates['redim'] * instance_share, 'redim')
+
+        step = min((loading.get(f, redimming.get(f)) / rate) for f, (rate, stage) in paces.iteritems())
+        now += step
+        for f, (rate, stage) in paces.iteritems():
+            bottleneck[stage] = bottleneck.get(stage, 0.0) + step / num_jobs
+            jobs = loading if f in loading else redimming
+            jobs[f] -= rate * step
+            if jobs[f] <= 1e-6 * f.cells():
+                del jobs[f]
+                if jobs is loading and 'redim' in rates:
+                    redim_queue.append(f)
+    return Plan(now, bottleneck)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Predict the wall time, disk use and bottleneck of a load.')
+    parser.add_argument('-m', '--manifest',
+                        help='A file listing the input files, one "path [prefix] [samples=N variants=N [chrom=C]]" per line.')
+    parser.add_argument('--history', default='bench_history.json',
+                        help='The history file of bench_ingest.py. Default is bench_history.json.')
+    parser.add_argument('--instances', type=int,
+                        help='The number of SciDB instances. Default is to ask SciDB with list(\'instances\').')
+    parser.add_argument('--max-loads', default='1,2,4',
+                        help='The concurrency settings to compare: comma-separated maximum numbers of in-flight loads. '
+                        'Default is 1,2,4.')
+    parser.add_argument('--cores', type=int, default=load_scheduler.default_cores(),
+                        help='The cores of the coordinator the loads may use together. Default is the number of cores '
+                        'of this machine.')
+    parser.add_argument('--load-cores', type=int, default=load_scheduler.LOAD_CORES,
+                        help='The cores one load uses. Default is %d.' % load_scheduler.LOAD_CORES)
+    parser.add_argument('--instance-cores', type=int, default=load_scheduler.default_cores(),
+                        help='The cores of every instance the loads and redims may use together; a load uses one for '
+                        'convert and one for load, a redim one. Default is the number of cores of this machine.')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='Plan for the partitioned layout, where the redims of different chromosomes run in parallel.')
+    parser.add_argument('--max-redims', type=int, help='The maximum number of concurrent redims with --partitioned.')
+    parser.add_argument('--sample-records', type=int, default=1000,
+                        help='How many records of every input file to sample. Default is 1000.')
+    parser.add_argument('-c', '--host', help='Host name to be passed to iquery.')
+    parser.add_argument('-p', '--port', help='Port number to be passed to iquery.')
+    parser.add_argument('files', nargs='*', help='Input files, in addition to those of the manifest.')
+    args = parser.parse_args(argv[1:])
+
+    try:
+        settings = [int(n) for n in args.max_loads.split(',')]
+    except ValueError:
+        parser.error('--max-loads expects comma-separated numbers.')
+    if args.instance_cores < 1:
+        parser.error('--instance-cores must be at least 1.')
+
+    try:
+        entries = read_plan_manifest(args.manifest) if args.manifest else []
+        entries.extend((path, None, {}) for path in args.files)
+        if not entries:
+            parser.error('No input files.')
+        files = describe_files(entries, args.sample_records)
+
+        in_use = None
+        instances = args.instances
+        if instances is None:
+            iquery_cmd = scidb_afl.get_iquery_cmd(args)
+            instances = scidb_afl.get_num_instances(iquery_cmd)
+            in_use = scidb_storage.storage_bytes(iquery_cmd)
+
+        if not os.path.exists(args.history):
+            raise scidblib.AppError('Cannot find the benchmark history %s; run bench_ingest.py first.' % args.history)
+        rates = stage_rates(scidb_bench.BenchHistory(args.history), instances)
+        if not any(stage in rates for stage in LOAD_STAGES):
+            raise scidblib.AppError('%s has no results of the load stages.' % args.history)
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+
+    num_cells = sum(f.cells() for f in files)
+    print 'Plan for %d files, %.3g genotypes, on %d instances of %d cores.' % (len(files), num_cells, instances,
+                                                                            args.instance_cores)
+    print
+    print '%-12s %14s %14s %5s' % ('stage', 'genotypes/s', '+/- (stdev)', 'runs')
+    for stage in LOAD_STAGES + ['redim']:
+        if stage in rates:
+            r = rates[stage]
+            print '%-12s %14.4g %14.4g %5d' % (stage, r.mean, r.stdev, r.runs)
+    if 'redim' not in rates:
+        print 'The history has no redim results (bench_ingest.py --db); the plan leaves the redims out.'
+    print
+
+    max_redims = (args.max_redims or len(files)) if args.partitioned else 1
+    if not args.partitioned:
+        for f in files:
+            f.chrom = None
+    scenarios = [scenario(rates, spread) for spread in (0, 1, -1)]
+    print '%-10s %12s %26s   %s' % ('max-loads', 'wall time', 'range (fast .. slow)', 'bottleneck')
+    for max_loads in settings:
+        expected, fast, slow = [simulate(files, rates_of, args.cores, max_loads, args.load_cores, max_redims,
+                                         args.instance_cores)
+                                for rates_of in scenarios]
+        stage = max(expected.bottleneck, key=expected.bottleneck.get)
+        share = expected.bottleneck[stage] * 100.0 / max(expected.seconds, 1e-9)
+        print '%-10d %12s %26s   %s (%.0f%% of the time)' % (
+            max_loads, format_seconds(expected.seconds),
+            '%s .. %s' % (format_seconds(fast.seconds), format_seconds(slow.seconds)), stage, share)
+    print
+
+    buffers = sum(f.buffer_bytes() for f in files)
+    targets = sum(f.target_bytes() for f in files)
+    print 'Disk: %s of load buffers (kept until reset_db.sh) and %s of target arrays.' % (
+        format_bytes(buffers), format_bytes(targets))
+    if in_use is not None:
+        print 'Peak disk use: %s, with the %s SciDB uses now.' % (format_bytes(in_use + buffers + targets),
+                                                                  format_bytes(in_use))
+    else:
+        print 'Peak disk use: %s, on top of what SciDB uses now.' % format_bytes(buffers + targets)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Reclaim old versions of the KG_* arrays according to a storage policy.
+
+Examples:
+  - Keep only the latest version of every target array (what redim_with_prefix.sh does at the end):
+      ./reclaim_versions.py --force
+  - Called after every insert into KG_GENOTYPE; reclaims once 3 versions piled up
+    or storage grew by 20 GiB since the last reclamation:
+      ./reclaim_versions.py --state-file reclaim.json --inserted KG_GENOTYPE \\
+                            --max-versions 3 --max-bytes 21474836480
+"""
+
+import argparse
+import sys
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_profile
+from scidblib import scidb_storage
+
+KG_ARRAYS = ['KG_CHROMOSOME', 'KG_GENOTYPE', 'KG_SAMPLE',
+             'KG_VARIANT', 'KG_VARIANT_MULT_VAL', 'KG_VARIANT_POSITION_MASK']
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Reclaim old array versions by policy.')
+    parser.add_argument('-c', '--host', help='Host name to be passed to iquery.')
+    parser.add_argument('-p', '--port', help='Port number to be passed to iquery.')
+    parser.add_argument('-s', '--state-file', help='JSON file keeping the insert counters and storage baseline across calls.')
+    parser.add_argument('-i', '--inserted', metavar='ARRAY', help='Record an insert into ARRAY, then reclaim it if a policy is due.')
+    parser.add_argument('--max-versions', type=int, help='Reclaim an array once it has more than this many versions.')
+    parser.add_argument('--max-bytes', type=long, help='Reclaim once storage grew by this many bytes since the last reclamation.')
+    parser.add_argument('--every-insert', type=int, metavar='N', help='Reclaim an array after every N inserts into it.')
+    parser.add_argument('-f', '--force', action='store_true', help='Reclaim all arrays regardless of the policies.')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='How many arrays to look up and reclaim concurrently. Default is 4.')
+    parser.add_argument('arrays', nargs='*', help='The arrays to track. Default is all KG_* target arrays.')
+    args = parser.parse_args(argv[1:])
+
+    policies = []
+    if args.max_versions:
+        policies.append(scidb_storage.MaxVersionsPolicy(args.max_versions))
+    if args.max_bytes:
+        policies.append(scidb_storage.MaxBytesPolicy(args.max_bytes))
+    if args.every_insert:
+        policies.append(scidb_storage.EveryInsertPolicy(args.every_insert))
+
+    def log(message):
+        print message
+
+    try:
+        iquery_cmd = scidb_afl.get_iquery_cmd(args)
+        array_names = args.arrays if args.arrays else KG_ARRAYS
+        manager = scidb_storage.StorageManager(iquery_cmd, array_names, policies,
+                                               state_file=args.state_file, log=log, max_queries=args.jobs)
+        if args.force:
+            report = manager.reclaim()
+        elif args.inserted:
+            report = manager.note_insert(args.inserted)
+        else:
+            report = manager.maintain()
+        if report is None:
+            print 'No array is due for reclamation.'
+        print 'Total freed by this manager: %d bytes.' % manager.total_freed()
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(scidb_profile.run(main, 'reclaim_versions'))
@@ -4,18 +4,54 @@ MYDIR=`dirname $0`
 pushd $MYDIR
 MYDIR=`pwd`
 
-if [ $# -ne 1 ]; then
-    echo "Please provide the Prefix! KTHXBYE"
+if [ $# -lt 1 ] || [ $# -gt 2 ]; then
+    echo "Please provide the Prefix (and optionally the chromosome, for the partitioned layout)! KTHXBYE"
     exit 1
 fi
 
 PREFIX=$1
 
-iquery -anq "remove(KG_VAR_GUIDE_BUF)"    > /dev/null 2>&1
-iquery -anq "remove(KG_SAMPLE_GUIDE_BUF)" > /dev/null 2>&1
-iquery -anq "remove(KG_SIG_BUF)"          > /dev/null 2>&1
+#SCIDB_TRACE=<dir> records every query below as an event of a Chrome trace (see trace_tool.py)
+TRACE=""
+if [ -n "$SCIDB_TRACE" ]; then
+  TRACE="./trace_tool.py run -g redim:$PREFIX --"
+fi
+#SCIDB_HOST and SCIDB_PORT (load_scheduler.py -c and -p) name the coordinator; the Python tools below read them too
+IQUERY=`type -P iquery`
+iquery() { $TRACE $IQUERY ${SCIDB_HOST:+-c $SCIDB_HOST} ${SCIDB_PORT:+-p $SCIDB_PORT} "$@"; }
+
+#With a chromosome argument, redim into that chromosome's own KG_CHR<n>_* arrays (see kg_layout.py).
+#Files of different chromosomes can then be redimensioned concurrently.
+CHROM=$2
+if [ -n "$CHROM" ]; then
+  T=`./kg_layout.py prefix $CHROM`
+  ID_BASE=`./kg_layout.py idbase $CHROM`
+  #A contig whose code another partition has would share its id range: refuse it. The check and the create hold
+  #the lock of the shared ids, so that two new partitions with the same code cannot both pass the check.
+  ( flock 9 && ./kg_layout.py check $CHROM && ./kg_layout.py schema $CHROM | ./ensure_arrays.py - > /dev/null ) 9> kg_shared_ids.lock || exit 1
+else
+  T="KG_"
+  ID_BASE=0
+fi
 
-set -e 
+if [ "`./load_manifest.py prefix-stage $PREFIX`" == "redimmed" ]; then
+  echo "The content loaded as $PREFIX is already in the target arrays (see load_manifest.py); skipping the redim"
+  exit 0
+fi
+
+#Optional policy for reclaiming versions between the inserts below, e.g.
+#RECLAIM_POLICY="--max-versions 2 --max-bytes 21474836480"
+#By default, old versions are only reclaimed once at the end.
+note_insert()
+{
+  if [ -n "$RECLAIM_POLICY" ]; then
+    ./reclaim_versions.py --state-file ${T}reclaim_state.json --inserted $1 $RECLAIM_POLICY
+  fi
+}
+
+./ensure_arrays.py -r ${T}VAR_GUIDE_BUF -r ${T}SAMPLE_GUIDE_BUF -r ${T}VID_SIG_BUF -r ${T}KNOWN_SIG_BUF > /dev/null
+
+set -e
 set -x
 
 NUM_SAMPLES=`iquery -ocsv -aq "op_count(${PREFIX}_KG_SAMPLE_BUF)" | tail -n 1`
@@ -25,13 +61,228 @@ echo File has $NUM_VARIANTS variants
 NUM_GT=`iquery -ocsv -aq "op_count(${PREFIX}_KG_GT_BUF)" | tail -n 1`
 
 if [ "$((NUM_SAMPLES * NUM_VARIANTS))" != "$NUM_GT" ];
-then 
+then
   echo "Num gt: $NUM_GT does not match; exiting"
   exit 1
 fi
 
+if [ -n "$CHROM" ]; then
+  NUM_OTHER_CHROM=`iquery -ocsv -aq "op_count(filter(${PREFIX}_KG_VAR_BUF, chrom <> '$CHROM'))" | tail -n 1`
+  if [ "$NUM_OTHER_CHROM" != "0" ];
+  then
+    echo "File has $NUM_OTHER_CHROM variants outside chromosome $CHROM; the partitioned layout needs one chromosome per file; exiting"
+    exit 1
+  fi
+  #KG_SAMPLE, KG_CHROMOSOME and KG_VARIANT_ID_SIDE are shared by all partitions: only one redim at a time may assign new ids
+  exec 9> kg_shared_ids.lock
+fi
+
+lock_shared_ids()
+{
+  if [ -n "$CHROM" ]; then
+    flock 9
+  fi
+}
+
+unlock_shared_ids()
+{
+  if [ -n "$CHROM" ]; then
+    flock -u 9
+  fi
+}
+
+#Every insert into a target array is a step; the steps done are written to ${PREFIX}_redim_state. A redim that
+#failed half-way is resumed by running it again: the steps done are skipped, the others are run again. A failed
+#step is retried REDIM_RETRIES times (default 2), after 1, 2, 4... seconds, before the redim gives up.
+#The state belongs to the buffers of one load: stream_vcf_1d.sh removes it when it creates new ones.
+REDIM_STATE=${PREFIX}_redim_state
+REDIM_RETRIES=${REDIM_RETRIES:-2}
+touch $REDIM_STATE
+
+run_step()
+{
+  local STEP=$1
+  shift
+  if grep -qx "done $STEP" $REDIM_STATE; then
+    echo "$STEP was already inserted by an earlier attempt; skipping"
+    return 0
+  fi
+  local ATTEMPT=0
+  until time "$@"; do
+    if [ $ATTEMPT -ge $REDIM_RETRIES ]; then
+      echo "Inserting into $STEP failed $((ATTEMPT + 1)) times; run the redim again to resume from there"
+      return 1
+    fi
+    ATTEMPT=$((ATTEMPT + 1))
+    echo "Inserting into $STEP failed; retry $ATTEMPT of $REDIM_RETRIES"
+    sleep $((2 ** (ATTEMPT - 1)))
+  done
+  echo "done $STEP" >> $REDIM_STATE
+  note_insert $STEP
+}
+
+VAR_SIG="apply(${PREFIX}_KG_VAR_BUF, signature, chrom + ':' + string(pos) + ' ' + ref + '>' + alt)"
+RECLAIM_EXTRA=""
+
+#Resolve the variant ids of the file first. NUM_NEW_VARIANTS tells whether the file brings any variant
+#that is not in ${T}VARIANT yet; if not, it is a cohort append and only the sample side gets written.
+#vcfstreamer -d leaves a side buffer behind; it means the variant lines carry position-derived ids
+if iquery -aq "show(${PREFIX}_KG_VID_SIDE_BUF)" > /dev/null 2>&1; then
+  #Position-derived ids (vcfstreamer -d): no global sort/uniq. An allele keeps the id it already has in ${T}VARIANT;
+  #else the id KG_VARIANT_ID_SIDE pins its signature to (a probed slot, or an earlier conflict); else the streamer's id.
+  #The streamer only probed the alleles of this file, so its id of an allele already loaded may differ from the stored one.
+  VARIANT_CHUNK=`iquery -ocsv -aq "project(dimensions(${T}VARIANT), chunk_interval)" | sed -n 2p`
+  #Ids above this live in the chromosome-less range 0 of kg_layout.py, and are handed out for conflicts only
+  OVERFLOW_BASE=`./kg_layout.py overflow`
+  NUM_SLOTS=`./kg_layout.py slots`
+  EXISTING="project(apply(${T}VARIANT, existing_signature, signature), existing_signature)"
+  RECLAIM_EXTRA="KG_VARIANT_ID_SIDE"
+
+  #The alleles of ${T}VARIANT at the positions of this file: an allele is either at its own position, or in KG_VARIANT_ID_SIDE
+  VID_RANGE=`iquery -ocsv -aq "aggregate(${PREFIX}_KG_VAR_BUF, min(vid), max(vid))" | tail -n 1`
+  echo "create temp array ${T}KNOWN_SIG_BUF <signature: string> [variant_id=0:*,${VARIANT_CHUNK},0]" | ./ensure_arrays.py --fresh - > /dev/null
+  if [[ "$VID_RANGE" =~ ^[0-9]+,[0-9]+$ ]]; then
+    LOW_VID=$(( ${VID_RANGE%,*} / NUM_SLOTS * NUM_SLOTS ))
+    HIGH_VID=$(( ${VID_RANGE#*,} / NUM_SLOTS * NUM_SLOTS + NUM_SLOTS - 1 ))
+    time iquery -anq "insert(redimension(project(between(${T}VARIANT, $LOW_VID, null, $HIGH_VID, null), signature), ${T}KNOWN_SIG_BUF), ${T}KNOWN_SIG_BUF)"
+  fi
+
+  LOOKUP="index_lookup(index_lookup(${VAR_SIG} as X, ${T}KNOWN_SIG_BUF, X.signature, known_vid) as Y, KG_VARIANT_ID_SIDE, Y.signature, side_vid)"
+  RESOLVED="apply(${LOOKUP}, variant_id, iif(known_vid is not null, known_vid, iif(side_vid is null, vid, side_vid)))"
+  #Only the alleles without an id in ${T}VARIANT can take an id another allele has
+  UNKNOWN="filter(${RESOLVED}, known_vid is null)"
+
+  lock_shared_ids
+
+  #Record the ids of the alleles the streamer had to probe, unless their signature already has an id;
+  #the first file to see a signature wins
+  NEW_SIDE="filter(index_lookup(index_lookup(${PREFIX}_KG_VID_SIDE_BUF as S, KG_VARIANT_ID_SIDE, S.signature, existing_vid) as S2, ${T}KNOWN_SIG_BUF, S2.signature, known_vid), existing_vid is null and known_vid is null)"
+  NUM_NEW_SIDE=`iquery -ocsv -aq "op_count(${NEW_SIDE})" | tail -n 1`
+  if [ "$NUM_NEW_SIDE" != "0" ]; then
+    time iquery -anq "
+    insert(
+     redimension(
+      apply(
+       ${NEW_SIDE},
+       variant_id, vid
+      ),
+      KG_VARIANT_ID_SIDE
+     ),
+     KG_VARIANT_ID_SIDE
+    )"
+    note_insert KG_VARIANT_ID_SIDE
+  fi
+
+  for ROUND in 1 2; do
+    echo "create temp array ${T}VID_SIG_BUF <signature: string> [variant_id=0:*,${VARIANT_CHUNK},0]" | ./ensure_arrays.py --fresh - > /dev/null
+    time iquery -anq "insert(redimension(${UNKNOWN}, ${T}VID_SIG_BUF), ${T}VID_SIG_BUF)"
+    CONFLICTS="filter(cross_join(${T}VID_SIG_BUF as A, ${EXISTING} as B, A.variant_id, B.variant_id), signature <> existing_signature)"
+    NUM_CONFLICTS=`iquery -ocsv -aq "op_count(${CONFLICTS})" | tail -n 1`
+    if [ "$NUM_CONFLICTS" == "0" ]; then
+      break
+    fi
+    if [ "$ROUND" == "2" ]; then
+      echo "Still $NUM_CONFLICTS variant id conflicts after moving them to KG_VARIANT_ID_SIDE; exiting"
+      exit 1
+    fi
+    echo "$NUM_CONFLICTS variant(s) collide with existing ids at the same position; moving them to the overflow range"
+    NUM_OVERFLOW=`iquery -ocsv -aq "op_count(between(KG_VARIANT_ID_SIDE, $OVERFLOW_BASE, $((OVERFLOW_BASE * 2 - 1))))" | tail -n 1`
+    time iquery -anq "
+    insert(
+     redimension(
+      apply(uniq(sort(project(${CONFLICTS}, signature))), variant_id, i + $OVERFLOW_BASE + $NUM_OVERFLOW),
+      KG_VARIANT_ID_SIDE
+     ),
+     KG_VARIANT_ID_SIDE
+    )"
+    note_insert KG_VARIANT_ID_SIDE
+  done
+
+  unlock_shared_ids
+
+  NUM_KNOWN_AT_POSITION=`iquery -ocsv -aq "op_count(filter(${LOOKUP}, known_vid is not null))" | tail -n 1`
+  NUM_RESOLVED=`iquery -ocsv -aq "op_count(${T}VID_SIG_BUF)" | tail -n 1`
+  if [ "$((NUM_RESOLVED + NUM_KNOWN_AT_POSITION))" != "$NUM_VARIANTS" ];
+  then
+    echo "Only $((NUM_RESOLVED + NUM_KNOWN_AT_POSITION)) distinct ids for $NUM_VARIANTS variants; two alleles resolved to the same id; exiting"
+    exit 1
+  fi
+  #The alleles without an id at their position may still have one in the overflow range
+  NUM_KNOWN_ELSEWHERE=`iquery -ocsv -aq "op_count(cross_join(${T}VID_SIG_BUF as A, ${EXISTING} as B, A.variant_id, B.variant_id))" | tail -n 1`
+  NUM_NEW_VARIANTS=$((NUM_VARIANTS - NUM_KNOWN_AT_POSITION - NUM_KNOWN_ELSEWHERE))
+  iquery -anq "remove(${T}VID_SIG_BUF)"
+
+  iquery -anq "create temp array ${T}VAR_GUIDE_BUF <nvid:int64> [variant_id=0:*,${VARIANT_CHUNK},0]"
+  time iquery -anq "insert(redimension(${RESOLVED}, ${T}VAR_GUIDE_BUF), ${T}VAR_GUIDE_BUF)"
+  iquery -anq "remove(${T}KNOWN_SIG_BUF)"
+else
+  #Sequential ids. ${T}SIG_INDEX maps every signature of ${T}VARIANT to its id, and is kept across redims
+  #as a lookup cache; it is rebuilt from ${T}VARIANT only when the two no longer agree (e.g. after a failed redim).
+  RECLAIM_EXTRA="${T}SIG_INDEX"
+  NUM_EXISTING_SIGNATURES=`iquery -ocsv -aq "op_count(${T}VARIANT)" | tail -n 1`
+  NUM_CACHED_SIGNATURES=`iquery -ocsv -aq "op_count(${T}SIG_INDEX)" 2> /dev/null | tail -n 1`
+  if [ "$NUM_CACHED_SIGNATURES" != "$NUM_EXISTING_SIGNATURES" ]; then
+    echo "Rebuilding the signature index of ${T}VARIANT"
+    echo "create array ${T}SIG_INDEX <signature: string> [variant_id =0:*,1000000,0]" | ./ensure_arrays.py --fresh - > /dev/null
+    time iquery -anq "insert(redimension(${T}VARIANT, ${T}SIG_INDEX), ${T}SIG_INDEX)"
+  fi
+
+  NEW_SIGNATURES="filter(index_lookup(${VAR_SIG} as X, ${T}SIG_INDEX, X.signature, existing_signature_id), existing_signature_id is null)"
+  NUM_NEW_VARIANTS=`iquery -ocsv -aq "op_count(${NEW_SIGNATURES})" | tail -n 1`
+  if [ "$NUM_NEW_VARIANTS" != "0" ]; then
+    time iquery -naq "
+    insert(
+     redimension(
+      apply(
+       uniq(
+        sort(
+         project(
+          ${NEW_SIGNATURES},
+          signature
+         )
+        )
+       ),
+       variant_id, i + $NUM_EXISTING_SIGNATURES + $ID_BASE
+      ),
+      ${T}SIG_INDEX
+     ),
+     ${T}SIG_INDEX
+    )"
+  fi
+
+  iquery -anq "create temp array ${T}VAR_GUIDE_BUF <nvid:int64> [variant_id=0:*,1000000,0]"
+  time iquery -anq "
+  insert(
+   redimension(
+    index_lookup(
+     ${VAR_SIG} as X,
+     ${T}SIG_INDEX,
+     X.signature,
+     variant_id
+    ),
+    ${T}VAR_GUIDE_BUF
+   ),
+   ${T}VAR_GUIDE_BUF
+  )"
+fi
+
+#A resumed redim keeps the decision of the attempt it resumes: the variants that attempt inserted no longer look new
+RECORDED_NEW_VARIANTS=`sed -n 's/^new_variants //p' $REDIM_STATE`
+if [ -n "$RECORDED_NEW_VARIANTS" ]; then
+  echo "Resuming the redim of $PREFIX, which had $RECORDED_NEW_VARIANTS new variants"
+  NUM_NEW_VARIANTS=$RECORDED_NEW_VARIANTS
+else
+  echo "new_variants $NUM_NEW_VARIANTS" >> $REDIM_STATE
+fi
+
+if [ "$NUM_NEW_VARIANTS" == "0" ]; then
+  echo "All $NUM_VARIANTS variants are already loaded: appending samples only"
+fi
+
+lock_shared_ids
+
 NUM_EXISTING_SAMPLES=`iquery -ocsv -aq "op_count(KG_SAMPLE)" | tail -n 1`
-time iquery -naq "
+run_step KG_SAMPLE iquery -naq "
 insert(
  redimension(
   apply(
@@ -39,13 +290,13 @@ insert(
     sort(
      project(
       filter(
-       index_lookup(${PREFIX}_KG_SAMPLE_BUF, KG_SAMPLE, ${PREFIX}_KG_SAMPLE_BUF.sample_name, sample_id), 
+       index_lookup(${PREFIX}_KG_SAMPLE_BUF, KG_SAMPLE, ${PREFIX}_KG_SAMPLE_BUF.sample_name, sample_id),
        sample_id is null
-      ), 
+      ),
       sample_name
      )
     )
-   ), 
+   ),
    sample_id, i+$NUM_EXISTING_SAMPLES
   ),
   KG_SAMPLE
@@ -53,8 +304,9 @@ insert(
  KG_SAMPLE
 )"
 
+if [ "$NUM_NEW_VARIANTS" != "0" ]; then
 NUM_EXISTING_CHROMOSOMES=`iquery -ocsv -aq "op_count(KG_CHROMOSOME)" | tail -n 1`
-time iquery -naq "
+run_step KG_CHROMOSOME iquery -naq "
 insert(
  redimension(
   apply(
@@ -75,68 +327,18 @@ insert(
  ),
  KG_CHROMOSOME
 )"
+fi
 
-iquery -anq "create temp array KG_SIG_BUF <signature: string> [variant_id =0:*,1000000,0]"
-iquery -anq "insert(redimension(KG_VARIANT, KG_SIG_BUF), KG_SIG_BUF)"
-NUM_EXISTING_SIGNATURES=`iquery -ocsv -aq "op_count(KG_SIG_BUF)" | tail -n 1`
-time iquery -naq "
-insert(
- redimension(
-  apply(
-   uniq(
-    sort(
-     project(
-      filter(
-       index_lookup(
-        apply(
-         ${PREFIX}_KG_VAR_BUF, 
-         signature,
-         chrom + ':' + string(pos) + ' ' + ref + '>' + alt
-        ) as X,
-        KG_SIG_BUF, X.signature, existing_signature_id),
-       existing_signature_id is null
-      ),
-      signature
-     )
-    )
-   ),
-   variant_id, i + $NUM_EXISTING_SIGNATURES
-  ),
-  KG_SIG_BUF
- ),
- KG_SIG_BUF
-)"
-
-iquery -anq "create temp array KG_VAR_GUIDE_BUF <nvid:int64> [variant_id=0:*,1000000,0]"
-time iquery -anq "
-insert(
- redimension(
-  index_lookup(
-   apply(
-     ${PREFIX}_KG_VAR_BUF, 
-     signature,
-     chrom + ':' + string(pos) + ' ' + ref + '>' + alt
-   ) as X,
-   KG_SIG_BUF,
-   X.signature,
-   variant_id
-  ),
-  KG_VAR_GUIDE_BUF
- ),
- KG_VAR_GUIDE_BUF
-)"
+unlock_shared_ids
 
-time iquery -anq "
+if [ "$NUM_NEW_VARIANTS" != "0" ]; then
+run_step ${T}VARIANT iquery -anq "
 insert(
  redimension(
   index_lookup(
    index_lookup(
-    apply(
-      ${PREFIX}_KG_VAR_BUF, 
-      signature,
-      chrom + ':' + string(pos) + ' ' + ref + '>' + alt
-    ) as X,
-    KG_VAR_GUIDE_BUF,
+    ${VAR_SIG} as X,
+    ${T}VAR_GUIDE_BUF,
     X.nvid,
     variant_id
    ),
@@ -144,12 +346,13 @@ insert(
    X.chrom,
    chrom_id
   ),
-  KG_VARIANT
+  ${T}VARIANT
  ),
- KG_VARIANT
+ ${T}VARIANT
 )"
+fi
 
-iquery -anq "create temp array KG_SAMPLE_GUIDE_BUF <nsid:int64> [sample_id=0:*,10000000,0]"
+iquery -anq "create temp array ${T}SAMPLE_GUIDE_BUF <nsid:int64> [sample_id=0:*,10000000,0]"
 time iquery -anq "
 insert(
  redimension(
@@ -159,45 +362,69 @@ insert(
    X.sample_name,
    sample_id
   ),
-  KG_SAMPLE_GUIDE_BUF
+  ${T}SAMPLE_GUIDE_BUF
  ),
- KG_SAMPLE_GUIDE_BUF
+ ${T}SAMPLE_GUIDE_BUF
 )"
 
-time iquery -anq "
+run_step ${T}GENOTYPE iquery -anq "
 insert(
  redimension(
   index_lookup(
    index_lookup(
     ${PREFIX}_KG_GT_BUF,
-    KG_SAMPLE_GUIDE_BUF,
+    ${T}SAMPLE_GUIDE_BUF,
     ${PREFIX}_KG_GT_BUF.nsid,
     sample_id
    ),
-   KG_VAR_GUIDE_BUF,
+   ${T}VAR_GUIDE_BUF,
    ${PREFIX}_KG_GT_BUF.nvid,
    variant_id
   ),
-  KG_GENOTYPE
+  ${T}GENOTYPE
  ),
- KG_GENOTYPE
+ ${T}GENOTYPE
 )"
 
-time iquery -anq "
+if [ "$NUM_NEW_VARIANTS" != "0" ]; then
+run_step ${T}VARIANT_MULT_VAL iquery -anq "
 insert(
  redimension(
   index_lookup(
-   ${PREFIX}_KG_MV_BUF, 
-   KG_VAR_GUIDE_BUF,
-   ${PREFIX}_KG_MV_BUF.nvid, 
+   ${PREFIX}_KG_MV_BUF,
+   ${T}VAR_GUIDE_BUF,
+   ${PREFIX}_KG_MV_BUF.nvid,
    variant_id
   ),
-  KG_VARIANT_MULT_VAL
+  ${T}VARIANT_MULT_VAL
  ),
- KG_VARIANT_MULT_VAL
+ ${T}VARIANT_MULT_VAL
 )"
 
-time iquery -anq "
+#Allele statistics computed from the genotypes, if the load made them (ALLELE_STATS=1 in stream_vcf_1d.sh).
+#Like KG_VARIANT_MULT_VAL, they count the samples of the file that brought the variant.
+if iquery -aq "show(${PREFIX}_KG_ALLELE_STATS_BUF)" > /dev/null 2>&1; then
+  if iquery -aq "show(${T}VARIANT_ALLELE_STATS)" > /dev/null 2>&1; then
+    run_step ${T}VARIANT_ALLELE_STATS iquery -anq "
+    insert(
+     redimension(
+      index_lookup(
+       ${PREFIX}_KG_ALLELE_STATS_BUF,
+       ${T}VAR_GUIDE_BUF,
+       ${PREFIX}_KG_ALLELE_STATS_BUF.nvid,
+       variant_id
+      ),
+      ${T}VARIANT_ALLELE_STATS
+     ),
+     ${T}VARIANT_ALLELE_STATS
+    )"
+    RECLAIM_EXTRA="$RECLAIM_EXTRA ${T}VARIANT_ALLELE_STATS"
+  else
+    echo "There is no ${T}VARIANT_ALLELE_STATS array to store the allele statistics in; create it as in kgenomes_schema.afl"
+  fi
+fi
+
+run_step ${T}VARIANT_POSITION_MASK iquery -anq "
 insert(
  redimension(
   index_lookup(
@@ -207,7 +434,7 @@ insert(
      mask,
      bool(true)
     ),
-    KG_VAR_GUIDE_BUF, 
+    ${T}VAR_GUIDE_BUF,
     ${PREFIX}_KG_VAR_BUF.nvid,
     variant_id
    ),
@@ -215,30 +442,22 @@ insert(
    ${PREFIX}_KG_VAR_BUF.chrom,
    chrom_id
   ),
-  KG_VARIANT_POSITION_MASK
+  ${T}VARIANT_POSITION_MASK
  ),
- KG_VARIANT_POSITION_MASK
+ ${T}VARIANT_POSITION_MASK
 )"
+fi
 
-delete_old_versions()
-{
-  ARRAY_NAME=$1
-  MAX_VERSION=`iquery -ocsv -aq "aggregate(versions($ARRAY_NAME), max(version_id) as max_version)" | tail -n 1`
-  iquery -anq "remove_versions($ARRAY_NAME, $MAX_VERSION)"
-}
+#Keep only the latest version of every target array; reports how much space was freed
+./reclaim_versions.py --state-file ${T}reclaim_state.json --force \
+  KG_CHROMOSOME KG_SAMPLE ${T}GENOTYPE ${T}VARIANT ${T}VARIANT_MULT_VAL ${T}VARIANT_POSITION_MASK $RECLAIM_EXTRA
 
-delete_old_versions "KG_CHROMOSOME" 
-delete_old_versions "KG_GENOTYPE"
-delete_old_versions "KG_SAMPLE"
-delete_old_versions "KG_VARIANT"
-delete_old_versions "KG_VARIANT_MULT_VAL"
-delete_old_versions "KG_VARIANT_POSITION_MASK"
+./load_manifest.py redimmed $PREFIX ${T}VAR_GUIDE_BUF
+rm -f $REDIM_STATE
 
 iquery -aq "op_count(KG_CHROMOSOME)"
-iquery -aq "op_count(KG_GENOTYPE)"
+iquery -aq "op_count(${T}GENOTYPE)"
 iquery -aq "op_count(KG_SAMPLE)"
-iquery -aq "op_count(KG_VARIANT)"
-iquery -aq "op_count(KG_VARIANT_MULT_VAL)"
-iquery -aq "op_count(KG_VARIANT_POSITION_MASK)"
-
-
+iquery -aq "op_count(${T}VARIANT)"
+iquery -aq "op_count(${T}VARIANT_MULT_VAL)"
+iquery -aq "op_count(${T}VARIANT_POSITION_MASK)"
@@ -1,4 +1,6 @@
 #!/bin/bash
 
-iquery -a < kgenomes_drop.afl      > /dev/null 2>&1
-iquery -a < kgenomes_schema.afl    > /dev/null 2>&1
+#Remove the partitions and the other arrays of kgenomes_drop.afl, and create the target arrays empty, in one iquery script
+(cat kgenomes_drop.afl; ./kg_layout.py drop; cat kgenomes_schema.afl) | ./ensure_arrays.py --fresh - > /dev/null
+#The target arrays are empty again: forget what was ingested
+rm -f ${LOAD_MANIFEST:-load_manifest.json} *_redim_state
@@ -29,37 +29,87 @@ import re
 import traceback
 import copy
 import csv
+import tempfile
+import signal
+import threading
+import time
+import Queue
 from StringIO import StringIO
 import scidblib
+from scidblib import scidb_profile
+from scidblib import scidb_schema
+from scidblib import scidb_transport
+from scidblib import scidb_trace
+from scidblib.util import superTuple
 
 def get_iquery_cmd(args = None, base_iquery_cmd = 'iquery -o dcsv'):
     """Change iquery_cmd to be base_iquery_cmd followed by optional parameters host and/or port from args.
 
+    Without a host or port in args, $SCIDB_HOST and $SCIDB_PORT are used if set, so that the scripts
+    that load_scheduler.py starts query the coordinator it was given.
     @param args      argparse arguments that may include host and port.
     @param base_iquery_cmd the iquery command without host or port.
     @return the iquery command which starts and ends with a whitespace.
     """
     iquery_cmd = ' ' + base_iquery_cmd + ' '
-    if args and args.host:
-        iquery_cmd += '-c ' + args.host + ' '
-    if args and args.port:
-        iquery_cmd += '-p ' + args.port + ' '
+    host = args.host if args and args.host else os.getenv('SCIDB_HOST')
+    port = args.port if args and args.port else os.getenv('SCIDB_PORT')
+    if host:
+        iquery_cmd += '-c ' + host + ' '
+    if port:
+        iquery_cmd += '-p ' + port + ' '
     return iquery_cmd
 
+# In a worker thread of a QueryPool, the future of the query being run.
+_worker = threading.local()
+
+class DcsvDialect(csv.excel):
+    """Dialect slightly tweaked from csv.excel, as a parameter to csv.reader, for the csv and dcsv output of iquery."""
+    def __init__(self):
+        csv.excel.__init__(self)
+        self.quotechar = "'"
+        self.escapechar = '\\'
+        self.lineterminator = '\n'
+
+def _start_it(cmd, stdout, stderr):
+    """Start one command in a shell, as a traced child and, in a QueryPool, a cancellable one.
+
+    @return the subprocess.Popen object.
+    """
+    in_pool = getattr(_worker, 'future', None) is not None
+    p = subprocess.Popen(cmd, stderr=stderr, stdout=stdout, shell=True,
+                         preexec_fn=os.setpgrp if in_pool else None)
+    _query_started(p)
+    scidb_trace.begin_child(p, scidb_trace.iquery_name(cmd), 'afl', cmd=cmd.strip())
+    return p
+
+def _query_started(handle):
+    """In a QueryPool, note the process, or the transport handle, of the query being run, to cancel it."""
+    future = getattr(_worker, 'future', None)
+    if future:
+        future._started(handle)
+
+def _is_transport(iquery_cmd):
+    return isinstance(iquery_cmd, scidb_transport.Transport)
+
 def execute_it_return_out_err(cmd):
     """Execute one command, and return the data of STDOUT and STDERR.
 
+    In a QueryPool, the command runs in its own process group, so that cancelling or timing
+    out its query kills the shell and everything it started.
     @param cmd   the system command to execute.
     @return a tuple (stdoutdata, stderrdata)
     @note It is up to the caller to decide whether to throw.
     """
-    p = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-    return p.communicate()
+    p = _start_it(cmd, subprocess.PIPE, subprocess.PIPE)
+    out = scidb_profile.communicate(p, cmd.strip())
+    scidb_trace.end_child(p, bytes_out=len(out[0]), bytes_err=len(out[1]))
+    return out
 
 def afl(iquery_cmd, query, want_output=False, tolerate_error=False):
     """Execute an AFL query.
 
-    @param iquery_cmd     the iquery command.
+    @param iquery_cmd     the iquery command, or a scidb_transport.Transport.
     @param query          the AFL query.
     @param want_output    requesting iquery to output query result.
     @param tolerate_error whether to keep silent when STDERR is not empty.
@@ -67,6 +117,8 @@ def afl(iquery_cmd, query, want_output=False, tolerate_error=False):
     @return (stdout_data, stderr_data)
     @exception AppError if STDERR is not empty and the caller says tolerate_error=False.
     """
+    if _is_transport(iquery_cmd):
+        return iquery_cmd.afl(query, want_output, tolerate_error, _query_started)
     full_command = iquery_cmd + ' -'
     if not want_output:
         full_command += 'n'
@@ -80,11 +132,13 @@ def afl(iquery_cmd, query, want_output=False, tolerate_error=False):
 def time_afl(iquery_cmd, query):
     """Execute an AFL query, and return the execution time.
 
-    @param iquery_cmd the iquery command.
+    @param iquery_cmd the iquery command, or a scidb_transport.Transport.
     @param query  the AFL query.
     @return the execution time.
     @exception AppError if the error did not execute successfully.
     """
+    if _is_transport(iquery_cmd):
+        return iquery_cmd.time_afl(query, _query_started)
     full_command = '/usr/bin/time -f \"%e\" ' + iquery_cmd + ' -naq \"' + query + "\" 1>/dev/null"
     out_data, err_data = execute_it_return_out_err(full_command)
     try:
@@ -93,6 +147,26 @@ def time_afl(iquery_cmd, query):
         raise scidblib.AppError('Timing the AFL query ' + query + ', failed with the following error:\n' +
                         err_data)
 
+def afl_script(iquery_cmd, queries):
+    """Execute several AFL queries in order, in one iquery session, without their output.
+
+    iquery runs them from a script file, and stops at the first query that fails.
+    @param iquery_cmd the iquery command, or a scidb_transport.Transport.
+    @param queries    the AFL queries.
+    @exception AppError if one of the queries failed.
+    """
+    if not queries:
+        return
+    if _is_transport(iquery_cmd):
+        return iquery_cmd.script(queries, _query_started)
+    with tempfile.NamedTemporaryFile(prefix='afl_script_', suffix='.afl') as f:
+        f.write(''.join(query + ';\n' for query in queries))
+        f.flush()
+        out_data, err_data = execute_it_return_out_err(iquery_cmd + ' -anf ' + f.name)
+    if len(err_data) > 0:
+        raise scidblib.AppError('The AFL script of ' + str(len(queries)) + ' queries, starting with ' +
+                                queries[0] + ', failed with the following error:\n' + err_data)
+
 def single_cell_afl(iquery_cmd, query, num_attrs):
     """Execute an AFL query that is supposed to return a single cell, and return the attribute values.
 
@@ -117,13 +191,6 @@ def single_cell_afl(iquery_cmd, query, num_attrs):
         raise scidblib.AppError('The afl query, ' + query + ', is supposed to return two lines including header; but it returned ' +
                         str(len(lines)) + ' lines.')
 
-    class DcsvDialect(csv.excel):
-        """Dialect slightly tweaked from csv.excel, as a parameter to csv.reader."""
-        def __init__(self):
-            csv.excel.__init__(self)
-            self.quotechar = "'"
-            self.lineterminator = '\n'
-
     re_result = r'^\{0\}\s([^\n]+)$'  # A single-cell afl query returns result at row 0.
     match_result = re.match(re_result, lines[1], re.M|re.I)
     if not match_result:
@@ -165,15 +232,531 @@ def get_array_names(iquery_cmd = None, temp_only = False):
     if not iquery_cmd:
         iquery_cmd = get_iquery_cmd()
     query = 'project(filter(list(), temporary=true), name)' if temp_only else 'project(list(), name)'
-    out_data, err_data = afl(iquery_cmd, query, want_output=True)
-    lines = out_data.strip().splitlines()
-    if not lines:
-        raise scidblib.AppError(query + ' is expected to return at least one line.')
-    ret = []
-    for line in lines[1:]:  # Skip the header line.
-        re_name = r'^\{\d+\}\s\'(.+)\'$'  # e.g.: {4} 'MyArray'
-        match_name = re.match(re_name, line)
-        if not match_name:
-            raise scidblib.AppError('I don\'t understand the result line ' + str(i+1) + ': ' + line)
-        ret.append(match_name.group(1))
-    return ret
+    return [row.name for row in afl_rows(iquery_cmd, query)]
+
+########################################
+# Streaming results.
+########################################
+
+# The number of cells of an afl_batches() batch.
+DEFAULT_BATCH_ROWS = 65536
+
+# The output formats afl_rows() understands: whether each has a header line, and the dimensions in every line.
+_FORMATS = {'dcsv': (True, True), 'csv': (True, False), 'csv+': (True, True),
+            'tsv': (False, False), 'tsv+': (False, True)}
+
+_INTEGER_TYPES = set(['int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64'])
+# The NumPy types of the SciDB types that are never null.
+_NUMPY_TYPES = {'int8': 'i1', 'int16': 'i2', 'int32': 'i4', 'int64': 'i8',
+                'uint8': 'u1', 'uint16': 'u2', 'uint32': 'u4', 'uint64': 'u8', 'bool': '?'}
+
+def _converter(scidb_type):
+    """@return a function turning the text of a value of a SciDB type into a Python value."""
+    base = scidb_type.split()[0]
+    if base in _INTEGER_TYPES:
+        return int
+    if base in ('double', 'float'):
+        return float
+    if base == 'bool':
+        return lambda text: text == 'true'
+    return str
+
+def query_schema(iquery_cmd, query):
+    """Get the schema of the result of an AFL query, without running it.
+
+    @param iquery_cmd  the iquery command.
+    @param query       the AFL query.
+    @return (attr_list, dim_list), as scidb_schema.parse() returns them.
+    @exception AppError if the query is not valid.
+    """
+    quoted = query.replace('\\', '\\\\').replace("'", "\\'")
+    schema = single_cell_afl(iquery_cmd, "show('" + quoted + "', 'afl')", 1)
+    try:
+        return _parse_schema(schema)
+    except ValueError as e:
+        raise scidblib.AppError('Cannot parse the schema of the AFL query, ' + query + ': ' + str(e))
+
+def _parse_schema(schema):
+    """@return the (attr_list, dim_list) of a schema string, which may start with an array name."""
+    return scidb_schema.parse(schema[schema.index('<'):] if '<' in schema else schema)
+
+def _output_format(iquery_cmd):
+    if _is_transport(iquery_cmd):
+        return iquery_cmd.output_format
+    m = re.search(r'\s-o\s*(\S+)', iquery_cmd)
+    return m.group(1) if m else None
+
+def afl_rows(iquery_cmd, query, schema=None):
+    """Execute an AFL query, and yield the cells of its result as they arrive.
+
+    Only one line of the output is in memory at a time, whatever the size of the result.
+    Every cell is a tuple with named fields: the dimensions, if the output format has them
+    (dcsv, csv+, tsv+), then the attributes. Nulls become None. With a schema, the values
+    are converted to int, float, bool or str after their type; without one, they stay strings.
+
+    @example
+      - for row in afl_rows(iquery_cmd, 'between(KG_GENOTYPE, 0, 0, 999, *)', '<gt:string null> [variant_id=0:*,1000,0, sample_id=0:*,100,0]'):
+            print row.variant_id, row.sample_id, row.gt
+
+    @param iquery_cmd  the iquery command; it may choose the output format with -o, among
+                       dcsv, csv, csv+, tsv and tsv+. Default is dcsv.
+    @param query       the AFL query.
+    @param schema      the schema of the result, as a string or as the (attr_list, dim_list) of
+                       scidb_schema.parse() or query_schema(); the tsv formats need it for their field names.
+    @return a generator of the cells. Closing it early kills the query.
+    @exception AppError if the output format is not supported, the output does not match the
+                        schema, or the query writes to STDERR.
+    """
+    output_format = _output_format(iquery_cmd)
+    if output_format is None:
+        output_format = 'dcsv'
+        iquery_cmd += ' -o dcsv '
+    if output_format not in _FORMATS:
+        raise scidblib.AppError('Cannot stream the ' + output_format + ' output format; use dcsv, csv, csv+, tsv or tsv+.')
+    has_header, has_dims = _FORMATS[output_format]
+    if isinstance(schema, basestring):
+        schema = _parse_schema(schema)
+    types = {}
+    if schema:
+        attr_list, dim_list = schema
+        types = dict((attr.name, attr.type) for attr in attr_list)
+        types.update((dim.name, 'int64') for dim in dim_list)
+    elif not has_header:
+        raise scidblib.AppError('The ' + output_format + ' output format needs the schema of the result.')
+    return _stream(iquery_cmd, query, output_format, schema, types)
+
+def _header_names(header, output_format):
+    """@return the field names of a header line of the csv, csv+ or dcsv format, e.g. '{i,j} a,b'."""
+    header = header.rstrip('\n')
+    if output_format == 'dcsv':
+        m = re.match(r'^\{([^}]*)\}\s?(.*)$', header)
+        if not m:
+            return []
+        header = m.group(1) + ',' + m.group(2) if m.group(2) else m.group(1)
+    return [name.strip() for name in header.split(',')] if header.strip() else []
+
+def afl_lines(iquery_cmd, query):
+    """Execute an AFL query, and yield the lines of its output as they arrive.
+
+    @param iquery_cmd  the iquery command, with the output format, or a scidb_transport.Transport.
+    @param query       the AFL query.
+    @return a generator of the lines, with their line feed. Closing it early kills the query.
+    @exception AppError if the query writes to STDERR.
+    """
+    if _is_transport(iquery_cmd):
+        for line in iquery_cmd.lines(query, iquery_cmd.output_format, _query_started):
+            yield line
+        return
+    full_command = iquery_cmd + ' -aq "' + query + '"'
+    err_file = tempfile.TemporaryFile()
+    p = _start_it(full_command, subprocess.PIPE, err_file)
+    num_bytes = 0
+    finished = False
+    try:
+        for line in iter(p.stdout.readline, ''):
+            num_bytes += len(line)
+            yield line
+        finished = True
+    finally:
+        p.stdout.close()
+        if not finished and p.poll() is None:
+            # Closed early, or the output was bad: do not leave the query running.
+            try:
+                p.kill()
+            except OSError:
+                pass
+        scidb_profile.wait(p, full_command.strip())
+        scidb_trace.end_child(p, bytes_out=num_bytes)
+    _raise_on_error(query, err_file)
+
+def _stream(iquery_cmd, query, output_format, schema, types):
+    has_header, has_dims = _FORMATS[output_format]
+    output = afl_lines(iquery_cmd, query)
+    try:
+        schema_names = []
+        if schema:
+            schema_names = ([dim.name for dim in schema[1]] if has_dims else []) + [attr.name for attr in schema[0]]
+        names = schema_names
+        if has_header:
+            names = _header_names(next(output, ''), output_format)
+        if not names:
+            # The end of the output raises the error of the query, if any.
+            for line in output:
+                pass
+            raise scidblib.AppError('The AFL query, ' + query + ', did not output a header line.')
+        # The header may name the dimensions differently, e.g. {i} for an unnamed dimension.
+        typed_names = schema_names if len(schema_names) == len(names) else names
+        converters = [_converter(types.get(name, 'string')) for name in typed_names]
+        Row = superTuple('Row', *names)
+
+        is_tsv = output_format.startswith('tsv')
+        if is_tsv:
+            records = (line.rstrip('\n').split('\t') for line in output)
+        elif output_format == 'dcsv':
+            # {0,1} 'a',2  ->  0,1,'a',2
+            records = csv.reader((re.sub(r'^\{([^}]*)\}\s?', r'\1,', line) for line in output), DcsvDialect())
+        else:
+            records = csv.reader(output, DcsvDialect())
+        for n, fields in enumerate(records):
+            if n == 0 and is_tsv and fields == names:
+                continue   # tsv:H has a header line after all.
+            if len(fields) != len(names):
+                raise scidblib.AppError('The AFL query, ' + query + ', output a line with ' + str(len(fields)) +
+                                        ' fields rather than ' + str(len(names)) + '.')
+            values = []
+            for text, convert in zip(fields, converters):
+                if text == 'null' or text == '\\N' or (text.startswith('?') and text[1:].isdigit()):
+                    values.append(None)
+                elif is_tsv and convert is str:
+                    values.append(text.decode('string_escape'))
+                else:
+                    values.append(convert(text))
+            yield Row(*values)
+    finally:
+        output.close()
+
+def _raise_on_error(query, err_file):
+    """Raise an AppError if a query wrote to its STDERR file."""
+    err_file.seek(0)
+    err_data = err_file.read()
+    if err_data:
+        raise scidblib.AppError('The AFL query, ' + query + ', failed with the following error:\n' + err_data)
+
+def afl_batches(iquery_cmd, query, schema=None, batch_rows=DEFAULT_BATCH_ROWS, as_records=False):
+    """Execute an AFL query, and yield the cells of its result in batches of bounded size.
+
+    @param iquery_cmd  the iquery command, as for afl_rows().
+    @param query       the AFL query.
+    @param schema      the schema of the result, as for afl_rows(); as_records needs it.
+    @param batch_rows  the maximum number of cells per batch.
+    @param as_records  whether to yield NumPy record arrays, rather than lists of afl_rows() cells.
+                       Numbers that may be null are float64 with NaN for null; strings, and other
+                       nullable values, are objects.
+    @return a generator of the batches.
+    @exception AppError if as_records is set and NumPy is missing or the schema is not given.
+    """
+    if not as_records:
+        return _batches(afl_rows(iquery_cmd, query, schema), batch_rows, None)
+    try:
+        import numpy
+    except ImportError:
+        raise scidblib.AppError('Record batches need NumPy; please install it, or read lists of cells.')
+    if schema is None:
+        raise scidblib.AppError('Record batches need the schema of the result; see query_schema().')
+    if isinstance(schema, basestring):
+        schema = _parse_schema(schema)
+    has_dims = _FORMATS.get(_output_format(iquery_cmd) or 'dcsv', (True, True))[1]
+    dtype = [(dim.name, 'i8') for dim in schema[1]] if has_dims else []
+    for attr in schema[0]:
+        base = attr.type.split()[0]
+        if base in ('double', 'float') or (attr.nullable and base in _INTEGER_TYPES):
+            dtype.append((attr.name, 'f8'))
+        elif base in _INTEGER_TYPES or (base == 'bool' and not attr.nullable):
+            dtype.append((attr.name, _NUMPY_TYPES[base]))
+        else:
+            dtype.append((attr.name, 'O'))
+    return _batches(afl_rows(iquery_cmd, query, schema), batch_rows, (numpy, numpy.dtype(dtype)))
+
+def _batches(rows, batch_rows, numpy_dtype):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_rows:
+            yield _batch(batch, numpy_dtype)
+            batch = []
+    if batch:
+        yield _batch(batch, numpy_dtype)
+
+def _batch(rows, numpy_dtype):
+    if numpy_dtype is None:
+        return rows
+    numpy, dtype = numpy_dtype
+    nan = float('nan')
+    floats = set(name for name in dtype.names if dtype[name].kind == 'f')
+    return numpy.array([tuple(nan if v is None and name in floats else v for name, v in zip(dtype.names, row))
+                        for row in rows], dtype=dtype)
+
+########################################
+# Concurrent queries.
+########################################
+
+class QueryTimeout(scidblib.AppError):
+    """A query of a QueryPool ran longer than its timeout, or a result was not ready in time."""
+    pass
+
+class QueryCancelled(scidblib.AppError):
+    """The query of a QueryFuture was cancelled."""
+    pass
+
+def _kill(p):
+    """Kill the process group of a query started by a QueryPool, or cancel its transport query."""
+    if hasattr(p, 'cancel'):
+        p.cancel()
+        return
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+    except OSError:
+        pass  # Already gone.
+
+class QueryFuture:
+    """The pending result of a query submitted to a QueryPool.
+
+    Details of public attributes:
+      - description: what the query is, for error messages.
+    """
+    def __init__(self, description, timeout):
+        self.description = description
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._state = 'pending'   # 'pending', 'running' or 'done'.
+        self._cancelled = False
+        self._timed_out = False
+        self._proc = None
+        self._result = None
+        self._error = None
+
+    def _finish(self, result, error):
+        self._result = result
+        self._error = error
+        self._done.set()
+
+    def _started(self, p):
+        """Note the process of the query; kill it if the query was cancelled or timed out meanwhile."""
+        with self._lock:
+            self._proc = p
+            too_late = self._cancelled or self._timed_out
+        if too_late:
+            _kill(p)
+
+    def _expire(self):
+        with self._lock:
+            if self._state != 'running':
+                return
+            self._timed_out = True
+            p = self._proc
+        if p:
+            _kill(p)
+
+    def _run(self, fn, args):
+        """Run the query in the current thread, unless it was cancelled."""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._state = 'running'
+        timer = None
+        if self._timeout:
+            timer = threading.Timer(self._timeout, self._expire)
+            timer.daemon = True
+            timer.start()
+        _worker.future = self
+        result = error = None
+        try:
+            result = fn(*args)
+        except Exception as e:
+            error = e
+        finally:
+            _worker.future = None
+            if timer:
+                # Joined, so that no timer thread outlives the query, e.g. at interpreter shutdown.
+                timer.cancel()
+                timer.join()
+        with self._lock:
+            self._state = 'done'
+            if self._cancelled:
+                result, error = None, QueryCancelled('The query %s was cancelled.' % self.description)
+            elif self._timed_out:
+                result, error = None, QueryTimeout('The query %s was killed after %g seconds.' % (
+                    self.description, self._timeout))
+        self._finish(result, error)
+
+    def cancel(self):
+        """Cancel the query: a pending one never runs, and a running one has its iquery killed.
+
+        SciDB aborts the query when its iquery client goes away.
+        @return False if the query had already finished, True otherwise.
+        """
+        with self._lock:
+            if self._state == 'done':
+                return False
+            self._cancelled = True
+            pending = self._state == 'pending'
+            if pending:
+                self._state = 'done'
+            p = self._proc
+        if pending:
+            self._finish(None, QueryCancelled('The query %s was cancelled.' % self.description))
+        elif p:
+            _kill(p)
+        return True
+
+    def cancelled(self):
+        """@return whether cancel() was called before the query finished."""
+        return self._cancelled
+
+    def done(self):
+        """@return whether the query finished, failed or was cancelled."""
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        """Wait for the query, and return its error.
+
+        @param timeout  the seconds to wait; None means as long as it takes.
+        @return the exception the query raised, or None if it succeeded.
+        @exception QueryTimeout if the query is still running after timeout seconds.
+        """
+        if not self._done.wait(timeout):
+            raise QueryTimeout('The query %s was not done after %g seconds.' % (self.description, timeout))
+        return self._error
+
+    def result(self, timeout=None):
+        """Wait for the query, and return what its function returned.
+
+        @param timeout  the seconds to wait; None means as long as it takes.
+        @return the result of the query function, e.g. (stdout_data, stderr_data) for afl().
+        @exception QueryTimeout if the query is still running after timeout seconds, or was killed by its own timeout.
+        @exception QueryCancelled if the query was cancelled.
+        @exception AppError (or whatever else the query function raised) if the query failed.
+        """
+        error = self.exception(timeout)
+        if error:
+            raise error
+        return self._result
+
+def wait(futures, timeout=None):
+    """Wait for several queries.
+
+    @param futures  QueryFuture objects.
+    @param timeout  the seconds to wait for all of them; None means as long as it takes.
+    @return (done, not_done), two lists of the futures.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    for future in futures:
+        left = None if deadline is None else max(0, deadline - time.time())
+        if not future._done.wait(left):
+            break
+    done = [f for f in futures if f.done()]
+    return done, [f for f in futures if not f.done()]
+
+class QueryPool:
+    """Run the queries of this module concurrently, in worker threads.
+
+    At most max_per_coordinator queries run at a time against the same coordinator,
+    i.e. the same -c host and -p port of iquery_cmd. Every query may have a timeout, after
+    which its iquery is killed, and every submission returns a QueryFuture.
+
+    A typical usage pattern is:
+      - with scidb_afl.QueryPool(max_per_coordinator=4, timeout=600) as pool:
+            counts = [(name, pool.single_cell_afl(iquery_cmd, 'op_count(%s)' % name, 1)) for name in names]
+            for name, future in counts:
+                print name, future.result()
+    Leaving the 'with' block waits for the queries; leaving it with an exception cancels them.
+    """
+    def __init__(self, max_per_coordinator=4, timeout=None):
+        """
+        @param max_per_coordinator  the maximum number of concurrent queries per coordinator.
+        @param timeout              the default timeout of a query in seconds; None means no timeout.
+        """
+        if max_per_coordinator < 1:
+            raise scidblib.AppError('A QueryPool needs at least one query per coordinator.')
+        self._max_per_coordinator = max_per_coordinator
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._queues = {}     # coordinator -> Queue.Queue of (future, fn, args).
+        self._threads = {}    # coordinator -> list of worker threads.
+        self._futures = set() # The futures not run yet or running.
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown(cancel=exc_type is not None)
+        return False
+
+    def _coordinator(self, iquery_cmd):
+        if _is_transport(iquery_cmd):
+            return iquery_cmd.coordinator()
+        host = re.search(r'\s-c\s+(\S+)', iquery_cmd)
+        port = re.search(r'\s-p\s+(\S+)', iquery_cmd)
+        return (host.group(1) if host else 'localhost', port.group(1) if port else '')
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            future, fn, args = item
+            future._run(fn, args)
+            with self._lock:
+                self._futures.discard(future)
+
+    def submit(self, iquery_cmd, fn, args=(), timeout=None):
+        """Run fn(iquery_cmd, *args) in a worker of the coordinator of iquery_cmd.
+
+        fn may be any function of this module or another one that runs its queries through
+        this module, e.g. scidb_storage.get_array_versions.
+        @param iquery_cmd  the iquery command.
+        @param fn          the function to call.
+        @param args        more arguments to fn.
+        @param timeout     the timeout of this query in seconds. Default is the timeout of the pool.
+        @return a QueryFuture.
+        @exception AppError if the pool was shut down.
+        """
+        description = str(args[0]) if args else fn.__name__
+        future = QueryFuture(description, timeout if timeout is not None else self._timeout)
+        key = self._coordinator(iquery_cmd)
+        with self._lock:
+            if self._closed:
+                raise scidblib.AppError('The QueryPool was shut down.')
+            queue = self._queues.setdefault(key, Queue.Queue())
+            threads = self._threads.setdefault(key, [])
+            if len(threads) < self._max_per_coordinator:
+                thread = threading.Thread(target=self._work, args=(queue,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            self._futures.add(future)
+        queue.put((future, fn, (iquery_cmd,) + tuple(args)))
+        return future
+
+    def afl(self, iquery_cmd, query, want_output=False, tolerate_error=False, timeout=None):
+        """Submit afl(iquery_cmd, query, want_output, tolerate_error).
+
+        @return a QueryFuture of (stdout_data, stderr_data).
+        """
+        return self.submit(iquery_cmd, afl, (query, want_output, tolerate_error), timeout)
+
+    def time_afl(self, iquery_cmd, query, timeout=None):
+        """Submit time_afl(iquery_cmd, query).
+
+        @return a QueryFuture of the execution time.
+        """
+        return self.submit(iquery_cmd, time_afl, (query,), timeout)
+
+    def single_cell_afl(self, iquery_cmd, query, num_attrs, timeout=None):
+        """Submit single_cell_afl(iquery_cmd, query, num_attrs).
+
+        @return a QueryFuture of the attribute value(s).
+        """
+        return self.submit(iquery_cmd, single_cell_afl, (query, num_attrs), timeout)
+
+    def shutdown(self, cancel=False):
+        """Stop the workers once they are idle, and wait for them.
+
+        @param cancel  whether to cancel the queries not done yet, rather than wait for them.
+        """
+        with self._lock:
+            self._closed = True
+            futures = list(self._futures)
+        if cancel:
+            for future in futures:
+                future.cancel()
+        for key, queue in self._queues.items():
+            for thread in self._threads[key]:
+                queue.put(None)
+        for threads in self._threads.values():
+            for thread in threads:
+                # A timed join keeps Ctrl-C working in Python 2.
+                while thread.is_alive():
+                    thread.join(1.0)
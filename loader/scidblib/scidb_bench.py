@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Measuring benchmark stages, and keeping their results in a history with baselines.
+
+A typical usage pattern is:
+  - history = BenchHistory('bench_history.json')
+  - m = measure('zcat big.vcf.gz > /dev/null')
+  - results = {'decompress/20k': {'seconds': m.seconds, 'throughput': size / m.seconds,
+                                  'max_rss_kb': m.max_rss_kb}}
+  - regressions = find_regressions(results, history.baselines(), 0.2, 'throughput')
+  - history.add_run('nightly', results)
+  - history.save()
+"""
+
+import json
+import os
+import socket
+import subprocess
+import time
+import scidblib
+from scidblib import scidb_progress
+from scidblib.util import superTuple
+
+Measurement = superTuple('Measurement', 'seconds', 'user', 'sys', 'max_rss_kb', 'exit_status')
+Regression = superTuple('Regression', 'key', 'metric', 'baseline', 'current', 'change')
+
+def measure(cmd, cwd=None, env=None, stdin=None, stdout=None):
+    """Run a command and measure its wall time, CPU time and peak memory.
+
+    The resource usage comes from os.wait4(), so it covers the command and all the
+    descendants it waited for, e.g. every process of a shell pipeline; max_rss_kb is the
+    peak resident set size of the largest of them.
+
+    @param cmd     a shell command line.
+    @param cwd     the working directory. Default is the current one.
+    @param env     the environment. Default is the current one.
+    @param stdin   a file object for the standard input. Default is inherited.
+    @param stdout  a file object for the standard output. Default is inherited.
+    @return a Measurement.
+    @exception AppError if the command fails.
+    """
+    start = time.time()
+    p = subprocess.Popen(cmd, shell=True, cwd=cwd, env=env, stdin=stdin, stdout=stdout)
+    pid, status, rusage = os.wait4(p.pid, 0)
+    seconds = time.time() - start
+    p.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if p.returncode != 0:
+        raise scidblib.AppError('The benchmark command, %s, failed with exit status %d.' % (cmd, p.returncode))
+    return Measurement(seconds, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss, p.returncode)
+
+def find_regressions(results, baselines, threshold, metric, higher_is_better=True):
+    """Compare results with their baselines.
+
+    @param results           a dict mapping a key, e.g. 'parse/2504x20000', to a dict of metrics.
+    @param baselines         a dict of the same form.
+    @param threshold         the tolerated relative change, e.g. 0.2 for 20%.
+    @param metric            the metric to compare, e.g. 'throughput' or 'seconds'.
+    @param higher_is_better  whether a larger value of the metric is an improvement.
+    @return a list of Regression tuples, one per key that got worse by more than threshold;
+            change is the relative change in the bad direction, e.g. 0.35 for 35% worse.
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baselines or metric not in baselines[key] or metric not in results[key]:
+            continue
+        baseline = baselines[key][metric]
+        current = results[key][metric]
+        if not baseline:
+            continue
+        change = (baseline - current) * 1.0 / baseline if higher_is_better else (current - baseline) * 1.0 / baseline
+        if change > threshold:
+            regressions.append(Regression(key, metric, baseline, current, change))
+    return regressions
+
+class BenchHistory:
+    """A JSON file with the results of every benchmark run, and the baseline of every key."""
+    def __init__(self, path):
+        """
+        @param path  the JSON file; it is created by the first save().
+        """
+        self._path = path
+        self._data = {'runs': [], 'baselines': {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._data = json.load(f)
+
+    def runs(self):
+        """@return the list of runs, oldest first; every run is a dict with 'time', 'host', 'label' and 'results'."""
+        return self._data['runs']
+
+    def baselines(self):
+        """@return a dict mapping every key to its baseline metrics."""
+        return self._data['baselines']
+
+    def add_run(self, label, results, meta=None):
+        """Append a run to the history.
+
+        @param label    a free-form name of the run, e.g. a git revision.
+        @param results  a dict mapping keys to dicts of metrics.
+        @param meta     additional facts about the run, e.g. the options it ran with.
+        """
+        run = {'time': scidb_progress.datetime_as_str(), 'host': socket.gethostname(),
+               'label': label, 'results': results}
+        if meta:
+            run['meta'] = meta
+        self._data['runs'].append(run)
+
+    def set_baselines(self, results, only_missing=False):
+        """Make results the baselines of their keys.
+
+        @param results       a dict mapping keys to dicts of metrics.
+        @param only_missing  only set the baselines of the keys that have none yet.
+        @return the list of keys whose baseline was set.
+        """
+        keys = [key for key in sorted(results) if not only_missing or key not in self._data['baselines']]
+        for key in keys:
+            self._data['baselines'][key] = results[key]
+        return keys
+
+    def results_of(self, key):
+        """@return the results of a key in all runs, oldest first."""
+        return [run['results'][key] for run in self._data['runs'] if key in run['results']]
+
+    def save(self):
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.rename(tmp, self._path)
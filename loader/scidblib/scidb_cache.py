@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""A cache of the results of read-only AFL queries, invalidated by new array versions.
+
+Every insert() or store() into an array creates a new version of it (see scidb_storage.py),
+so the result of a query that only reads persistent arrays stays valid as long as none of
+them has a new version. An entry is keyed by the normalized query text, and remembers the
+id and latest version id of every array the query names. Version ids start again at 1
+when an array is removed and created again, but the id of the array, from the id column
+of list('arrays', true), is never reused. A lookup runs one cheap probe,
+list('arrays', true), which lists the versions of all arrays at once; an entry whose
+arrays moved on since it was stored is dropped, and the query runs again.
+
+The entries are kept in memory, least recently used first out beyond max_entries or
+max_memory_bytes, and optionally in a directory, oldest first out beyond max_disk_bytes,
+so that later sessions reuse them.
+
+Queries are run directly, without caching, when they write (insert, store, remove...),
+when they name no array, or when they name a temp array, which has no versions.
+
+A typical usage pattern is:
+  - cache = QueryCache(iquery_cmd, disk_dir=os.path.expanduser('~/.scidb_query_cache'))
+  - num_samples = cache.single_cell_afl('op_count(KG_SAMPLE)', 1)
+  - out_data, err_data = cache.afl("filter(KG_VARIANT, signature = '21:9411239 G>A')")
+"""
+
+import collections
+import hashlib
+import os
+import re
+import cPickle as pickle
+from scidblib import scidb_afl
+
+# The operators that change the database: their queries are never cached.
+WRITE_OPERATORS = set(['insert', 'store', 'remove', 'remove_versions', 'rename', 'create', 'load', 'input',
+                       'redimension_store', 'delete', 'load_library', 'unload_library', 'cancel', 'save'])
+
+def normalize(query):
+    """Collapse the white space of an AFL query, outside of its string literals.
+
+    @param query  the AFL query.
+    @return the normalized query.
+    """
+    parts = re.split(r"('(?:[^'\\]|\\.)*')", query)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s*([(),=<>])\s*', r'\1', ' '.join(parts[i].split()))
+    return ''.join(parts).strip()
+
+def referenced_names(query):
+    """Find the names a query may use as arrays.
+
+    @param query  the AFL query.
+    @return (names, operators): the sets of the identifiers outside string literals that are,
+            and that are not, followed by an opening parenthesis.
+    """
+    text = re.sub(r"'(?:[^'\\]|\\.)*'", "''", query)
+    names = set(re.findall(r'\b([A-Za-z_]\w*)\b(?!\s*\()', text))
+    operators = set(re.findall(r'\b([A-Za-z_]\w*)\s*\(', text))
+    return names, operators
+
+def probe_versions(iquery_cmd):
+    """Get the id and latest version id of every array, with one query.
+
+    @param iquery_cmd  the iquery command.
+    @return a dict mapping every array name to an (array id, latest version id) tuple, or to
+            None for a temp array. The version id is 0 if the array has no version; the array
+            id is None if list('arrays', true) has no id column.
+    @exception AppError if the query fails.
+    """
+    ids = {}
+    latest = {}
+    temporary = set()
+    for row in scidb_afl.afl_rows(iquery_cmd, "list('arrays', true)"):
+        name, sep, version = row.name.partition('@')
+        if getattr(row, 'temporary', 'false') == 'true':
+            temporary.add(name)
+        elif sep:
+            latest[name] = max(latest.get(name, 0), long(version))
+        else:
+            array_id = getattr(row, 'id', None)
+            ids[name] = long(array_id) if array_id else None
+    versions = dict((name, (ids.get(name), latest.get(name, 0))) for name in set(ids) | set(latest))
+    versions.update((name, None) for name in temporary)
+    return versions
+
+class QueryCache:
+    """Cache the results of read-only queries until the arrays they read get a new version."""
+    def __init__(self, iquery_cmd, max_entries=256, max_memory_bytes=64 << 20, disk_dir=None,
+                 max_disk_bytes=1 << 30):
+        """
+        @param iquery_cmd        the iquery command, or a scidb_transport.Transport.
+        @param max_entries       the maximum number of entries in memory.
+        @param max_memory_bytes  the maximum size of the entries in memory, pickled.
+        @param disk_dir          a directory to keep the entries in across processes; None means memory only.
+        @param max_disk_bytes    the maximum size of the directory.
+        """
+        self._iquery_cmd = iquery_cmd
+        self._max_entries = max_entries
+        self._max_memory_bytes = max_memory_bytes
+        self._disk_dir = disk_dir
+        self._max_disk_bytes = max_disk_bytes
+        self._memory = collections.OrderedDict()   # key -> (versions, value, size), least recently used first.
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if disk_dir and not os.path.isdir(disk_dir):
+            os.makedirs(disk_dir)
+
+    def _key(self, kind, query):
+        # The coordinator and output format are part of the key: they change the result.
+        return hashlib.sha1('\0'.join([' '.join(str(self._iquery_cmd).split()), kind, query])).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._disk_dir, key + '.pickle')
+
+    def _remember(self, key, versions, value, size):
+        old = self._memory.pop(key, None)
+        if old:
+            self._memory_bytes -= old[2]
+        self._memory[key] = (versions, value, size)
+        self._memory_bytes += size
+        while self._memory and (len(self._memory) > self._max_entries or self._memory_bytes > self._max_memory_bytes):
+            evicted_key, (versions, value, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def _forget(self, key):
+        old = self._memory.pop(key, None)
+        if old:
+            self._memory_bytes -= old[2]
+        if self._disk_dir:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass   # Not on disk, or another process removed it first.
+
+    def _lookup(self, key):
+        """@return the (versions, value, size) of an entry, from memory or disk, or None."""
+        if key in self._memory:
+            entry = self._memory.pop(key)
+            self._memory[key] = entry
+            return entry
+        if not self._disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            versions, value = pickle.loads(data)
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        os.utime(path, None)   # The disk store evicts the least recently used files first.
+        self._remember(key, versions, value, len(data))
+        return versions, value, len(data)
+
+    def _store_on_disk(self, key, data):
+        path = self._path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+        files = []
+        for name in os.listdir(self._disk_dir):
+            if name.endswith('.pickle'):
+                st = os.stat(os.path.join(self._disk_dir, name))
+                files.append((st.st_mtime, st.st_size, name))
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if total <= self._max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self._disk_dir, name))
+            except OSError:
+                pass   # Another process evicted it first.
+            total -= size
+
+    def dependencies(self, query):
+        """Get the current versions of the arrays a query reads.
+
+        @param query  the AFL query.
+        @return a dict mapping array name to (array id, version id), or None if the query may not be cached.
+        @exception AppError if the probe query fails.
+        """
+        names, operators = referenced_names(query)
+        if operators & WRITE_OPERATORS:
+            return None
+        current = probe_versions(self._iquery_cmd)
+        arrays = names & set(current)
+        if not arrays or any(current[name] is None for name in arrays):
+            return None
+        return dict((name, current[name]) for name in arrays)
+
+    def get(self, kind, query, compute):
+        """Return the cached result of a query, or compute and cache it.
+
+        @param kind     what compute returns, e.g. 'afl', so that different results of a query have different keys.
+        @param query    the AFL query.
+        @param compute  a function taking iquery_cmd and query and returning a picklable result.
+        @return the result.
+        """
+        versions = self.dependencies(query)
+        if versions is None:
+            return compute(self._iquery_cmd, query)
+        key = self._key(kind, normalize(query))
+        entry = self._lookup(key)
+        if entry is not None:
+            if entry[0] == versions:
+                self.hits += 1
+                return entry[1]
+            self._forget(key)
+        self.misses += 1
+        value = compute(self._iquery_cmd, query)
+        data = pickle.dumps((versions, value), pickle.HIGHEST_PROTOCOL)
+        self._remember(key, versions, value, len(data))
+        if self._disk_dir:
+            self._store_on_disk(key, data)
+        return value
+
+    def afl(self, query, want_output=True):
+        """Like scidb_afl.afl(), cached when possible.
+
+        @return (stdout_data, stderr_data)
+        @exception AppError if the query fails; failures are not cached.
+        """
+        return self.get('afl/%s' % want_output, query,
+                        lambda iquery_cmd, q: scidb_afl.afl(iquery_cmd, q, want_output=want_output))
+
+    def single_cell_afl(self, query, num_attrs):
+        """Like scidb_afl.single_cell_afl(), cached when possible."""
+        return self.get('single_cell/%d' % num_attrs, query,
+                        lambda iquery_cmd, q: scidb_afl.single_cell_afl(iquery_cmd, q, num_attrs))
+
+    def rows(self, query, schema=None):
+        """Like list(scidb_afl.afl_rows()), cached when possible; the rows become plain tuples."""
+        return self.get('rows/%s' % (schema,), query,
+                        lambda iquery_cmd, q: [tuple(row) for row in scidb_afl.afl_rows(iquery_cmd, q, schema)])
+
+    def clear(self):
+        """Drop every entry, in memory and on disk."""
+        self._memory.clear()
+        self._memory_bytes = 0
+        if self._disk_dir:
+            for name in os.listdir(self._disk_dir):
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(self._disk_dir, name))
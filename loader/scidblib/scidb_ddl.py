@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Bring a set of arrays to a desired state with as few queries as possible.
+
+Each remove(), create array or remove_versions() is a query of its own, and every query
+takes the coordinator's locks and catalog round trips, so a script that resets a dozen
+buffers the naive way, one iquery call each, competes with every other load for them.
+Instead, the desired arrays are declared: the arrays to be present, with their schemas,
+the arrays to be absent, and how many versions to keep. One probe, list('arrays', true),
+finds what exists, and only the missing statements run, as one script in one session.
+
+A typical usage pattern is:
+  - desired = [DesiredArray('P_KG_VAR_BUF', '<chrom:string, pos:int64> [n=0:*,1000000,0]', fresh=True),
+               DesiredArray('P_KG_VID_SIDE_BUF'),
+               DesiredArray('KG_GENOTYPE', keep_versions=1)]
+  - plan = ensure_arrays(iquery_cmd, desired)
+  - plan.removes, plan.creates and plan.trims list the statements that ran.
+
+Declarations can also be read from AFL scripts of create array and remove() statements,
+e.g. kgenomes_schema.afl, with parse_script().
+"""
+
+import collections
+import re
+import scidblib
+from scidblib import scidb_afl
+from scidblib import scidb_schema
+from scidblib.util import superTuple
+
+ExistingArray = superTuple('ExistingArray', 'name', 'schema', 'temporary', 'versions')
+Plan = superTuple('Plan', 'removes', 'creates', 'trims', 'mismatched')
+
+class DesiredArray:
+    """The desired state of one array."""
+    def __init__(self, name, schema=None, temporary=False, fresh=False, keep_versions=None):
+        """
+        @param name           the array name.
+        @param schema         the schema, e.g. '<a:int64> [i=0:*,1000,0]'; None for an array that must not exist.
+        @param temporary      whether the array is to be created as a temp array.
+        @param fresh          whether the array must be empty: an existing one is removed and created again.
+        @param keep_versions  the number of latest versions to keep, or None to keep them all.
+        """
+        assert keep_versions is None or keep_versions > 0
+        self.name = name
+        self.schema = schema
+        self.temporary = temporary
+        self.fresh = fresh
+        self.keep_versions = keep_versions
+
+    def create_statement(self):
+        return 'create ' + ('temp ' if self.temporary else '') + 'array ' + self.name + ' ' + self.schema
+
+def probe_arrays(iquery_cmd):
+    """Get the schema and version ids of every array, with one query.
+
+    @param iquery_cmd  the iquery command, or a scidb_transport.Transport.
+    @return a dict mapping every array name to an ExistingArray, whose versions is the sorted
+            list of its version ids.
+    @exception AppError if the query fails.
+    """
+    arrays = {}
+    for row in scidb_afl.afl_rows(iquery_cmd, "list('arrays', true)"):
+        name, sep, version = row.name.partition('@')
+        if name not in arrays:
+            arrays[name] = ExistingArray(name, None, getattr(row, 'temporary', 'false') == 'true', [])
+        if sep:
+            arrays[name].versions.append(long(version))
+        else:
+            arrays[name] = ExistingArray(name, re.sub(r'^[^<]*', '', getattr(row, 'schema', '')),
+                                         arrays[name].temporary, arrays[name].versions)
+    for array in arrays.values():
+        array.versions.sort()
+    return arrays
+
+def _normalized(schema):
+    """@return the attributes and dimensions of a schema, in a form that ignores spacing and NOT NULL."""
+    attrs, dims = scidb_schema.parse(schema)
+    normalized_attrs = []
+    for attr in attrs:
+        words = attr.type.split()
+        normalized_attrs.append((attr.name, words[0], 'null' in words and 'not' not in words))
+    return normalized_attrs, [tuple(dim) for dim in dims]
+
+def same_schema(schema1, schema2):
+    """Tell whether two schemas declare the same attributes and dimensions.
+
+    @return True if they do; False if they differ, or if either does not parse.
+    """
+    try:
+        return _normalized(schema1) == _normalized(schema2)
+    except ValueError:
+        return False
+
+def plan(existing, desired):
+    """Work out the statements that bring the arrays to their desired state.
+
+    An array declared more than once takes its last declaration. An existing array that is not
+    fresh but has another schema than declared is kept as is, since it may hold data, and listed
+    in the plan's mismatched.
+    @param existing  the dict returned by probe_arrays().
+    @param desired   a list of DesiredArray.
+    @return a Plan, whose removes, creates and trims are lists of statements to run in this order.
+    """
+    latest = collections.OrderedDict()
+    for array in desired:
+        latest.pop(array.name, None)
+        latest[array.name] = array
+    removes = []
+    creates = []
+    trims = []
+    mismatched = []
+    for array in latest.values():
+        current = existing.get(array.name)
+        if array.schema is None:
+            if current:
+                removes.append('remove(' + array.name + ')')
+            continue
+        if current and array.fresh:
+            removes.append('remove(' + array.name + ')')
+            current = None
+        if not current:
+            creates.append(array.create_statement())
+            continue
+        if current.temporary != array.temporary or not same_schema(current.schema, array.schema):
+            mismatched.append(array.name)
+        if array.keep_versions and len(current.versions) > array.keep_versions:
+            trims.append('remove_versions(' + array.name + ', ' +
+                         str(current.versions[-array.keep_versions]) + ')')
+    return Plan(removes, creates, trims, mismatched)
+
+def ensure_arrays(iquery_cmd, desired, dry_run=False):
+    """Bring arrays to their desired state, with one probe and one script.
+
+    @param iquery_cmd  the iquery command, or a scidb_transport.Transport.
+    @param desired     a list of DesiredArray.
+    @param dry_run     whether to only work out the plan, without running it.
+    @return the Plan.
+    @exception AppError if a query fails.
+    """
+    the_plan = plan(probe_arrays(iquery_cmd), desired)
+    if not dry_run:
+        scidb_afl.afl_script(iquery_cmd, the_plan.removes + the_plan.creates + the_plan.trims)
+    return the_plan
+
+def parse_script(text, fresh=False):
+    """Read declarations from an AFL script of create array and remove() statements.
+
+    @param text   the script.
+    @param fresh  whether the arrays created by the script must be empty.
+    @return a list of DesiredArray, in the order of the script.
+    @exception AppError on another kind of statement.
+    """
+    desired = []
+    for statement in text.split(';'):
+        statement = ' '.join(statement.split())
+        if not statement:
+            continue
+        m = re.match(r'(?i)create\s+(temp\s+)?array\s+(\w+)\s*(<.*)$', statement)
+        if m:
+            desired.append(DesiredArray(m.group(2), m.group(3), temporary=bool(m.group(1)), fresh=fresh))
+            continue
+        m = re.match(r'(?i)remove\s*\(\s*(\w+)\s*\)$', statement)
+        if m:
+            desired.append(DesiredArray(m.group(1)))
+            continue
+        raise scidblib.AppError('Only create array and remove() statements declare arrays, not: ' + statement)
+    return desired
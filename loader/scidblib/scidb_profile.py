@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Opt-in profiling of a script and the resource usage of its child processes.
+
+Profiling is off unless the environment variable SCIDB_PROFILE is set, to a comma-separated
+list of:
+  - cprofile:      deterministic profiling of every Python call, with cProfile.
+  - sample[:MS]:   statistical profiling: the Python stack is sampled every MS milliseconds of
+                   CPU time (default 5), with a SIGPROF timer.
+The artifacts go to $SCIDB_PROFILE_DIR (default the current directory), named after the
+script and its pid:
+  - <name>.<pid>.pstats:       with cprofile; read it with pstats or snakeviz.
+  - <name>.<pid>.collapsed:    with sample; one 'frame;frame;frame count' line per stack,
+                               as flamegraph.pl expects.
+  - <name>.<pid>.profile.json: the elapsed time and rusage of the script itself, and the
+                               rusage of every child process reaped through wait(), poll() or communicate().
+
+A typical usage pattern is:
+  - if __name__ == '__main__':
+        sys.exit(scidb_profile.run(main, 'myscript'))
+  - p = subprocess.Popen(...)
+    ret = scidb_profile.wait(p, 'split')      # instead of p.wait()
+
+When SCIDB_PROFILE is not set, run() calls main directly and wait(), poll() and communicate()
+call the Popen methods directly, so there is nothing to pay.
+"""
+
+import errno
+import json
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+import scidblib
+
+DEFAULT_SAMPLE_MS = 5
+
+_active = None
+
+def _rusage_dict(ru):
+    return {'user': ru.ru_utime, 'sys': ru.ru_stime, 'max_rss_kb': ru.ru_maxrss,
+            'major_faults': ru.ru_majflt, 'in_blocks': ru.ru_inblock, 'out_blocks': ru.ru_oublock,
+            'voluntary_switches': ru.ru_nvcsw, 'involuntary_switches': ru.ru_nivcsw}
+
+class StackSampler:
+    """Count the Python stacks seen by a SIGPROF timer."""
+    def __init__(self, interval):
+        """
+        @param interval  the seconds of CPU time between two samples.
+        """
+        self._interval = interval
+        self.counts = {}
+        self._old_handler = None
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def _on_signal(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_name(frame))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def start(self):
+        self._old_handler = signal.signal(signal.SIGPROF, self._on_signal)
+        # Restart the system calls the timer interrupts, rather than failing them with EINTR.
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._old_handler or signal.SIG_DFL)
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for key in sorted(self.counts):
+                f.write('%s %d\n' % (key, self.counts[key]))
+
+class Profiler:
+    """Profile the current process, and collect the rusage of its children, for one run."""
+    def __init__(self, name, spec, out_dir):
+        """
+        @param name     the name of the run, e.g. the script name.
+        @param spec     the value of SCIDB_PROFILE.
+        @param out_dir  where to write the artifacts.
+        @exception AppError if spec names an unknown mode.
+        """
+        self.name = name
+        self.spec = spec
+        self.base = os.path.join(out_dir, '%s.%d' % (name, os.getpid()))
+        self.children = []
+        self.labels = {}      # pid -> label of the children named before they were reaped.
+        self._cprofile = None
+        self._sampler = None
+        self._start_time = None
+        for mode in spec.split(','):
+            mode = mode.strip()
+            if mode == 'cprofile':
+                import cProfile
+                self._cprofile = cProfile.Profile()
+            elif mode == 'sample' or mode.startswith('sample:'):
+                ms = float(mode.split(':', 1)[1]) if ':' in mode else DEFAULT_SAMPLE_MS
+                self._sampler = StackSampler(ms / 1000.0)
+            elif mode:
+                raise scidblib.AppError('Unknown SCIDB_PROFILE mode %s; use cprofile and/or sample[:MS].' % mode)
+
+    def start(self):
+        self._start_time = time.time()
+        if self._sampler:
+            self._sampler.start()
+        if self._cprofile:
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile:
+            self._cprofile.disable()
+        if self._sampler:
+            self._sampler.stop()
+
+    def record_child(self, pid, label, status, usage):
+        """Add the resource usage of a reaped child.
+
+        @param pid     the pid of the child.
+        @param label   what the child was doing; None means the label given to name_child(), if any.
+        @param status  the exit status, negative for a signal.
+        @param usage   a dict of rusage fields, as _rusage_dict() returns.
+        """
+        if label is None:
+            label = self.labels.pop(pid, None)
+        else:
+            self.labels.pop(pid, None)
+        child = {'pid': pid, 'label': label, 'exit_status': status,
+                 'reaped_at': time.time() - self._start_time}
+        child.update(usage)
+        self.children.append(child)
+
+    def reap(self, p, label, options):
+        """Reap a child with wait4(), keeping its rusage.
+
+        @return the exit status, or None if options has WNOHANG and the child is still running.
+        """
+        if p.returncode is not None:
+            return p.returncode
+        while True:
+            try:
+                pid, status, ru = os.wait4(p.pid, options)
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    # Reaped behind our back, e.g. by a SIGCHLD handler; Popen reports 0 in this case too.
+                    p.returncode = 0
+                    return 0
+                raise
+        if pid == 0:
+            return None
+        p.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        self.record_child(p.pid, label, p.returncode, _rusage_dict(ru))
+        return p.returncode
+
+    def write(self):
+        """Write the artifacts of the run.
+
+        @return the list of files written.
+        """
+        files = []
+        if self._cprofile:
+            self._cprofile.dump_stats(self.base + '.pstats')
+            files.append(self.base + '.pstats')
+        if self._sampler:
+            self._sampler.write_collapsed(self.base + '.collapsed')
+            files.append(self.base + '.collapsed')
+        totals = {}
+        for key in ('user', 'sys'):
+            totals[key] = sum(c[key] for c in self.children if c[key] is not None)
+        totals['max_rss_kb'] = max([c['max_rss_kb'] for c in self.children if c['max_rss_kb'] is not None] or [0])
+        summary = {'name': self.name, 'pid': os.getpid(), 'argv': sys.argv, 'profile': self.spec,
+                   'elapsed': time.time() - self._start_time,
+                   'self': _rusage_dict(resource.getrusage(resource.RUSAGE_SELF)),
+                   'children': self.children, 'children_total': totals,
+                   'files': [os.path.basename(f) for f in files]}
+        with open(self.base + '.profile.json', 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        files.append(self.base + '.profile.json')
+        return files
+
+def enabled():
+    """@return whether profiling is on in this process."""
+    return _active is not None
+
+def start(name):
+    """Start profiling the process if SCIDB_PROFILE asks for it.
+
+    @param name  the name of the artifacts, e.g. the script name.
+    @return the Profiler, or None if profiling is off or already on.
+    """
+    global _active
+    spec = os.getenv('SCIDB_PROFILE')
+    if not spec or _active is not None:
+        return None
+    _active = Profiler(name, spec, os.getenv('SCIDB_PROFILE_DIR', '.'))
+    _active.start()
+    return _active
+
+def stop():
+    """Stop profiling and write the artifacts.
+
+    @return the list of files written; empty if profiling was off.
+    """
+    global _active
+    if _active is None:
+        return []
+    profiler = _active
+    _active = None
+    profiler.stop()
+    files = profiler.write()
+    print >> sys.stderr, 'Profile written to %s.' % ', '.join(files)
+    return files
+
+def run(main, name):
+    """Call main(), profiled if SCIDB_PROFILE asks for it.
+
+    @param main  the function to call.
+    @param name  the name of the artifacts.
+    @return what main() returns.
+    """
+    if not os.getenv('SCIDB_PROFILE'):
+        return main()
+    start(name)
+    try:
+        return main()
+    finally:
+        stop()
+
+def name_child(p, label):
+    """Label a child that is reaped elsewhere, e.g. by poll() in a cleanup loop."""
+    if _active is not None:
+        _active.labels[p.pid] = label
+
+def wait(p, label=None):
+    """Like p.wait(), but keeps the rusage of the child when profiling.
+
+    @param p      a subprocess.Popen object.
+    @param label  what the child was doing, e.g. 'split'.
+    @return the exit status.
+    """
+    if _active is None:
+        return p.wait()
+    return _active.reap(p, label, 0)
+
+def poll(p, label=None):
+    """Like p.poll(), but keeps the rusage of the child when profiling.
+
+    @return the exit status, or None if the child is still running.
+    """
+    if _active is None:
+        return p.poll()
+    return _active.reap(p, label, os.WNOHANG)
+
+def _read_all(f, outputs, name):
+    outputs[name] = f.read()
+    f.close()
+
+def communicate(p, label=None, input=None):
+    """Like p.communicate(), but keeps the rusage of the child when profiling.
+
+    The pipes are read here rather than by Popen.communicate(), which would reap the child
+    itself, so that the child is reaped with wait4() and its own rusage is kept, even while
+    other threads, e.g. of a QueryPool, reap children of their own.
+
+    @return (stdout_data, stderr_data)
+    """
+    if _active is None:
+        return p.communicate(input)
+    outputs = {}
+    readers = []
+    for name in ('stdout', 'stderr'):
+        f = getattr(p, name)
+        if f:
+            reader = threading.Thread(target=_read_all, args=(f, outputs, name))
+            reader.daemon = True
+            reader.start()
+            readers.append(reader)
+    if p.stdin:
+        try:
+            if input:
+                p.stdin.write(input)
+            p.stdin.close()
+        except IOError as e:
+            if e.errno not in (errno.EPIPE, errno.EINVAL):
+                raise   # As Popen.communicate(), ignore a child that exited without reading its input.
+    for reader in readers:
+        reader.join()
+    _active.reap(p, label, 0)
+    return outputs.get('stdout'), outputs.get('stderr')
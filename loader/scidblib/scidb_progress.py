@@ -22,7 +22,11 @@
 import sys
 import os
 import datetime
+import json
+import math
 import re
+import threading
+import time
 import scidblib
 
 def datetime_as_str(the_datetime = None, format = '%Y-%m-%d %H:%M:%S'):
@@ -35,6 +39,28 @@ def datetime_as_str(the_datetime = None, format = '%Y-%m-%d %H:%M:%S'):
         the_datetime = datetime.datetime.now()
     return the_datetime.strftime(format)
 
+def format_seconds(seconds):
+    """@return a duration like '42 s', '12.5 min' or '5.5 h'."""
+    if seconds < 60:
+        return '%.0f s' % seconds
+    if seconds < 3600:
+        return '%.1f min' % (seconds / 60)
+    return '%.1f h' % (seconds / 3600)
+
+def format_bytes(num_bytes):
+    """@return a size like '3.2 GB'."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024:
+            return '%.1f %s' % (num_bytes, unit)
+        num_bytes /= 1024.0
+    return '%.1f TB' % num_bytes
+
+def format_amount(amount, unit):
+    """@return an amount of a unit like '3.2 GB' for bytes, or '1,234,567 rows'."""
+    if unit == 'bytes':
+        return format_bytes(amount)
+    return '{0:,} {1}'.format(int(amount), unit)
+
 class VersionAndDate:
     """A class that makes it easy to parse, generate, or compare version and date.
 
@@ -136,62 +162,122 @@ class ProgressTracker:
       - Call register_step() to register all steps of an algorithm.
       - Call start_step() at the beginning of each step.
       - Call end_step() at the end of each step.
+
+    A step may have sub-steps, registered with a parent, and a counter of units (rows, bytes...)
+    with an expected total: advance() moves the counter, and the tracker keeps a smoothed rate
+    and an estimated time to completion, which it prints every report_interval seconds. A step
+    without a total of its own estimates its completion from its sub-steps.
+
+    Every start, end, skip and progress report is also passed to the sink, if any, as a dict;
+    JsonLinesSink and StatusFileSink write them for other programs to read.
     """
     def __init__(self, out=sys.stdout, name='',
                  if_print_start=True, if_print_end=True, if_print_skip=True,
                  prefix_start='*** ', prefix_end='*** ', prefix_skip='*** ',
-                 suffix_start=' ***', suffix_end=' ***', suffix_skip=' ***'):
+                 suffix_start=' ***', suffix_end=' ***', suffix_skip=' ***',
+                 if_print_progress=True, prefix_progress='*** ', suffix_progress=' ***',
+                 report_interval=60.0, smoothing=60.0, sink=None):
         """Configure a ProgressTracker object with some optional configurations.
 
-        @param out            where to print output to. Default is sys.stdout.
-        @param name           a name to be printed along with every step. Default is ''.
-        @param if_print_start whether to print a message when a step has started. Default is True.
-        @param if_print_end   whether to print a message when a step has ended. Default is True.
-        @param if_print_skip  whether to print a message when a step is skipped. Default is True.
-        @param prefix_start   a prefix string for a start message. Default is '*** '.
-        @param prefix_end     a prefix string for a end message.   Default is '*** '.
-        @param prefix_skip    a prefix string for a skip message.  Default is '*** '.
-        @param suffix_start   a suffix string for a start message. Default is ' ***'.
-        @param suffix_end     a suffix string for a end message.   Default is ' ***'.
-        @param suffix_skip    a suffix string for a skip message.  Default is ' ***'.
+        @param out               where to print output to. Default is sys.stdout.
+        @param name              a name to be printed along with every step. Default is ''.
+        @param if_print_start    whether to print a message when a step has started. Default is True.
+        @param if_print_end      whether to print a message when a step has ended. Default is True.
+        @param if_print_skip     whether to print a message when a step is skipped. Default is True.
+        @param prefix_start      a prefix string for a start message. Default is '*** '.
+        @param prefix_end        a prefix string for a end message.   Default is '*** '.
+        @param prefix_skip       a prefix string for a skip message.  Default is '*** '.
+        @param suffix_start      a suffix string for a start message. Default is ' ***'.
+        @param suffix_end        a suffix string for a end message.   Default is ' ***'.
+        @param suffix_skip       a suffix string for a skip message.  Default is ' ***'.
+        @param if_print_progress whether to print the progress of the steps with a counter. Default is True.
+        @param prefix_progress   a prefix string for a progress message. Default is '*** '.
+        @param suffix_progress   a suffix string for a progress message. Default is ' ***'.
+        @param report_interval   the seconds between two progress reports of a step. Default is 60.
+        @param smoothing         the time constant of the rate estimate, in seconds: the rate of the
+                                 last `smoothing` seconds weighs about as much as all the earlier ones.
+                                 Default is 60.
+        @param sink              a callable taking an event dict and this tracker, e.g. a JsonLinesSink.
+                                 Default is None.
         """
         self._out = out
         self._name = name
-        self._if_print = {}   # a dict mapping ('start' | 'end' | 'skip') to a boolean telling whether to print.
-        self._prefix = {}     # a dict mapping ('start' | 'end' | 'skip') to a prefix string.
-        self._suffix = {}     # a dict mapping ('start' | 'end' | 'skip') to a suffix string.
+        self._if_print = {}   # a dict mapping ('start' | 'end' | 'skip' | 'progress') to a boolean telling whether to print.
+        self._prefix = {}     # a dict mapping ('start' | 'end' | 'skip' | 'progress') to a prefix string.
+        self._suffix = {}     # a dict mapping ('start' | 'end' | 'skip' | 'progress') to a suffix string.
         self._verb = {}       # a dict mapping ('start' | 'end' | 'skip') to a verb string.
         self._id_2_name = {}  # a dict mapping step_id to step_name.
-        self._id_2_index = {} # a dict mapping step_id to step number.
+        self._id_2_index = {} # a dict mapping step_id to step number, among the steps of its parent.
         self._start_time = {} # a dict mapping step_id to start time of the step.
         self._end_time = {}   # a dict mapping step_id to end time of the step.
+        self._parent = {}     # a dict mapping step_id to the step_id of its parent, or None.
+        self._children = {None: []}  # a dict mapping step_id (None for the top) to its sub-steps, in order.
+        self._skipped = set() # the step_ids of the skipped steps.
+        self._counter = {}    # a dict mapping step_id to its _Counter.
+        self._report_interval = report_interval
+        self._smoothing = smoothing
+        self._sink = sink
+        self._lock = threading.Lock()
 
         self._if_print['start'] = if_print_start
         self._if_print['end'] =   if_print_end
         self._if_print['skip'] =  if_print_skip
+        self._if_print['progress'] = if_print_progress
 
         self._prefix['start'] = prefix_start
         self._prefix['end'] =   prefix_end
         self._prefix['skip'] =  prefix_skip
+        self._prefix['progress'] = prefix_progress
 
         self._suffix['start'] = suffix_start
         self._suffix['end'] =   suffix_end
         self._suffix['skip'] =  suffix_skip
+        self._suffix['progress'] = suffix_progress
 
         self._verb['start'] = 'has started'
         self._verb['end'] =   'has ended'
         self._verb['skip'] =  'is skipped'
 
-    def register_step(self, step_id, step_name):
+    def register_step(self, step_id, step_name, parent=None, total=None, unit='rows'):
         """Register a step.
 
         @param step_id    an identifier to be used later when a step starts/ends.
         @param step_name  what the step does.
+        @param parent     the step_id of the step this one is a part of. Default is None, for a top step.
+        @param total      the expected number of units of the step, if it counts any; see advance().
+        @param unit       what the step counts, e.g. 'rows', or 'bytes' to print sizes. Default is 'rows'.
         """
         if step_id in self._id_2_index:
             raise scidblib.AppError('The step_id, \'' + step_id + '\', was already registered.')
+        if parent is not None and not parent in self._id_2_index:
+            raise scidblib.AppError('The parent step, \'' + parent + '\', was not registered in ProgressTracker.')
         self._id_2_name[step_id] = step_name
-        self._id_2_index[step_id] = len(self._id_2_name)
+        self._parent[step_id] = parent
+        self._children[parent].append(step_id)
+        self._children[step_id] = []
+        self._id_2_index[step_id] = len(self._children[parent])
+        self._counter[step_id] = _Counter(total, unit)
+
+    def _check(self, step_id):
+        if not step_id in self._id_2_index:
+            raise scidblib.AppError('The step_id, \'' + step_id + '\', was not registered in ProgressTracker.')
+
+    def _label(self, step_id):
+        """@return e.g. 'Step 2 of 3', or 'Step 2.1 of 4' for the first of the 4 sub-steps of step 2."""
+        numbers = []
+        parent = step_id
+        while parent is not None:
+            numbers.insert(0, str(self._id_2_index[parent]))
+            parent = self._parent[parent]
+        return 'Step ' + '.'.join(numbers) + ' of ' + str(len(self._children[self._parent[step_id]]))
+
+    def _elapsed(self, step_id, now=None):
+        """@return the seconds since the step started, until it ended or now; None if it has not started."""
+        if not step_id in self._start_time:
+            return None
+        end = self._end_time.get(step_id) or now or datetime.datetime.now()
+        td = end - self._start_time[step_id]
+        return td.seconds + (td.days * 24 * 3600) + (td.microseconds*0.000001)
 
     def _print(self, what, step_id):
         """A helper function, servicing all of start_step(), end_step(), and skip_step().
@@ -201,38 +287,53 @@ class ProgressTracker:
         @exception AssertException if 'what' is not understood.
         @exception AppError if the step_id was not registered.
         """
-        assert what in self._if_print
-        if not step_id in self._id_2_index:
-            raise scidblib.AppError('The step_id, \'' + step_id + '\', was not registered in ProgressTracker.')
+        assert what in self._verb
+        self._check(step_id)
 
         if self._if_print[what]:
             s = self._prefix[what]
             if self._name:
                 s += self._name + ': '
-            s += 'Step ' + str(self._id_2_index[step_id]) + ' of ' + str(len(self._id_2_index)) + ' ' + self._verb[what]
+            s += self._label(step_id) + ' ' + self._verb[what]
 
             # In 'start' and 'skip' messages, print the step name;
             # In 'end' messages, print the elapsed time for the step.
             if what=='start' or what=='skip':
                 s += '. (' + self._id_2_name[step_id] + ')'  # print the step name
             elif step_id in self._start_time and step_id in self._end_time and self._end_time[step_id] > self._start_time[step_id]:
-                td = self._end_time[step_id]-self._start_time[step_id]
-                seconds = td.seconds + (td.days * 24 * 3600) + (td.microseconds*0.000001)
-                s += ' after ' + str(seconds) + ' s.'
+                s += ' after ' + str(self._elapsed(step_id)) + ' s'
+                counter = self._counter[step_id]
+                if counter.done and self._elapsed(step_id) > 0:
+                    s += ', ' + format_amount(counter.done, counter.unit) + ' at ' + \
+                         format_amount(counter.done / self._elapsed(step_id), counter.unit) + '/s'
+                s += '.'
             else:
                 s += '.'
             s += self._suffix[what]
 
             print >> self._out, s
+        self._emit(what, step_id)
+
+    def _emit(self, what, step_id):
+        if self._sink is not None:
+            event = self.step_status(step_id)
+            event['event'] = what
+            event['time'] = time.time()
+            if self._name:
+                event['name'] = self._name
+            self._sink(event, self)
 
     def start_step(self, step_id):
         """A step started.
 
         @param step_id: the Id of the step.
         """
+        self._check(step_id)
         self._start_time[step_id] = datetime.datetime.now()
         if step_id in self._end_time:
             del self._end_time[step_id]
+        self._skipped.discard(step_id)
+        self._counter[step_id].start(time.time())
         self._print('start', step_id)
 
     def end_step(self, step_id):
@@ -240,6 +341,7 @@ class ProgressTracker:
 
         @param step_id: the Id of the step.
         """
+        self._check(step_id)
         self._end_time[step_id] = datetime.datetime.now()
         self._print('end', step_id)
 
@@ -248,5 +350,308 @@ class ProgressTracker:
 
         @param step_id: the Id of the step.
         """
+        self._check(step_id)
+        self._skipped.add(step_id)
         self._print('skip', step_id)
 
+    def set_total(self, step_id, total, unit=None):
+        """Set, or correct, the expected number of units of a step.
+
+        @param step_id  the Id of the step.
+        @param total    the expected number of units, or None if unknown.
+        @param unit     what the step counts. Default is to keep the unit it was registered with.
+        """
+        self._check(step_id)
+        with self._lock:
+            self._counter[step_id].total = total
+            if unit is not None:
+                self._counter[step_id].unit = unit
+
+    def advance(self, step_id, amount=1):
+        """Count units of a step, and report its progress if report_interval elapsed since the last report.
+
+        The step is started first if it was not.
+        @param step_id  the Id of the step.
+        @param amount   the number of units done since the last call.
+        """
+        self.update(step_id, None, amount)
+
+    def update(self, step_id, done, amount=0):
+        """Set the number of units a step has done, e.g. the bytes a reader got through.
+
+        @param step_id  the Id of the step.
+        @param done     the number of units done so far; None to add amount to the current number.
+        @param amount   the number of units to add, if done is None.
+        """
+        self._check(step_id)
+        if not step_id in self._start_time:
+            self.start_step(step_id)
+        now = time.time()
+        with self._lock:
+            counter = self._counter[step_id]
+            counter.update(counter.done + amount if done is None else done, now, self._smoothing)
+            due = now - counter.last_report >= self._report_interval
+            if due:
+                counter.last_report = now
+        if due:
+            self.report(step_id)
+
+    def fraction(self, step_id):
+        """@return the fraction of a step that is done, between 0 and 1, or None if unknown.
+
+        A step with a total counts its units; one without uses its sub-steps, a skipped or
+        ended sub-step counting as done.
+        """
+        self._check(step_id)
+        if step_id in self._end_time or step_id in self._skipped:
+            return 1.0
+        counter = self._counter[step_id]
+        if counter.total:
+            return min(1.0, counter.done * 1.0 / counter.total)
+        children = self._children[step_id]
+        if not children:
+            return None
+        fractions = [self.fraction(child) for child in children]
+        return sum(f or 0.0 for f in fractions) / len(fractions)
+
+    def eta(self, step_id):
+        """@return the estimated seconds until a step ends, or None if unknown.
+
+        A step with a total divides what remains by its smoothed rate; one without projects
+        its elapsed time over the fraction of its sub-steps done.
+        """
+        self._check(step_id)
+        if step_id in self._end_time or step_id in self._skipped:
+            return 0.0
+        counter = self._counter[step_id]
+        if counter.total and counter.rate:
+            return max(counter.total - counter.done, 0) / counter.rate
+        f = self.fraction(step_id)
+        elapsed = self._elapsed(step_id)
+        if not f or not elapsed or counter.total:
+            return None
+        return elapsed * (1 - f) / f
+
+    def step_status(self, step_id):
+        """@return a dict describing a step, e.g. for a status file."""
+        self._check(step_id)
+        counter = self._counter[step_id]
+        if step_id in self._end_time:
+            state = 'ended'
+        elif step_id in self._skipped:
+            state = 'skipped'
+        elif step_id in self._start_time:
+            state = 'running'
+        else:
+            state = 'pending'
+        status = {'step': step_id, 'label': self._label(step_id), 'description': self._id_2_name[step_id],
+                  'parent': self._parent[step_id], 'state': state, 'elapsed': self._elapsed(step_id),
+                  'fraction': self.fraction(step_id), 'eta': self.eta(step_id)}
+        if counter.done or counter.total:
+            status.update({'done': counter.done, 'total': counter.total, 'unit': counter.unit, 'rate': counter.rate})
+        return status
+
+    def status(self):
+        """@return the step_status() of every step, parents before their sub-steps."""
+        result = []
+        def add(parent):
+            for step_id in self._children[parent]:
+                result.append(self.step_status(step_id))
+                add(step_id)
+        add(None)
+        return result
+
+    def report(self, step_id):
+        """Print and emit the progress of a step now, e.g.
+        '*** Step 2 of 3: 1.2 GB of 4.0 GB (30%), 25.3 MB/s, 1.9 min left ***'.
+
+        @param step_id: the Id of the step.
+        """
+        self._check(step_id)
+        if self._if_print['progress']:
+            counter = self._counter[step_id]
+            s = self._prefix['progress']
+            if self._name:
+                s += self._name + ': '
+            s += self._label(step_id) + ': ' + format_amount(counter.done, counter.unit)
+            if counter.total:
+                s += ' of ' + format_amount(counter.total, counter.unit)
+            f = self.fraction(step_id)
+            if f is not None:
+                s += ' (%.0f%%)' % (f * 100)
+            if counter.rate is not None:
+                s += ', ' + format_amount(counter.rate, counter.unit) + '/s'
+            eta = self.eta(step_id)
+            if eta is not None:
+                finish = datetime.datetime.now() + datetime.timedelta(seconds=eta)
+                s += ', ' + format_seconds(eta) + ' left (at ' + datetime_as_str(finish, '%H:%M:%S') + ')'
+            s += self._suffix['progress']
+            print >> self._out, s
+        self._emit('progress', step_id)
+
+    def attach(self, step_id, f):
+        """Count the bytes read from or written to a file object, e.g. a FIFO, as the units of a step.
+
+        @param step_id  the Id of the step; its unit becomes 'bytes'.
+        @param f        the file object.
+        @return a ProgressFile to use in place of f.
+        """
+        self._check(step_id)
+        self._counter[step_id].unit = 'bytes'
+        return ProgressFile(f, self, step_id)
+
+class _Counter:
+    """The units done by a step, and their smoothed rate."""
+    def __init__(self, total, unit):
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.rate = None         # The exponentially weighted moving average of the units per second.
+        self.last_report = 0
+        self._sample_time = None
+        self._sample_done = 0
+
+    def start(self, now):
+        self.last_report = now
+        self._sample_time = now
+        self._sample_done = self.done
+
+    def update(self, done, now, smoothing):
+        self.done = done
+        if self._sample_time is None:
+            self.start(now)
+        dt = now - self._sample_time
+        if dt < 1.0:
+            return   # Shorter samples mostly measure the burstiness of the caller.
+        rate = (done - self._sample_done) / dt
+        # The weight of the new sample depends on its length, so that irregular calls still
+        # give the last `smoothing` seconds the same weight.
+        alpha = 1 - math.exp(-dt / smoothing) if smoothing > 0 else 1.0
+        self.rate = rate if self.rate is None else alpha * rate + (1 - alpha) * self.rate
+        self._sample_time = now
+        self._sample_done = done
+
+class ProgressFile:
+    """A file object wrapper counting the bytes read or written as the progress of a step."""
+    def __init__(self, f, tracker, step_id):
+        self._f = f
+        self._tracker = tracker
+        self._step_id = step_id
+
+    def _count(self, data):
+        if data:
+            self._tracker.advance(self._step_id, len(data))
+        return data
+
+    def read(self, *args):
+        return self._count(self._f.read(*args))
+
+    def readline(self, *args):
+        return self._count(self._f.readline(*args))
+
+    def __iter__(self):
+        for line in self._f:
+            yield self._count(line)
+
+    def write(self, data):
+        self._f.write(data)
+        self._count(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+class ReadPosition:
+    """Follow how far another process has read a file, e.g. zcat reading the input of a load.
+
+    The reader is found through /proc (Linux only): the first process with the file open,
+    and its file offset is read from /proc/<pid>/fdinfo. Nothing has to be changed in the
+    reader, so the progress of a shell pipeline can be watched from the outside.
+    """
+    def __init__(self, path, interval=1.0):
+        """
+        @param path      the file.
+        @param interval  the minimum seconds between two looks in /proc.
+        """
+        self.path = os.path.realpath(path)
+        self.size = os.path.getsize(path)
+        self._interval = interval
+        self._reader = None    # (pid, fd) of the reader, once found.
+        self._last = 0
+        self._position = 0
+        self._seen = False
+
+    def _find_reader(self):
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            fd_dir = os.path.join('/proc', pid, 'fd')
+            try:
+                for fd in os.listdir(fd_dir):
+                    if os.readlink(os.path.join(fd_dir, fd)) == self.path:
+                        return pid, fd
+            except OSError:
+                continue   # The process ended, or is not ours.
+        return None
+
+    def position(self):
+        """@return the offset of the reader, the size of the file once the reader is gone, or 0 before it came."""
+        now = time.time()
+        if now - self._last < self._interval:
+            return self._position
+        self._last = now
+        if self._reader is None:
+            self._reader = self._find_reader()
+        if self._reader is None:
+            return self._position
+        try:
+            with open('/proc/%s/fdinfo/%s' % self._reader) as f:
+                for line in f:
+                    if line.startswith('pos:'):
+                        self._position = int(line.split()[1])
+                        self._seen = True
+        except IOError:
+            self._reader = None
+            if self._seen:
+                self._position = self.size   # The reader closed the file: it read all of it.
+        return self._position
+
+class JsonLinesSink:
+    """A ProgressTracker sink appending every event to a file as one line of JSON."""
+    def __init__(self, path):
+        """
+        @param path  the file to append to.
+        """
+        self._f = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def __call__(self, event, tracker):
+        line = json.dumps(event, sort_keys=True) + '\n'
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+class StatusFileSink:
+    """A ProgressTracker sink keeping a JSON file up to date with the status of every step."""
+    def __init__(self, path, interval=1.0):
+        """
+        @param path      the status file; it is replaced atomically.
+        @param interval  the minimum seconds between two rewrites, except at the start or end of a step.
+        """
+        self._path = path
+        self._interval = interval
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, event, tracker):
+        now = time.time()
+        with self._lock:
+            if event['event'] == 'progress' and now - self._last < self._interval:
+                return
+            self._last = now
+            tmp = '%s.%d.tmp' % (self._path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({'time': now, 'last_event': event, 'steps': tracker.status()}, f, indent=1, sort_keys=True)
+            os.rename(tmp, self._path)
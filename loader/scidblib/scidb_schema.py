@@ -2,6 +2,7 @@
 
 import re
 import sys
+from .scidb_math import ceil_of_division
 from .util import superTuple
 
 # BEGIN_COPYRIGHT
@@ -84,6 +85,104 @@ def parse(schema):
         dims = dims[len(m.group(0)):]
     return attr_list, dim_list
 
+def unparse(attr_list, dim_list):
+    """Write attributes and dimensions as a SciDB schema, the inverse of parse().
+
+    @param attr_list  attributes with the fields of those of parse().
+    @param dim_list   dimensions with the fields of those of parse().
+    @return the schema, e.g. '<a:int64, b:string null> [i=0:*,1000,0, j=0:99,10,0]'.
+    """
+    attrs = ', '.join('%s:%s' % (attr.name, attr.type) for attr in attr_list)
+    dims = ', '.join('%s=%d:%s,%d,%d' % (dim.name, dim.lo, '*' if dim.hi == sys.maxsize else dim.hi,
+                                         dim.chunk, dim.overlap) for dim in dim_list)
+    return '<%s> [%s]' % (attrs, dims)
+
+# Approximate on-disk overhead of one string cell: null terminator, size header and offset.
+STRING_OVERHEAD = 6
+# The stored size of one cell of the fixed-size types.
+TYPE_BYTES = {'bool': 1, 'char': 1, 'int8': 1, 'uint8': 1, 'int16': 2, 'uint16': 2,
+              'int32': 4, 'uint32': 4, 'float': 4, 'int64': 8, 'uint64': 8, 'double': 8,
+              'datetime': 8, 'datetimetz': 16}
+# The string width assumed when none is given.
+DEFAULT_STRING_WIDTH = 16
+# The extra bytes of a cell of a nullable attribute, for its missing reason.
+NULLABLE_OVERHEAD = 1
+# The bytes of one coordinate, which a redimension carries with every cell until it is sorted.
+COORDINATE_BYTES = 8
+# Fewer cells than this per chunk, and the per-chunk overhead dominates.
+MIN_CELLS_PER_CHUNK = 1000
+
+Footprint = superTuple('Footprint', 'cells_per_chunk', 'chunk_bytes', 'widest_chunk_bytes', 'num_chunks',
+                       'chunks_per_instance', 'bytes_per_instance', 'redim_bytes_per_instance')
+
+def cell_bytes(attr, width=None):
+    """Estimate the stored size of one cell of an attribute.
+
+    @param attr   an element of the attr_list of parse().
+    @param width  the average width of the values of a string attribute, in characters.
+    @return the number of bytes.
+    """
+    base = attr.type.split()[0]
+    if base in TYPE_BYTES:
+        size = TYPE_BYTES[base]
+    else:
+        size = int(width if width is not None else DEFAULT_STRING_WIDTH) + STRING_OVERHEAD
+    return size + (NULLABLE_OVERHEAD if attr.nullable else 0)
+
+def estimate_footprint(schema, num_cells, widths=None, density=1.0, num_instances=1, extents=None):
+    """Estimate the size of the chunks of an array, and the memory a redimension into it needs.
+
+    Every attribute is stored in chunks of its own; a chunk of the array holds the cells of one
+    chunk interval of every dimension that are present, i.e. density times its volume. The
+    chunks are assumed to spread evenly over the instances. A redimension gathers the cells
+    of the output chunks of an instance with their coordinates before it sorts and writes
+    them, so its peak memory is taken as all of these cells, unless SciDB spills them.
+
+    @param schema         a schema string, or the (attr_list, dim_list) of parse().
+    @param num_cells      the number of cells the array will hold.
+    @param widths         a dict mapping the names of string attributes to their average width.
+    @param density        the fraction of the cells of a chunk interval that are present.
+    @param num_instances  the number of SciDB instances.
+    @param extents        a dict mapping dimension names to the number of coordinates the data
+                          spans along them, when it is less than a chunk interval, e.g. the
+                          number of samples for a sample_id chunk longer than the cohort.
+    @return a Footprint tuple; sizes are in bytes.
+    """
+    attr_list, dim_list = parse(schema) if isinstance(schema, basestring) else schema
+    widths = widths or {}
+    extents = extents or {}
+    volume = 1
+    for dim in dim_list:
+        volume *= min(dim.chunk, extents.get(dim.name, dim.chunk))
+    cells_per_chunk = max(1, min(num_cells, int(volume * density)))
+    attr_bytes = [cells_per_chunk * cell_bytes(attr, widths.get(attr.name)) for attr in attr_list]
+    num_chunks = max(1, ceil_of_division(num_cells, cells_per_chunk))
+    chunks_per_instance = ceil_of_division(num_chunks, num_instances)
+    cells_per_instance = min(num_cells, chunks_per_instance * cells_per_chunk)
+    row_bytes = sum(cell_bytes(attr, widths.get(attr.name)) for attr in attr_list)
+    return Footprint(cells_per_chunk, sum(attr_bytes), max(attr_bytes), num_chunks, chunks_per_instance,
+                     chunks_per_instance * sum(attr_bytes),
+                     cells_per_instance * (row_bytes + COORDINATE_BYTES * len(dim_list)))
+
+def check_footprint(footprint, memory_limit=None, max_chunk_bytes=None):
+    """Flag a footprint that is likely to fail or to be slow.
+
+    @param footprint        a Footprint tuple.
+    @param memory_limit     the memory a query may use per instance, in bytes; None means no check.
+    @param max_chunk_bytes  the largest acceptable attribute chunk, in bytes; None means no check.
+    @return a list of warning messages, empty if the footprint looks fine.
+    """
+    warnings = []
+    if memory_limit is not None and footprint.redim_bytes_per_instance > memory_limit:
+        warnings.append('a redimension into it may need %.1f MB per instance, more than the limit of %.1f MB'
+                        % (footprint.redim_bytes_per_instance / 1048576.0, memory_limit / 1048576.0))
+    if max_chunk_bytes is not None and footprint.widest_chunk_bytes > max_chunk_bytes:
+        warnings.append('its widest attribute chunk is %.1f MB, more than %.1f MB'
+                        % (footprint.widest_chunk_bytes / 1048576.0, max_chunk_bytes / 1048576.0))
+    if footprint.num_chunks > 1 and footprint.cells_per_chunk < MIN_CELLS_PER_CHUNK:
+        warnings.append('its chunks hold only %d cells' % footprint.cells_per_chunk)
+    return warnings
+
 def main(args=None):
     if args is None:
         args = sys.argv
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Array version reclamation and storage accounting.
+
+Every insert() or store() into a SciDB array creates a new version, and the
+chunks of the old versions stay on disk until remove_versions() is called.
+A StorageManager tracks the versions of a set of arrays, decides when to
+reclaim them based on a list of policies, and reports how much space was freed.
+
+A typical usage pattern is:
+  - manager = StorageManager(iquery_cmd, ['KG_GENOTYPE', 'KG_VARIANT'],
+                             [MaxVersionsPolicy(2), MaxBytesPolicy(50*1024**3)])
+  - Call manager.note_insert('KG_GENOTYPE') after every insert into KG_GENOTYPE.
+  - Call manager.reclaim() to force a reclamation of all tracked arrays.
+"""
+
+import json
+import os
+from scidblib import scidb_afl
+from scidblib.util import superTuple
+
+ArrayVersions = superTuple('ArrayVersions', 'name', 'count', 'max_version')
+ReclaimReport = superTuple('ReclaimReport', 'arrays', 'versions_removed', 'bytes_before', 'bytes_after')
+
+def storage_bytes(iquery_cmd):
+    """Get the number of bytes allocated by all chunks of all arrays, across all instances.
+
+    @param iquery_cmd  the iquery command.
+    @return the total allocated size in bytes, as reported by list('chunk map').
+    @exception AppError if the query fails.
+    """
+    value = scidb_afl.single_cell_afl(iquery_cmd, "aggregate(list('chunk map'), sum(asize))", 1)
+    if value == 'null' or value == '':
+        return 0
+    return long(float(value))
+
+def get_array_versions(iquery_cmd, array_name):
+    """Get the number of versions and the latest version id of an array.
+
+    @param iquery_cmd  the iquery command.
+    @param array_name  the array name.
+    @return an ArrayVersions tuple; max_version is None if the array has no version.
+    @exception AppError if the query fails.
+    """
+    count, max_version = scidb_afl.single_cell_afl(
+        iquery_cmd,
+        'aggregate(versions(' + array_name + '), count(*), max(version_id))',
+        2)
+    count = int(count)
+    if count == 0 or max_version == 'null':
+        return ArrayVersions(array_name, 0, None)
+    return ArrayVersions(array_name, count, long(max_version))
+
+class MaxVersionsPolicy:
+    """Reclaim an array once it has more than a given number of versions."""
+    def __init__(self, max_versions):
+        """
+        @param max_versions  the number of versions an array may keep before it is reclaimed.
+        """
+        assert max_versions > 0
+        self.max_versions = max_versions
+
+    def due(self, manager, array_name):
+        return manager.versions(array_name).count > self.max_versions
+
+class MaxBytesPolicy:
+    """Reclaim once storage has grown by more than a given number of bytes since the last reclamation."""
+    def __init__(self, max_bytes):
+        """
+        @param max_bytes  the allowed storage growth, in bytes.
+        """
+        assert max_bytes > 0
+        self.max_bytes = max_bytes
+
+    def due(self, manager, array_name):
+        return manager.growth() > self.max_bytes
+
+class EveryInsertPolicy:
+    """Reclaim an array after every n-th insert into it."""
+    def __init__(self, every=1):
+        """
+        @param every  how many inserts to wait between two reclamations. Default is 1.
+        """
+        assert every > 0
+        self.every = every
+
+    def due(self, manager, array_name):
+        return manager.inserts_since_reclaim(array_name) >= self.every
+
+class StorageManager:
+    """Track the versions and storage growth of a set of arrays, and reclaim old versions by policy.
+
+    The state (insert counters and the storage baseline) may be kept in a JSON file, so that
+    the policies keep working across several short-lived processes, e.g. one per redim step.
+    """
+    def __init__(self, iquery_cmd, array_names, policies=None, state_file=None,
+                 usage_probe=storage_bytes, log=None, max_queries=1):
+        """
+        @param iquery_cmd   the iquery command.
+        @param array_names  the arrays to track.
+        @param policies     a list of policy objects; an array is reclaimed if any policy is due.
+                            Default is [MaxVersionsPolicy(1)], i.e. keep only the latest version.
+        @param state_file   an optional JSON file where the state is loaded from and saved to.
+        @param usage_probe  a function taking iquery_cmd and returning the storage in use, in bytes.
+        @param log          an optional function taking a message string.
+        @param max_queries  how many version lookups and removals of a reclamation may run concurrently.
+        """
+        self._iquery_cmd = iquery_cmd
+        self._array_names = list(array_names)
+        self._policies = policies if policies else [MaxVersionsPolicy(1)]
+        self._state_file = state_file
+        self._usage_probe = usage_probe
+        self._log = log
+        self._max_queries = max_queries
+        self._versions = {}   # a dict mapping array name to the most recently seen ArrayVersions.
+        self._inserts = {}    # a dict mapping array name to #inserts since its last reclamation.
+        self._baseline = None # storage bytes right after the last reclamation.
+        self._total_freed = 0 # bytes freed by all reclamations so far.
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            self._inserts = dict((str(k), v) for k, v in state.get('inserts', {}).iteritems())
+            self._baseline = state.get('baseline')
+            self._total_freed = state.get('total_freed', 0)
+
+    def _say(self, message):
+        if self._log:
+            self._log(message)
+
+    def _save(self):
+        if not self._state_file:
+            return
+        tmp = self._state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'inserts': self._inserts,
+                       'baseline': self._baseline,
+                       'total_freed': self._total_freed}, f)
+        os.rename(tmp, self._state_file)
+
+    def versions(self, array_name, refresh=False):
+        """Get the version information of an array, querying SciDB at most once per reclamation cycle.
+
+        @param array_name  the array name.
+        @param refresh     whether to query SciDB even if the information is cached.
+        @return an ArrayVersions tuple.
+        """
+        if refresh or array_name not in self._versions:
+            self._versions[array_name] = get_array_versions(self._iquery_cmd, array_name)
+        return self._versions[array_name]
+
+    def usage(self):
+        """@return the storage in use, in bytes."""
+        return self._usage_probe(self._iquery_cmd)
+
+    def growth(self):
+        """@return the storage growth in bytes since the last reclamation (or since tracking began)."""
+        current = self.usage()
+        if self._baseline is None:
+            self._baseline = current
+            self._save()
+        return current - self._baseline
+
+    def inserts_since_reclaim(self, array_name):
+        """@return the number of inserts into an array since it was last reclaimed."""
+        return self._inserts.get(array_name, 0)
+
+    def total_freed(self):
+        """@return the number of bytes freed by all reclamations, including those by previous processes."""
+        return self._total_freed
+
+    def note_insert(self, array_name):
+        """Record that a new version of an array was created, and reclaim the array if a policy is due.
+
+        @param array_name  the array that was inserted into.
+        @return a ReclaimReport if a reclamation happened, or None.
+        """
+        self._inserts[array_name] = self._inserts.get(array_name, 0) + 1
+        self._versions.pop(array_name, None)
+        self._save()
+        for policy in self._policies:
+            if policy.due(self, array_name):
+                return self.reclaim([array_name])
+        return None
+
+    def reclaim(self, array_names=None):
+        """Remove every version but the latest one, of the given arrays.
+
+        @param array_names  the arrays to reclaim. Default is all tracked arrays.
+        @return a ReclaimReport.
+        @exception AppError if a query fails.
+        """
+        if array_names is None:
+            array_names = self._array_names
+        bytes_before = self.usage()
+        reclaimed = []
+        versions_removed = 0
+        with scidb_afl.QueryPool(self._max_queries) as pool:
+            lookups = [(name, pool.submit(self._iquery_cmd, get_array_versions, (name,))) for name in array_names]
+            removals = []
+            for name, lookup in lookups:
+                info = lookup.result()
+                if info.count > 1:
+                    self._say('Removing %d old version(s) of %s.' % (info.count - 1, name))
+                    removals.append(pool.afl(self._iquery_cmd,
+                                             'remove_versions(' + name + ', ' + str(info.max_version) + ')'))
+                    versions_removed += info.count - 1
+                    reclaimed.append(name)
+            for removal in removals:
+                removal.result()
+        for name in array_names:
+            self._inserts[name] = 0
+            self._versions.pop(name, None)
+        bytes_after = self.usage() if reclaimed else bytes_before
+        self._baseline = bytes_after
+        self._total_freed += max(0, bytes_before - bytes_after)
+        self._save()
+        report = ReclaimReport(reclaimed, versions_removed, bytes_before, bytes_after)
+        self._say('Reclaimed %d version(s), freeing %d bytes.' % (versions_removed, freed_bytes(report)))
+        return report
+
+    def maintain(self):
+        """Check every policy for every tracked array, and reclaim the arrays that are due.
+
+        @return a ReclaimReport, or None if no array was due.
+        """
+        due = []
+        for name in self._array_names:
+            for policy in self._policies:
+                if policy.due(self, name):
+                    due.append(name)
+                    break
+        if not due:
+            return None
+        return self.reclaim(due)
+
+def freed_bytes(report):
+    """@return the number of bytes a reclamation freed, according to a ReclaimReport."""
+    return max(0, report.bytes_before - report.bytes_after)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Record child processes and queries as Chrome trace events.
+
+Tracing is off unless the environment variable SCIDB_TRACE names a directory. Every
+process that records an event then appends to its own file there,
+<script>.<pid>.trace, in the trace-event JSON array format: chrome://tracing and
+Perfetto open such a file as is, and trace_tool.py merges the files of all the
+processes of a load into one timeline.
+
+Every child process is a 'complete' event, from begin_child() to end_child(). It is drawn
+in the row of its own pid, under the process that spawned it; its args hold the command,
+the host and instance it ran for, byte counts and the exit status. Timestamps are
+microseconds since the epoch, so the files of different processes line up.
+
+A typical usage pattern is:
+  - p = subprocess.Popen(cmd, ...)
+    scidb_trace.begin_child(p, 'convert', host='node2', instance=3)
+    ...
+    p.wait()
+    scidb_trace.end_child(p, bytes=12345)
+
+When SCIDB_TRACE is not set, every function returns at once.
+"""
+
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+_dir = os.getenv('SCIDB_TRACE')
+_tracer = None
+_tracer_lock = threading.Lock()
+
+def now_us():
+    """@return the current time in microseconds since the epoch, the unit of trace events."""
+    return int(time.time() * 1e6)
+
+def iquery_name(query):
+    """@return 'iquery' and the outer AFL operators of a query, e.g. 'iquery insert/redimension'."""
+    operators = re.findall(r'(\w+)\s*\(', query)[:2]
+    return 'iquery ' + '/'.join(operators) if operators else 'iquery'
+
+class Tracer:
+    """Append the trace events of the current process to its trace file."""
+    def __init__(self, trace_dir, name):
+        """
+        @param trace_dir  the directory of the trace files.
+        @param name       the name of this process, e.g. the script name.
+        """
+        if not os.path.isdir(trace_dir):
+            try:
+                os.makedirs(trace_dir)
+            except OSError:
+                if not os.path.isdir(trace_dir):  # Another process may have just created it.
+                    raise
+        self.path = os.path.join(trace_dir, '%s.%d.trace' % (name, os.getpid()))
+        self._lock = threading.Lock()
+        self._children = {}   # pid -> (start, name, cat, args) of the children not ended yet.
+        self._f = open(self.path, 'a')
+        if self._f.tell() == 0:
+            self._f.write('[\n')
+        self.process_name(os.getpid(), '%s (%s)' % (name, socket.gethostname()))
+
+    def write(self, event):
+        line = json.dumps(event, sort_keys=True) + ',\n'
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+
+    def process_name(self, pid, name):
+        """Name the row of a pid in the timeline."""
+        self.write({'ph': 'M', 'name': 'process_name', 'pid': pid, 'tid': pid, 'args': {'name': name}})
+
+    def complete(self, name, cat, start, end, pid, tid, args):
+        """Record an interval.
+
+        @param name   the label of the interval.
+        @param cat    its category, e.g. 'process' or 'afl'.
+        @param start  the start, from now_us().
+        @param end    the end, from now_us().
+        @param pid    the pid of the row group in the timeline.
+        @param tid    the row in the group.
+        @param args   a dict of details.
+        """
+        self.write({'ph': 'X', 'name': name, 'cat': cat, 'ts': start, 'dur': max(end - start, 0),
+                    'pid': pid, 'tid': tid, 'args': args})
+
+    def begin_child(self, p, name, cat, args):
+        with self._lock:
+            self._children[p.pid] = (now_us(), name, cat, args)
+
+    def end_child(self, p, args):
+        with self._lock:
+            if p.pid not in self._children:
+                return
+            start, name, cat, child_args = self._children.pop(p.pid)
+        child_args = dict(child_args)
+        child_args.update(args)
+        if p.returncode is not None:
+            child_args['exit_status'] = p.returncode
+        self.complete(name, cat, start, now_us(), os.getpid(), p.pid, child_args)
+
+def tracer():
+    """@return the Tracer of this process, or None if tracing is off."""
+    global _tracer
+    if not _dir:
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(_dir, os.path.basename(sys.argv[0] or 'python'))
+    return _tracer
+
+def enabled():
+    """@return whether SCIDB_TRACE is set."""
+    return bool(_dir)
+
+def begin_child(p, name, cat='process', **args):
+    """Note the start of a child process.
+
+    @param p     a subprocess.Popen object, just started.
+    @param name  what the child does, e.g. 'split'.
+    @param cat   the category of the event.
+    @param args  details to record, e.g. cmd, host, instance.
+    """
+    if not _dir:
+        return
+    tracer().begin_child(p, name, cat, args)
+
+def end_child(p, **args):
+    """Record a child process begun with begin_child(), as ending now.
+
+    @param p     the subprocess.Popen object, normally already reaped.
+    @param args  more details to record, e.g. byte counts.
+    """
+    if not _dir:
+        return
+    tracer().end_child(p, args)
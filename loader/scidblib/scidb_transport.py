@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""The ways the functions of scidb_afl reach SciDB.
+
+Every function of scidb_afl takes an iquery_cmd. When it is a string, the default, every
+query runs in a new iquery process. When it is a Transport, the transport runs it:
+  - IqueryTransport: iquery again, wrapped in the Transport interface.
+  - ShimTransport:   the HTTP API of shim, the SciDB web service the R toolkit also uses.
+                     It keeps its HTTP/1.1 connections open, each with a shim session, and
+                     reuses them across queries, so a query costs a couple of HTTP requests
+                     rather than the start of a process. Results are read as they arrive,
+                     as lines of text, or as blocks of bytes in the SciDB binary format.
+Everything built on scidb_afl, e.g. afl_rows(), a QueryPool or a QueryCache, works over
+either transport; a QueryPool cancels a shim query with shim's cancel request.
+
+A typical usage pattern is:
+  - transport = scidb_transport.get_transport(args)   # --shim URL, $SCIDB_SHIM, or iquery.
+  - count = scidb_afl.single_cell_afl(transport, 'op_count(KG_SAMPLE)', 1)
+  - for row in scidb_afl.afl_rows(transport, 'KG_CHROMOSOME'):
+        print row.chrom_id, row.chrom
+  - with open('gt.bin', 'wb') as f:
+        for block in transport.result_blocks('KG_GENOTYPE', '(string null)'):
+            f.write(block)
+"""
+
+import errno
+import httplib
+import os
+import re
+import socket
+import threading
+import time
+import urllib
+import urlparse
+import scidblib
+from scidblib import scidb_trace
+
+# The block size of streamed downloads.
+READ_BLOCK_BYTES = 1 << 20
+
+class Transport(object):
+    """The interface of a way to run queries; scidb_afl calls it in place of iquery."""
+    # The output format of afl_rows() and single_cell_afl(), as iquery's -o would set it.
+    output_format = 'dcsv'
+
+    def afl(self, query, want_output=False, tolerate_error=False, started=None):
+        """Run a query, as scidb_afl.afl() does.
+
+        @param started  a function to call with a handle having a cancel() method, once the query started.
+        @return (stdout_data, stderr_data)
+        @exception AppError if the query fails and tolerate_error is False.
+        """
+        raise NotImplementedError()
+
+    def time_afl(self, query, started=None):
+        """Run a query without fetching its result, as scidb_afl.time_afl() does.
+
+        @return the execution time in seconds, as the client sees it.
+        @exception AppError if the query fails.
+        """
+        raise NotImplementedError()
+
+    def script(self, queries, started=None):
+        """Run several queries in order, without their output, as scidb_afl.afl_script() does.
+
+        @exception AppError at the first query that fails.
+        """
+        for query in queries:
+            self.afl(query, False, False, started)
+
+    def lines(self, query, output_format, started=None):
+        """Run a query, and yield the lines of its result in an output format as they arrive.
+
+        Closing the generator early cancels the query.
+        @exception AppError if the query fails.
+        """
+        raise NotImplementedError()
+
+    def coordinator(self):
+        """@return (host, port) of the coordinator, to group the queries of a QueryPool."""
+        raise NotImplementedError()
+
+    def close(self):
+        """Release the connections of the transport, if any."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+class IqueryTransport(Transport):
+    """Run every query in its own iquery process, as a plain iquery_cmd does."""
+    def __init__(self, iquery_cmd):
+        """
+        @param iquery_cmd  the iquery command, e.g. from scidb_afl.get_iquery_cmd().
+        """
+        self.iquery_cmd = iquery_cmd
+        m = re.search(r'\s-o\s*(\S+)', iquery_cmd)
+        self.output_format = m.group(1) if m else 'dcsv'
+
+    def afl(self, query, want_output=False, tolerate_error=False, started=None):
+        from scidblib import scidb_afl
+        return scidb_afl.afl(self.iquery_cmd, query, want_output, tolerate_error)
+
+    def time_afl(self, query, started=None):
+        from scidblib import scidb_afl
+        return scidb_afl.time_afl(self.iquery_cmd, query)
+
+    def script(self, queries, started=None):
+        from scidblib import scidb_afl
+        return scidb_afl.afl_script(self.iquery_cmd, queries)
+
+    def lines(self, query, output_format, started=None):
+        from scidblib import scidb_afl
+        iquery_cmd = re.sub(r'\s-o\s*\S+', ' ', self.iquery_cmd) + ' -o ' + output_format + ' '
+        return scidb_afl.afl_lines(iquery_cmd, query)
+
+    def coordinator(self):
+        host = re.search(r'\s-c\s+(\S+)', self.iquery_cmd)
+        port = re.search(r'\s-p\s+(\S+)', self.iquery_cmd)
+        return (host.group(1) if host else 'localhost', port.group(1) if port else '')
+
+    def __str__(self):
+        return ' '.join(self.iquery_cmd.split())
+
+class ShimError(scidblib.AppError):
+    """shim answered a request with an error status.
+
+    Details of public attributes:
+      - status: the HTTP status, e.g. 404 when the session expired, or 500 when the query failed.
+    """
+    def __init__(self, message, status):
+        scidblib.AppError.__init__(self, message)
+        self.status = status
+
+class _Session:
+    """A keep-alive HTTP connection to shim, and the shim session it runs queries in."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn_requests = 0   # The requests answered over conn.
+        self.id = None
+        self.queries = 0
+
+def _closed_while_idle(e, sent):
+    """Tell whether a request failed because shim had closed the connection before reading it.
+
+    @param e     the exception of the request.
+    @param sent  whether the request was sent.
+    @return True if shim cannot have run the request, so that it is safe to send it again.
+    """
+    if not sent:
+        return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE)
+    # Not a byte of the response: httplib reports the end of the stream as an empty status line,
+    # or, since Python 2.7.15 or so, with a message of its own.
+    return isinstance(e, httplib.BadStatusLine) and (e.line in ('', "''") or 'closed the connection' in e.line)
+
+class _RunningQuery:
+    """The handle of a shim query, for a QueryPool to cancel it."""
+    def __init__(self, transport, session_id):
+        self._transport = transport
+        self._session_id = session_id
+
+    def cancel(self):
+        self._transport._cancel(self._session_id)
+
+class ShimTransport(Transport):
+    """Run queries through shim, over a pool of keep-alive connections with one session each.
+
+    Details of public attributes:
+      - connections_opened: the number of HTTP connections made so far.
+      - sessions_opened:    the number of shim sessions created so far.
+    """
+    def __init__(self, url, output_format='dcsv', max_idle=4, timeout=None, username=None, password=None):
+        """
+        @param url            the address of shim, e.g. http://coordinator:8080; https works too.
+        @param output_format  the text format of the results of afl() and afl_rows(), e.g. dcsv or csv+.
+        @param max_idle       the number of idle connections kept open for the next queries.
+        @param timeout        the socket timeout in seconds; None means no timeout.
+        @param username       the user to log in as, if shim requires authentication.
+        @param password       the password of the user.
+        """
+        parsed = urlparse.urlparse(url if '://' in url else 'http://' + url)
+        if parsed.scheme not in ('http', 'https'):
+            raise scidblib.AppError('The shim address, %s, must be an http or https URL.' % url)
+        self.url = '%s://%s' % (parsed.scheme, parsed.netloc)
+        self.output_format = output_format
+        self._connection_class = httplib.HTTPSConnection if parsed.scheme == 'https' else httplib.HTTPConnection
+        self._host = parsed.hostname
+        self._port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        self._max_idle = max_idle
+        self._timeout = timeout
+        self._username = username
+        self._password = password
+        self._auth = None
+        self._lock = threading.Lock()
+        self._idle = []   # The idle _Session objects, the most recently used last.
+        self._closed = False
+        self.connections_opened = 0
+        self.sessions_opened = 0
+
+    def __str__(self):
+        return 'shim %s -o %s' % (self.url, self.output_format)
+
+    def coordinator(self):
+        return (self._host, str(self._port))
+
+    def _connect(self):
+        with self._lock:
+            self.connections_opened += 1
+        if self._timeout is None:
+            conn = self._connection_class(self._host, self._port)
+        else:
+            conn = self._connection_class(self._host, self._port, timeout=self._timeout)
+        try:
+            conn.connect()
+        except socket.error as e:
+            raise scidblib.AppError('Cannot reach shim at %s: %s' % (self.url, e))
+        # A request is a single small write: do not let it wait for the acknowledgement of the last one.
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def _request(self, session, path, params, stream=False):
+        """Send a GET request over the connection of a session.
+
+        An idle keep-alive connection may have been closed by shim; a request that failed on it
+        before shim could read it, i.e. on sending it or with no byte of response, is sent again,
+        once, on a new connection. Any other failure, e.g. a timeout, is not retried, since shim
+        may have run the request, e.g. an insert.
+        @param stream  whether to return the response unread, rather than its body.
+        @return the body, or the httplib.HTTPResponse if stream is set.
+        @exception ShimError if shim answers with an error status.
+        @exception AppError if shim cannot be reached.
+        """
+        if self._auth:
+            params = dict(params, auth=self._auth)
+        target = '/%s?%s' % (path, urllib.urlencode(params))
+        for attempt in (0, 1):
+            sent = False
+            try:
+                session.conn.request('GET', target)
+                sent = True
+                response = session.conn.getresponse()
+                break
+            except (httplib.HTTPException, socket.error) as e:
+                session.conn.close()
+                if attempt or session.conn_requests == 0 or not _closed_while_idle(e, sent):
+                    raise scidblib.AppError('Cannot reach shim at %s: %s' % (self.url, e))
+                session.conn = self._connect()
+                session.conn_requests = 0
+        session.conn_requests += 1
+        if response.status != 200:
+            body = response.read()
+            raise ShimError('shim at %s answered %s with status %d: %s' % (
+                self.url, path, response.status, body.strip() or response.reason), response.status)
+        if stream:
+            return response
+        return response.read()
+
+    def _acquire(self):
+        """@return an idle session, or a new one."""
+        with self._lock:
+            if self._closed:
+                raise scidblib.AppError('The shim transport to %s was closed.' % self.url)
+            if self._idle:
+                return self._idle.pop()
+        session = _Session(self._connect())
+        try:
+            self._open_session(session)
+        except scidblib.AppError:
+            session.conn.close()
+            raise
+        return session
+
+    def _open_session(self, session):
+        if self._username and not self._auth:
+            self._auth = self._request(session, 'login',
+                                       {'username': self._username, 'password': self._password or ''}).strip()
+        session.id = self._request(session, 'new_session', {}).strip()
+        session.queries = 0
+        with self._lock:
+            self.sessions_opened += 1
+
+    def _release(self, session, reusable=True):
+        """Put a session back in the pool, or release it if the pool is full or it cannot be reused."""
+        with self._lock:
+            if reusable and not self._closed and len(self._idle) < self._max_idle:
+                self._idle.append(session)
+                return
+        if reusable:
+            try:
+                self._request(session, 'release_session', {'id': session.id})
+            except scidblib.AppError:
+                pass   # shim drops the sessions it has not heard of for a while anyway.
+        session.conn.close()
+
+    def _cancel(self, session_id, release=False):
+        """Cancel the query of a session, over a new connection, as the connection of the session is busy.
+
+        @param release  whether to also release the session.
+        """
+        try:
+            session = _Session(self._connect())
+        except scidblib.AppError:
+            return
+        try:
+            self._request(session, 'cancel', {'id': session_id})
+        except scidblib.AppError:
+            pass   # The query finished meanwhile.
+        try:
+            if release:
+                self._request(session, 'release_session', {'id': session_id})
+        except scidblib.AppError:
+            pass
+        finally:
+            session.conn.close()
+
+    def _execute(self, session, query, save, started):
+        """Run a query in a session; a session that shim expired is replaced once."""
+        params = {'query': query}
+        if save:
+            params['save'] = save
+        for attempt in (0, 1):
+            if started:
+                started(_RunningQuery(self, session.id))
+            params['id'] = session.id
+            try:
+                self._request(session, 'execute_query', params)
+                break
+            except ShimError as e:
+                if e.status != 404 or session.queries == 0 or attempt:
+                    raise
+                self._open_session(session)
+        session.queries += 1
+
+    def _trace(self, query, start, session, **args):
+        if scidb_trace.enabled():
+            args.update(session=session.id, url=self.url, cmd=' '.join(query.split()))
+            name = 'shim' + scidb_trace.iquery_name(query)[len('iquery'):]
+            scidb_trace.tracer().complete(name, 'afl', start, scidb_trace.now_us(), os.getpid(),
+                                          threading.current_thread().ident, args)
+
+    def afl(self, query, want_output=False, tolerate_error=False, started=None):
+        session = self._acquire()
+        start = scidb_trace.now_us()
+        out_data = ''
+        try:
+            self._execute(session, query, self.output_format if want_output else None, started)
+            if want_output:
+                out_data = self._request(session, 'read_lines', {'id': session.id, 'n': 0})
+        except ShimError as e:
+            self._release(session)
+            self._trace(query, start, session, error=e.status)
+            if e.status != 500 or not tolerate_error:
+                raise scidblib.AppError('The AFL query, ' + query + ', failed with the following error:\n' + str(e))
+            return ('', str(e))
+        except scidblib.AppError:
+            self._release(session, reusable=False)
+            raise
+        self._release(session)
+        self._trace(query, start, session, bytes_out=len(out_data))
+        return (out_data, '')
+
+    def time_afl(self, query, started=None):
+        session = self._acquire()
+        start = time.time()
+        try:
+            self._execute(session, query, None, started)
+        except ShimError as e:
+            self._release(session)
+            raise scidblib.AppError('Timing the AFL query ' + query + ', failed with the following error:\n' + str(e))
+        except scidblib.AppError:
+            self._release(session, reusable=False)
+            raise
+        seconds = time.time() - start
+        self._release(session)
+        return seconds
+
+    def script(self, queries, started=None):
+        """Run several queries in order, in one session."""
+        session = self._acquire()
+        for query in queries:
+            start = scidb_trace.now_us()
+            try:
+                self._execute(session, query, None, started)
+            except ShimError as e:
+                self._release(session)
+                self._trace(query, start, session, error=e.status)
+                raise scidblib.AppError('The AFL query, ' + query + ', failed with the following error:\n' + str(e))
+            except scidblib.AppError:
+                self._release(session, reusable=False)
+                raise
+            self._trace(query, start, session)
+        self._release(session)
+
+    def _download(self, query, save, path, started):
+        """Run a query, and yield the blocks of its result as they arrive."""
+        session = self._acquire()
+        start = scidb_trace.now_us()
+        try:
+            self._execute(session, query, save, started)
+            response = self._request(session, path, {'id': session.id, 'n': 0}, stream=True)
+        except ShimError as e:
+            self._release(session)
+            self._trace(query, start, session, error=e.status)
+            raise scidblib.AppError('The AFL query, ' + query + ', failed with the following error:\n' + str(e))
+        except scidblib.AppError:
+            self._release(session, reusable=False)
+            raise
+        num_bytes = 0
+        finished = False
+        try:
+            while True:
+                block = response.read(READ_BLOCK_BYTES)
+                if not block:
+                    break
+                num_bytes += len(block)
+                yield block
+            finished = True
+        finally:
+            if not finished:
+                # Closed early: the rest of the result is still on the connection, which cannot be reused.
+                self._cancel(session.id, release=True)
+            self._release(session, reusable=finished)
+            self._trace(query, start, session, bytes_out=num_bytes)
+
+    def lines(self, query, output_format, started=None):
+        pending = ''
+        for block in self._download(query, output_format, 'read_lines', started):
+            parts = (pending + block).split('\n')
+            pending = parts.pop()
+            for line in parts:
+                yield line + '\n'
+        if pending:
+            yield pending
+
+    def result_blocks(self, query, save_format, started=None):
+        """Run a query, and yield its result in a binary format, as blocks of bytes.
+
+        @param query        the AFL query.
+        @param save_format  the binary format, as for save(), e.g. '(int64,double null,string)'.
+        @return a generator of byte strings of up to READ_BLOCK_BYTES; closing it early cancels the query.
+        @exception AppError if the query fails.
+        """
+        return self._download(query, save_format, 'read_bytes', started)
+
+    def close(self):
+        """Release every idle session; the sessions in use are released when their query is done."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for session in idle:
+            try:
+                self._request(session, 'release_session', {'id': session.id})
+            except scidblib.AppError:
+                pass
+            session.conn.close()
+
+# The ShimTransport of every shim URL and output format, shared by the callers of get_transport().
+_shared = {}
+_shared_lock = threading.Lock()
+
+def add_arguments(parser):
+    """Add the --shim option to an argparse parser."""
+    parser.add_argument('--shim', default=os.getenv('SCIDB_SHIM'),
+                        help='Send the queries to shim at this URL, e.g. http://localhost:8080, rather than '
+                             'through iquery. Default is $SCIDB_SHIM, if set.')
+
+def get_transport(args=None, output_format='dcsv'):
+    """Get the transport that args ask for.
+
+    @param args           argparse arguments that may include shim, host and port.
+    @param output_format  the output format of the results.
+    @return a ShimTransport, shared with the other callers for the same URL, if args.shim or
+            $SCIDB_SHIM names one; otherwise the iquery command of scidb_afl.get_iquery_cmd().
+    """
+    url = getattr(args, 'shim', None) if args else os.getenv('SCIDB_SHIM')
+    if not url:
+        from scidblib import scidb_afl
+        return scidb_afl.get_iquery_cmd(args, 'iquery -o ' + output_format)
+    with _shared_lock:
+        key = (url, output_format)
+        if key not in _shared:
+            _shared[key] = ShimTransport(url, output_format)
+        return _shared[key]
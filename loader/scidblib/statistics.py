@@ -22,6 +22,8 @@
 #     to avoid truncating the division result to an integer, in Python 2.
 #   - Other changes are all accompanied with a comment "Modified by SciDB, Inc.",
 #     to allow easy searching. 
+#   - The streaming accumulators, RunningStats and LogHistogram, were added by
+#     SciDB, Inc.
 #
 
 """
@@ -94,6 +96,27 @@ second argument to the four "spread" functions to avoid recalculating it:
 2.5
 
 
+Streaming accumulators
+----------------------
+
+==================  =============================================
+Class               Description
+==================  =============================================
+RunningStats        Count, mean, variance, min and max of a stream.
+LogHistogram        Quantiles of a stream, within a relative error.
+==================  =============================================
+
+The accumulators take one value at a time, in constant memory, and merge
+with the accumulators of other workers, processes or hosts:
+
+>>> a = RunningStats([1, 2, 3])
+>>> b = RunningStats([4, 5])
+>>> (a + b).mean()
+3.0
+>>> RunningStats.from_snapshot(a.snapshot()).variance()
+1.0
+
+
 Exceptions
 ----------
 
@@ -105,6 +128,7 @@ __all__ = [ 'StatisticsError',
             'pstdev', 'pvariance', 'stdev', 'variance',
             'median',  'median_low', 'median_high', 'median_grouped',
             'mean', 'mode',
+            'RunningStats', 'LogHistogram',
           ]
 
 
@@ -609,4 +633,299 @@ def pstdev(data, mu=None):
     try:
         return var.sqrt()
     except AttributeError:
-        return math.sqrt(var)
\ No newline at end of file
+        return math.sqrt(var)
+
+
+# === Streaming accumulators ===
+#
+# Added by SciDB, Inc.: the functions above need all the data in a list. The
+# accumulators below take one value at a time, in constant memory, so that a
+# long-running loader or benchmark can keep statistics of every timing and
+# size; and they merge, so that the partial statistics of several processes or
+# hosts combine into the statistics of all their data.
+#
+# See http://en.wikipedia.org/wiki/Algorithms_for_calculating_variance for the
+# online and parallel algorithms of RunningStats, and the DDSketch paper
+# (Masson, Rim and Lee, VLDB 2019) for the buckets of LogHistogram.
+
+class LogHistogram(object):
+    """Quantiles of a stream of numbers, within a relative error.
+
+    A value x > 0 is counted in bucket ceil(log(x, gamma)), with
+    gamma = (1 + relative_error) / (1 - relative_error), so every bucket
+    spans values within the relative error of its midpoint. Negative
+    values have their own buckets, and zeros a count. The number of
+    buckets grows with the logarithm of the range of the values, e.g.
+    about 1400 for 1 microsecond to 10 days at 1%; beyond max_buckets
+    the buckets of the values closest to zero are folded together, which
+    only makes the lowest quantiles less accurate.
+
+    >>> h = LogHistogram(0.01, data=range(1, 1001))
+    >>> abs(h.quantile(0.5) - 500.5) < 0.01 * 500.5
+    True
+    """
+    def __init__(self, relative_error=0.01, max_buckets=2048, data=()):
+        if not 0 < relative_error < 1:
+            raise StatisticsError('relative_error must be between 0 and 1')
+        self.relative_error = relative_error
+        self.max_buckets = max_buckets
+        self._gamma = scidb_fdiv(1 + relative_error, 1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        self._positive = {}   # bucket index -> count
+        self._negative = {}   # bucket index of -x -> count
+        self.zeros = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.update(data)
+
+    def _index(self, x):
+        return int(math.ceil(math.log(x) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def _collapse(self, buckets):
+        if len(buckets) <= self.max_buckets:
+            return
+        indexes = sorted(buckets)
+        excess = len(indexes) - self.max_buckets
+        into = indexes[excess]
+        for index in indexes[:excess]:
+            buckets[into] += buckets.pop(index)
+
+    def add(self, x, n=1):
+        """Count the value x, n times."""
+        if x > 0:
+            index = self._index(x)
+            self._positive[index] = self._positive.get(index, 0) + n
+            self._collapse(self._positive)
+        elif x < 0:
+            index = self._index(-x)
+            self._negative[index] = self._negative.get(index, 0) + n
+            self._collapse(self._negative)
+        else:
+            self.zeros += n
+        self.count += n
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def update(self, data):
+        """Count every value of an iterable."""
+        for x in data:
+            self.add(x)
+
+    def merge(self, other):
+        """Add the counts of another LogHistogram with the same relative error.
+
+        @return self.
+        """
+        if other.relative_error != self.relative_error:
+            raise StatisticsError('cannot merge histograms of relative errors %g and %g'
+                                  % (self.relative_error, other.relative_error))
+        for mine, theirs in ((self._positive, other._positive), (self._negative, other._negative)):
+            for index, n in theirs.items():
+                mine[index] = mine.get(index, 0) + n
+            self._collapse(mine)
+        self.zeros += other.zeros
+        self.count += other.count
+        for x in (other.min, other.max):
+            if x is not None:
+                self.min = x if self.min is None else min(self.min, x)
+                self.max = x if self.max is None else max(self.max, x)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return LogHistogram.from_snapshot(self.snapshot()).merge(other)
+
+    def quantile(self, q):
+        """Return the q-quantile, 0 <= q <= 1, e.g. 0.99 for the 99th percentile.
+
+        The result is within the relative error of a value of the data
+        whose rank is q * (count - 1), rounded down; 0 and 1 give the exact
+        minimum and maximum.
+        """
+        if self.count < 1:
+            raise StatisticsError('no quantile for empty data')
+        if not 0 <= q <= 1:
+            raise StatisticsError('quantile must be between 0 and 1')
+        rank = int(q * (self.count - 1))
+        if rank == 0:
+            return self.min
+        if rank == self.count - 1:
+            return self.max
+        seen = 0
+        for index in sorted(self._negative, reverse=True):
+            seen += self._negative[index]
+            if seen > rank:
+                return max(-self._value(index), self.min)
+        seen += self.zeros
+        if seen > rank:
+            return 0
+        for index in sorted(self._positive):
+            seen += self._positive[index]
+            if seen > rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def quantiles(self, qs):
+        """Return the list of the q-quantiles of every q in qs."""
+        return [self.quantile(q) for q in qs]
+
+    def snapshot(self):
+        """Return the state as a dict of plain values, e.g. to send as JSON."""
+        return {'relative_error': self.relative_error, 'max_buckets': self.max_buckets,
+                'positive': sorted(self._positive.items()), 'negative': sorted(self._negative.items()),
+                'zeros': self.zeros, 'count': self.count, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_snapshot(cls, state):
+        """Return a LogHistogram with the state of snapshot()."""
+        h = cls(state['relative_error'], state['max_buckets'])
+        h._positive = dict((int(index), n) for index, n in state['positive'])
+        h._negative = dict((int(index), n) for index, n in state['negative'])
+        h.zeros = state['zeros']
+        h.count = state['count']
+        h.min = state['min']
+        h.max = state['max']
+        return h
+
+
+class RunningStats(object):
+    """Count, mean, variance, minimum and maximum of a stream of numbers.
+
+    The mean and the sum of square deviations are updated with Welford's
+    algorithm, which keeps the precision of the two-pass ``variance`` in
+    floating point, and merged with the parallel formula of Chan et al.
+    With a relative_error, a LogHistogram also keeps the quantiles.
+
+    >>> s = RunningStats(relative_error=0.01)
+    >>> for seconds in [2.5, 3.25, 5.5, 11.25, 11.75]:
+    ...     s.add(seconds)
+    >>> s.stdev()  #doctest: +ELLIPSIS
+    4.38961843444...
+    >>> s.count, s.min, s.max
+    (5, 2.5, 11.75)
+
+    The accumulators are picklable, and snapshot() gives their state as
+    plain values; merge() or + combine them.
+    """
+    def __init__(self, data=(), relative_error=None):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._mean = 0.0
+        self._m2 = 0.0   # The sum of square deviations from the mean.
+        self.histogram = LogHistogram(relative_error) if relative_error else None
+        self.update(data)
+
+    def add(self, x):
+        """Add the value x."""
+        self.count += 1
+        delta = x - self._mean
+        self._mean += scidb_fdiv(delta, self.count)
+        self._m2 += delta * (x - self._mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+        if self.histogram is not None:
+            self.histogram.add(x)
+
+    def update(self, data):
+        """Add every value of an iterable."""
+        for x in data:
+            self.add(x)
+
+    def merge(self, other):
+        """Add the values counted by another RunningStats.
+
+        The quantiles are kept only if both keep them.
+        @return self.
+        """
+        if other.count == 0:
+            return self
+        n = self.count + other.count
+        delta = other._mean - self._mean
+        self._mean += delta * scidb_fdiv(other.count, n)
+        self._m2 += other._m2 + delta * delta * scidb_fdiv(self.count * other.count, n)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        if self.histogram is not None and other.histogram is not None:
+            self.histogram.merge(other.histogram)
+        elif self.histogram is not None:
+            # It would miss the values of other, even if self has none of its own yet.
+            self.histogram = None
+        elif other.histogram is not None and self.count == 0:
+            self.histogram = LogHistogram.from_snapshot(other.histogram.snapshot())
+        self.count = n
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return RunningStats.from_snapshot(self.snapshot()).merge(other)
+
+    def total(self):
+        """Return the sum of the values."""
+        return self._mean * self.count
+
+    def mean(self):
+        """Return the arithmetic mean of the values."""
+        if self.count < 1:
+            raise StatisticsError('mean requires at least one data point')
+        return self._mean
+
+    def variance(self):
+        """Return the sample variance of the values."""
+        if self.count < 2:
+            raise StatisticsError('variance requires at least two data points')
+        return scidb_fdiv(self._m2, self.count - 1)
+
+    def pvariance(self):
+        """Return the population variance of the values."""
+        if self.count < 1:
+            raise StatisticsError('pvariance requires at least one data point')
+        return scidb_fdiv(self._m2, self.count)
+
+    def stdev(self):
+        """Return the square root of the sample variance."""
+        return math.sqrt(self.variance())
+
+    def pstdev(self):
+        """Return the square root of the population variance."""
+        return math.sqrt(self.pvariance())
+
+    def quantile(self, q):
+        """Return the q-quantile; see LogHistogram.quantile."""
+        if self.histogram is None:
+            raise StatisticsError('quantiles require a relative_error')
+        return self.histogram.quantile(q)
+
+    def median(self):
+        """Return the median, within the relative error."""
+        return self.quantile(0.5)
+
+    def snapshot(self):
+        """Return the state as a dict of plain values, e.g. to send as JSON."""
+        return {'count': self.count, 'mean': self._mean, 'm2': self._m2, 'min': self.min, 'max': self.max,
+                'histogram': self.histogram.snapshot() if self.histogram is not None else None}
+
+    @classmethod
+    def from_snapshot(cls, state):
+        """Return a RunningStats with the state of snapshot()."""
+        s = cls()
+        s.count = state['count']
+        s._mean = state['mean']
+        s._m2 = state['m2']
+        s.min = state['min']
+        s.max = state['max']
+        if state.get('histogram'):
+            s.histogram = LogHistogram.from_snapshot(state['histogram'])
+        return s
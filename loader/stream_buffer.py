@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Relay FIFOs through a bounded in-memory buffer that spills to disk.
+
+vcfstreamer writes the VAR, GT and MV streams to three FIFOs. A FIFO only holds
+64 KiB, so when one loader falls behind, vcfstreamer blocks on that FIFO and the
+other two streams stall with it. This relay sits between vcfstreamer and the
+loaders: it always reads its inputs, keeps up to a memory budget per stream, and
+appends the excess to large spill segments on local disk, which are read back in
+order once the loader catches up.
+
+Usage:
+  ./stream_buffer.py --memory 256 --spill-dir /tmp --status P_buffer.json \\
+                     P_vcf_raw_fifo P_vcf_buf_fifo P_gt_raw_fifo P_gt_buf_fifo
+
+The status file is rewritten every second with the occupancy of every stream:
+bytes in and out, bytes held in memory and on disk, and their peaks.
+
+With --progress, the bytes every stream delivered to its loader, and their rate, are
+appended to a JSON lines file (see scidb_progress.JsonLinesSink) every --report-interval
+seconds. With --watch INPUT, the offset the producer, e.g. zcat, has reached in INPUT,
+scaled by the share of its bytes that the slowest stream delivered so far, also
+gives the fraction of the load done and an estimated time to completion.
+"""
+
+import argparse
+import collections
+import errno
+import json
+import os
+import select
+import sys
+import time
+import scidblib
+from scidblib import scidb_progress
+
+READ_SIZE = 1 << 16
+SPILL_READ_SIZE = 1 << 20
+
+class SpillBuffer:
+    """A FIFO byte queue with a memory budget; the excess goes to disk segments.
+
+    Data is kept in order: once anything is spilled, later writes also go to disk
+    until the reader has drained every segment, and only then use memory again.
+
+    Details of public attributes:
+      - memory_bytes:  bytes currently held in memory.
+      - spill_bytes:   bytes currently held in spill segments.
+      - peak_memory_bytes, peak_spill_bytes: the maxima of the two.
+      - spilled_bytes: the total number of bytes ever spilled.
+      - segments:      the number of spill segments ever written.
+    """
+    def __init__(self, name, memory_budget, spill_dir, segment_size):
+        """
+        @param name           a name for the spill segment files.
+        @param memory_budget  the maximum number of bytes to keep in memory.
+        @param spill_dir      where to write the spill segments.
+        @param segment_size   the size at which a spill segment is closed and a new one started.
+        """
+        self._name = name
+        self._memory_budget = memory_budget
+        self._spill_dir = spill_dir
+        self._segment_size = segment_size
+        self._memory = collections.deque()
+        self._sealed = collections.deque()  # closed segments, oldest first: (path, size).
+        self._writing = None                # (path, file, size) of the segment being written.
+        self._reading = None                # (path, file, remaining size) of the segment being read.
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        self.peak_memory_bytes = 0
+        self.peak_spill_bytes = 0
+        self.spilled_bytes = 0
+        self.segments = 0
+
+    def __len__(self):
+        return self.memory_bytes + self.spill_bytes
+
+    def _spilling(self):
+        return self._writing is not None or self._sealed or self._reading is not None
+
+    def _seal(self):
+        path, f, size = self._writing
+        f.close()
+        self._sealed.append((path, size))
+        self._writing = None
+
+    def write(self, data):
+        """Append data at the end of the queue."""
+        if not self._spilling() and self.memory_bytes + len(data) <= self._memory_budget:
+            self._memory.append(data)
+            self.memory_bytes += len(data)
+            self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+            return
+        if self._writing is None:
+            path = os.path.join(self._spill_dir, '%s.%d.spill' % (self._name, self.segments))
+            self._writing = (path, open(path, 'wb'), 0)
+            self.segments += 1
+        path, f, size = self._writing
+        f.write(data)
+        self._writing = (path, f, size + len(data))
+        self.spill_bytes += len(data)
+        self.spilled_bytes += len(data)
+        self.peak_spill_bytes = max(self.peak_spill_bytes, self.spill_bytes)
+        if size + len(data) >= self._segment_size:
+            self._seal()
+
+    def read(self):
+        """Remove and return the next piece of data from the head of the queue, or '' if empty."""
+        if self._memory:
+            data = self._memory.popleft()
+            self.memory_bytes -= len(data)
+            return data
+        if self._reading is None:
+            if not self._sealed and self._writing is not None:
+                # The reader caught up with the writer: hand over the segment being written.
+                self._seal()
+            if not self._sealed:
+                return ''
+            path, size = self._sealed.popleft()
+            self._reading = (path, open(path, 'rb'), size)
+        path, f, remaining = self._reading
+        data = f.read(min(SPILL_READ_SIZE, remaining))
+        remaining -= len(data)
+        self.spill_bytes -= len(data)
+        if remaining == 0:
+            f.close()
+            os.remove(path)
+            self._reading = None
+        else:
+            self._reading = (path, f, remaining)
+        return data
+
+    def close(self):
+        """Delete whatever spill segment is left."""
+        if self._writing is not None:
+            self._seal()
+        if self._reading is not None:
+            self._reading[1].close()
+            self._sealed.appendleft((self._reading[0], 0))
+            self._reading = None
+        for path, size in self._sealed:
+            if os.path.exists(path):
+                os.remove(path)
+        self._sealed.clear()
+
+class Relay:
+    """Move the data of one input FIFO to one output FIFO through a SpillBuffer."""
+    def __init__(self, input_path, output_path, buf):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.buf = buf
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.eof = False
+        # A FIFO opened with O_NONBLOCK does not wait for a writer; select() only reports it
+        # readable once a writer connected, so an early read cannot be mistaken for the end.
+        self.in_fd = os.open(input_path, os.O_RDONLY | os.O_NONBLOCK)
+        self.out_fd = None
+        self.finished = False
+        self._pending = ''
+
+    def try_open_output(self):
+        """Open the output FIFO if its reader is there yet. @return whether it is open."""
+        if self.out_fd is None and not self.finished:
+            try:
+                self.out_fd = os.open(self.output_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:  # ENXIO: no reader yet.
+                    raise
+        return self.out_fd is not None
+
+    def wants_write(self):
+        return self.out_fd is not None and (self._pending or len(self.buf) > 0)
+
+    def done(self):
+        # The output must have been opened, even for an empty input: its reader waits for the open,
+        # and only sees the end of the stream once it is closed.
+        return self.finished or (self.eof and self.out_fd is not None and not self._pending and len(self.buf) == 0)
+
+    def finish(self):
+        """Close the output of a relay that is done, so that its reader sees the end of the stream."""
+        if self.out_fd is not None:
+            os.close(self.out_fd)
+            self.out_fd = None
+        self.finished = True
+
+    def on_readable(self):
+        try:
+            data = os.read(self.in_fd, READ_SIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        if not data:
+            self.eof = True
+            os.close(self.in_fd)
+            self.in_fd = None
+            return
+        self.bytes_in += len(data)
+        self.buf.write(data)
+
+    def on_writable(self):
+        if not self._pending:
+            self._pending = self.buf.read()
+        try:
+            n = os.write(self.out_fd, self._pending)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            if e.errno == errno.EPIPE:
+                raise scidblib.AppError('The reader of %s went away.' % self.output_path)
+            raise
+        self.bytes_out += n
+        self._pending = self._pending[n:]
+
+    def close(self):
+        for fd in (self.in_fd, self.out_fd):
+            if fd is not None:
+                os.close(fd)
+        self.in_fd = self.out_fd = None
+        self.buf.close()
+
+    def status(self):
+        return {'input': self.input_path,
+                'output': self.output_path,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'memory_bytes': self.buf.memory_bytes,
+                'spill_bytes': self.buf.spill_bytes,
+                'peak_memory_bytes': self.buf.peak_memory_bytes,
+                'peak_spill_bytes': self.buf.peak_spill_bytes,
+                'spilled_bytes': self.buf.spilled_bytes,
+                'spill_segments': self.buf.segments,
+                'eof': self.eof}
+
+def write_status(status_file, relays, start_time):
+    """Atomically rewrite the status file with the occupancy of all relays."""
+    tmp = status_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'elapsed': time.time() - start_time, 'streams': [r.status() for r in relays]},
+                  f, indent=1, sort_keys=True)
+    os.rename(tmp, status_file)
+
+def run(relays, status_file=None, status_interval=1.0, tracker=None, watch=None):
+    """Relay until every input reached its end and every buffer was drained into its output.
+
+    @param relays           the Relay objects.
+    @param status_file      where to write the occupancy metrics; None means nowhere.
+    @param status_interval  seconds between two updates of the status file.
+    @param tracker          a ProgressTracker with a step 'relay', and a sub-step per relay
+                            named after its input; None means no progress reporting.
+    @param watch            a ReadPosition of the input of the producer, whose bytes read and
+                            delivered by every stream are the units of the 'relay' step;
+                            None means the relay has no total.
+    @exception AppError if the reader of an output goes away.
+    """
+    start_time = time.time()
+    last_status = 0
+    ended = set()
+    if tracker:
+        tracker.start_step('relay')
+    while not all(r.done() for r in relays):
+        for r in relays:
+            r.try_open_output()
+        readers = [r for r in relays if not r.eof]
+        writers = [r for r in relays if r.wants_write()]
+        readable, writable, unused = select.select([r.in_fd for r in readers],
+                                                   [r.out_fd for r in writers], [], 0.1)
+        for r in readers:
+            if r.in_fd in readable:
+                r.on_readable()
+        for r in writers:
+            if r.out_fd in writable:
+                r.on_writable()
+                if tracker:
+                    tracker.update(r.input_path, r.bytes_out)
+        for r in relays:
+            if r.done() and not r.finished:
+                r.finish()
+        if tracker:
+            for r in relays:
+                if r.done() and r.input_path not in ended:
+                    ended.add(r.input_path)
+                    tracker.end_step(r.input_path)
+            if watch:
+                # The input read counts as done in the proportion the slowest stream delivered.
+                delivered = min(r.bytes_out * 1.0 / r.bytes_in if r.bytes_in else 1.0 for r in relays)
+                tracker.update('relay', int(watch.position() * delivered))
+        if status_file and time.time() - last_status >= status_interval:
+            write_status(status_file, relays, start_time)
+            last_status = time.time()
+    for r in relays:
+        r.finish()
+    if status_file:
+        write_status(status_file, relays, start_time)
+    if tracker:
+        if watch:
+            tracker.update('relay', watch.size)
+        tracker.end_step('relay')
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Relay FIFOs through memory-bounded buffers that spill to disk.')
+    parser.add_argument('-m', '--memory', type=int, default=256, metavar='MB',
+                        help='The memory budget of every stream. Default is 256.')
+    parser.add_argument('--segment', type=int, default=64, metavar='MB',
+                        help='The size of a spill segment. Default is 64.')
+    parser.add_argument('-d', '--spill-dir', default='.', help='Where to write the spill segments. Default is the current directory.')
+    parser.add_argument('-s', '--status', help='A JSON file to keep updated with the buffer occupancy.')
+    parser.add_argument('-p', '--progress', metavar='FILE',
+                        help='A JSON lines file to append the progress of every stream to.')
+    parser.add_argument('-w', '--watch', metavar='INPUT',
+                        help='The input file of the producer, e.g. the VCF file zcat reads, to estimate the time to completion from.')
+    parser.add_argument('--report-interval', type=float, default=60.0,
+                        help='The seconds between two progress reports. Default is 60.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Print the progress, and a summary of every stream at the end.')
+    parser.add_argument('fifos', nargs='+', metavar='IN OUT', help='Pairs of input and output FIFOs.')
+    args = parser.parse_args(argv[1:])
+
+    if len(args.fifos) % 2 != 0:
+        parser.error('The FIFOs must come in input/output pairs.')
+    if args.watch and not os.path.isfile(args.watch):
+        parser.error('There is no file %s to watch.' % args.watch)
+
+    relays = []
+    tracker = None
+    watch = None
+    try:
+        if args.progress or args.verbose:
+            sink = scidb_progress.JsonLinesSink(args.progress) if args.progress else None
+            tracker = scidb_progress.ProgressTracker(
+                out=sys.stderr, name='stream_buffer', if_print_start=False, if_print_end=args.verbose,
+                if_print_skip=False, if_print_progress=args.verbose, report_interval=args.report_interval, sink=sink)
+            if args.watch:
+                watch = scidb_progress.ReadPosition(args.watch)
+            tracker.register_step('relay', 'relay the streams of ' + (args.watch or 'the producer'),
+                                  total=watch.size if watch else None, unit='bytes')
+        for i in range(0, len(args.fifos), 2):
+            name = '%s.%d' % (os.path.basename(args.fifos[i]), os.getpid())
+            buf = SpillBuffer(name, args.memory << 20, args.spill_dir, args.segment << 20)
+            relays.append(Relay(args.fifos[i], args.fifos[i + 1], buf))
+            if tracker:
+                tracker.register_step(args.fifos[i], 'relay %s to %s' % (args.fifos[i], args.fifos[i + 1]),
+                                      parent='relay', unit='bytes')
+        run(relays, args.status, tracker=tracker, watch=watch)
+        if args.verbose:
+            for r in relays:
+                s = r.status()
+                print >> sys.stderr, '%s: %d bytes, peak %d in memory, %d spilled to %d segments.' % (
+                    s['input'], s['bytes_in'], s['peak_memory_bytes'], s['spilled_bytes'], s['spill_segments'])
+    except scidblib.AppError as e:
+        print >> sys.stderr, e
+        return 1
+    finally:
+        for r in relays:
+            r.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,6 +23,52 @@ if [ ${#PREFIX} -eq 0 ] ; then
 	 exit 1
 fi
 
+#SCIDB_TRACE=<dir> records the streamer, the loaders and every query below as events of a Chrome trace (see trace_tool.py)
+TRACE=""
+if [ -n "$SCIDB_TRACE" ]; then
+  TRACE="./trace_tool.py run -g load:$PREFIX --"
+fi
+#SCIDB_HOST and SCIDB_PORT (load_scheduler.py -c and -p) name the coordinator; the Python tools below read them too
+IQUERY=`type -P iquery`
+LOADCSV=`type -P loadcsv.py`
+iquery()     { $TRACE $IQUERY ${SCIDB_HOST:+-c $SCIDB_HOST} ${SCIDB_PORT:+-p $SCIDB_PORT} "$@"; }
+loadcsv.py() { $TRACE $LOADCSV ${SCIDB_HOST:+-d $SCIDB_HOST} ${SCIDB_PORT:+-p $SCIDB_PORT} "$@"; }
+
+#Skip the content already ingested, or already loaded into this prefix's buffers (see load_manifest.py)
+STAGE=`./load_manifest.py stage $INFILE $PREFIX`
+if [ "$STAGE" == "loaded" ] || [ "$STAGE" == "redimmed" ]; then
+  echo "The content of $INFILE is already $STAGE; skipping the load"
+  exit 0
+fi
+
+#Chunk length of the 1-D load buffers; chunk_advisor.py recommends one for your input
+BUF_CHUNK=${BUF_CHUNK:-1000000}
+
+#ID_MODE=position makes vcfstreamer compute position-derived variant ids (see kg_layout.py),
+#so that redim_with_prefix.sh needs no global sort/uniq and files can be redimensioned in any order.
+#The target arrays should then be created with chunk_advisor.py --position-ids: the ids are NUM_SLOTS apart per
+#base pair, so the variant_id chunks of kgenomes_schema.afl would be almost empty. The load checks the chunk length
+#of KG_VARIANT against the one chunk_advisor.py recommends for the file: it warns below it, and fails ten times below it.
+ID_MODE=${ID_MODE:-sequential}
+if [ "$ID_MODE" == "position" ]; then
+  VID_ATTRIBUTE=", vid: int64"
+  STREAMER_ID_ARGS="-d ${PREFIX}_vid_side_file"
+  VARIANT_CHUNK=`iquery -ocsv -aq "project(dimensions(KG_VARIANT), chunk_interval)" | sed -n 2p`
+  if [[ "$VARIANT_CHUNK" =~ ^[0-9]+$ ]]; then
+    ADVISED_CHUNK=`./chunk_advisor.py --position-ids --print variant_chunk -n 2000 $INFILE 2> /dev/null`
+    if [[ "$ADVISED_CHUNK" =~ ^[0-9]+$ ]] && [ "$VARIANT_CHUNK" -lt "$ADVISED_CHUNK" ]; then
+      echo "The variant_id chunk length of KG_VARIANT, $VARIANT_CHUNK, is below the $ADVISED_CHUNK that position-derived ids need;"
+      echo "create the target arrays with: ./chunk_advisor.py --position-ids -o kgenomes_schema.afl $INFILE && ./reset_db.sh"
+      if [ "$((VARIANT_CHUNK * 10))" -lt "$ADVISED_CHUNK" ]; then
+        exit 1
+      fi
+    fi
+  fi
+else
+  VID_ATTRIBUTE=""
+  STREAMER_ID_ARGS=""
+fi
+
 SAMPLE_BUF_ATTRIBUTES=" <nsid:   int64       ,
                          sample_name: string >"
 VAR_BUF_ATTRIBUTES="    <nvid:   int64       ,
@@ -35,7 +81,8 @@ VAR_BUF_ATTRIBUTES="    <nvid:   int64       ,
                          filter: string  null,
                          ns:     int64   null,
                          an:     int64   null,
-                         misc:   string  null>"
+                         misc:   string  null
+                         ${VID_ATTRIBUTE}>"
 GT_BUF_ATTRIBUTES="     <nvid:   int64       , 
                          nsid:   int64       , 
                          gt:     string      >"
@@ -43,21 +90,69 @@ MV_BUF_ATTRIBUTES="     <nvid:   int64       ,
                          order_nbr:   int64  ,
                          ac:     int64   null,
                          af:     double  null>"
-
-iquery -anq "remove(${PREFIX}_KG_SAMPLE_BUF)"       > /dev/null 2>&1 
-iquery -anq "remove(${PREFIX}_KG_VAR_BUF)"          > /dev/null 2>&1
-iquery -anq "remove(${PREFIX}_KG_GT_BUF)"           > /dev/null 2>&1
-iquery -anq "remove(${PREFIX}_KG_MV_BUF)"           > /dev/null 2>&1
+STATS_BUF_ATTRIBUTES="  <nvid:   int64       ,
+                         order_nbr:   int64  ,
+                         ac:     int64       ,
+                         an:     int64       ,
+                         af:     double  null,
+                         het:    int64       ,
+                         hom_alt: int64      ,
+                         missing: int64      >"
+
+#ALLELE_STATS=1 also computes the allele counts and frequencies of every variant from its genotypes
+#(see allele_stats.py, which needs NumPy); redim_with_prefix.sh stores them in KG_VARIANT_ALLELE_STATS.
+ALLELE_STATS=${ALLELE_STATS:-0}
+
+#A bad row does not abort the load: every loader goes on past up to LOAD_ERRORS_ALLOWED bad rows per instance
+#(default 100), and records them in the shadow array of its buffer, e.g. ${PREFIX}_KG_GT_BUF_SHADOW. Once all
+#loaders are done, the bad rows are counted and written to e.g. ${PREFIX}_KG_GT_BUF_bad_rows.csv, and a load
+#with bad rows fails, so that its buffers are not redimensioned. LOAD_ERRORS_ALLOWED=0 stops at the first bad row.
+LOAD_ERRORS_ALLOWED=${LOAD_ERRORS_ALLOWED:-100}
+
+#The create statements of a buffer and of its shadow array, whose attributes are those of the buffer as nullable
+#strings, and the row_offset of the bad row in the input
+declare_buffer()
+{
+  local SHADOW_ATTRIBUTES=`echo "$2" | tr -d '\n' | sed -e 's/:[^,>]*/: string null/g' -e 's/>$/, row_offset: int64 null>/'`
+  echo "create array $1 $2 [ n = 0:*,${BUF_CHUNK},0];
+        create array $1_SHADOW $SHADOW_ATTRIBUTES [ n = 0:*,${BUF_CHUNK},0];"
+}
+
+#Empty buffers for this load: ensure_arrays.py works out the removes and creates, and runs them as one iquery script
+SHADOWED=""
+BUFFERS="`declare_buffer ${PREFIX}_KG_SAMPLE_BUF "$SAMPLE_BUF_ATTRIBUTES"`
+         `declare_buffer ${PREFIX}_KG_VAR_BUF    "$VAR_BUF_ATTRIBUTES"`
+         `declare_buffer ${PREFIX}_KG_GT_BUF     "$GT_BUF_ATTRIBUTES"`
+         `declare_buffer ${PREFIX}_KG_MV_BUF     "$MV_BUF_ATTRIBUTES"`"
+SHADOWED="${PREFIX}_KG_SAMPLE_BUF ${PREFIX}_KG_VAR_BUF ${PREFIX}_KG_GT_BUF ${PREFIX}_KG_MV_BUF"
+if [ "$ID_MODE" == "position" ]; then
+  BUFFERS="$BUFFERS `declare_buffer ${PREFIX}_KG_VID_SIDE_BUF '<vid: int64, signature: string>'`"
+  SHADOWED="$SHADOWED ${PREFIX}_KG_VID_SIDE_BUF"
+else
+  BUFFERS="$BUFFERS remove(${PREFIX}_KG_VID_SIDE_BUF); remove(${PREFIX}_KG_VID_SIDE_BUF_SHADOW);"
+fi
+if [ "$ALLELE_STATS" == "1" ]; then
+  BUFFERS="$BUFFERS `declare_buffer ${PREFIX}_KG_ALLELE_STATS_BUF "$STATS_BUF_ATTRIBUTES"`"
+  SHADOWED="$SHADOWED ${PREFIX}_KG_ALLELE_STATS_BUF"
+else
+  BUFFERS="$BUFFERS remove(${PREFIX}_KG_ALLELE_STATS_BUF); remove(${PREFIX}_KG_ALLELE_STATS_BUF_SHADOW);"
+fi
+#The options of a loader of a buffer: the bad rows allowed, and the shadow array to record them in
+errors_into()
+{
+  echo "-e $LOAD_ERRORS_ALLOWED -w $1_SHADOW"
+}
 
 set -e 
 
-iquery -aq "create array ${PREFIX}_KG_SAMPLE_BUF $SAMPLE_BUF_ATTRIBUTES [ n             = 0:*,1000000,0]" > /dev/null
-iquery -aq "create array ${PREFIX}_KG_VAR_BUF    $VAR_BUF_ATTRIBUTES    [ n             = 0:*,1000000,0]" > /dev/null
-iquery -aq "create array ${PREFIX}_KG_GT_BUF     $GT_BUF_ATTRIBUTES     [ n             = 0:*,1000000,0]" > /dev/null
-iquery -aq "create array ${PREFIX}_KG_MV_BUF     $MV_BUF_ATTRIBUTES     [ n             = 0:*,1000000,0]" > /dev/null
+echo "$BUFFERS" | ./ensure_arrays.py --fresh - > /dev/null
 
-rm -rf ${PREFIX}_sample_buf_file ${PREFIX}_vcf_buf_fifo ${PREFIX}_gt_buf_fifo ${PREFIX}_mv_buf_fifo 
-rm -rf ${PREFIX}_vcf_load.log ${PREFIX}_gt_load.log ${PREFIX}_mv_load.log ${PREFIX}_samples_load.log
+rm -rf ${PREFIX}_sample_buf_file ${PREFIX}_vcf_buf_fifo ${PREFIX}_gt_buf_fifo ${PREFIX}_mv_buf_fifo ${PREFIX}_vid_side_file ${PREFIX}_stats_buf_fifo
+rm -rf ${PREFIX}_vcf_raw_fifo ${PREFIX}_gt_raw_fifo ${PREFIX}_mv_raw_fifo
+rm -rf ${PREFIX}_vcf_load.log ${PREFIX}_gt_load.log ${PREFIX}_mv_load.log ${PREFIX}_samples_load.log ${PREFIX}_stream_buffer.json ${PREFIX}_progress.jsonl
+rm -f ${PREFIX}_KG_*_BUF_bad_rows.csv
+#The resume state of a redim describes the buffers it was run on: new buffers start a new redim
+rm -f ${PREFIX}_redim_state
 
 echo "Launching streamer"
 
@@ -65,11 +160,38 @@ mkfifo ${PREFIX}_vcf_buf_fifo
 mkfifo ${PREFIX}_gt_buf_fifo
 mkfifo ${PREFIX}_mv_buf_fifo
 
-zcat $INFILE | ./vcfstreamer/vcfstreamer ${PREFIX}_sample_buf_file ${PREFIX}_vcf_buf_fifo ${PREFIX}_gt_buf_fifo ${PREFIX}_mv_buf_fifo &
+#STREAM_BUFFER_MB=<n> puts stream_buffer.py between vcfstreamer and the loaders, so that a slow loader does not
+#stall the other streams: each stream gets n MB of memory, then spills to STREAM_SPILL_DIR.
+#Buffer occupancy is kept up to date in ${PREFIX}_stream_buffer.json, and the progress of every stream, with the
+#estimated time to completion of the load, is appended to ${PREFIX}_progress.jsonl every STREAM_PROGRESS_SECONDS (default 60).
+if [ -n "$STREAM_BUFFER_MB" ]; then
+  mkfifo ${PREFIX}_vcf_raw_fifo
+  mkfifo ${PREFIX}_gt_raw_fifo
+  mkfifo ${PREFIX}_mv_raw_fifo
+  ./stream_buffer.py -v -m $STREAM_BUFFER_MB -d ${STREAM_SPILL_DIR:-.} -s ${PREFIX}_stream_buffer.json \
+    -p ${PREFIX}_progress.jsonl -w $INFILE --report-interval ${STREAM_PROGRESS_SECONDS:-60} \
+    ${PREFIX}_vcf_raw_fifo ${PREFIX}_vcf_buf_fifo \
+    ${PREFIX}_gt_raw_fifo  ${PREFIX}_gt_buf_fifo  \
+    ${PREFIX}_mv_raw_fifo  ${PREFIX}_mv_buf_fifo  > ${PREFIX}_stream_buffer.log 2>&1 &
+  STREAMER_OUTPUTS="${PREFIX}_vcf_raw_fifo ${PREFIX}_gt_raw_fifo ${PREFIX}_mv_raw_fifo"
+else
+  STREAMER_OUTPUTS="${PREFIX}_vcf_buf_fifo ${PREFIX}_gt_buf_fifo ${PREFIX}_mv_buf_fifo"
+fi
+
+zcat $INFILE | $TRACE ./vcfstreamer/vcfstreamer $STREAMER_ID_ARGS ${PREFIX}_sample_buf_file $STREAMER_OUTPUTS &
+
+loadcsv.py           -v -i ${PREFIX}_vcf_buf_fifo   -a ${PREFIX}_KG_VAR_BUF     -D '\t' `errors_into ${PREFIX}_KG_VAR_BUF` > ${PREFIX}_vcf_load.log 2>&1 &
+./loadcsv_express.py -v -i ${PREFIX}_gt_buf_fifo    -a ${PREFIX}_KG_GT_BUF      -D '\t' `errors_into ${PREFIX}_KG_GT_BUF` \
+                     -W ${PREFIX}_KG_GT_BUF_bad_rows.csv > ${PREFIX}_gt_load.log  2>&1 &
+loadcsv.py           -v -i ${PREFIX}_mv_buf_fifo    -a ${PREFIX}_KG_MV_BUF      -D '\t' `errors_into ${PREFIX}_KG_MV_BUF` > ${PREFIX}_mv_load.log  2>&1 &
 
-loadcsv.py           -v -i ${PREFIX}_vcf_buf_fifo   -a ${PREFIX}_KG_VAR_BUF     -D '\t' > ${PREFIX}_vcf_load.log 2>&1 &
-./loadcsv_express.py -v -i ${PREFIX}_gt_buf_fifo    -a ${PREFIX}_KG_GT_BUF      -D '\t' > ${PREFIX}_gt_load.log  2>&1 &
-loadcsv.py           -v -i ${PREFIX}_mv_buf_fifo    -a ${PREFIX}_KG_MV_BUF      -D '\t' > ${PREFIX}_mv_load.log  2>&1 &
+#The allele statistics read the input on their own, next to the streamer
+if [ "$ALLELE_STATS" == "1" ]; then
+  mkfifo ${PREFIX}_stats_buf_fifo
+  $TRACE ./allele_stats.py -v -o ${PREFIX}_stats_buf_fifo $INFILE > ${PREFIX}_allele_stats.log 2>&1 &
+  loadcsv.py         -v -i ${PREFIX}_stats_buf_fifo -a ${PREFIX}_KG_ALLELE_STATS_BUF -D '\t' `errors_into ${PREFIX}_KG_ALLELE_STATS_BUF` \
+                     > ${PREFIX}_stats_load.log 2>&1 &
+fi
 
 FAILURES=0
 for job in `jobs -p`
@@ -85,8 +207,33 @@ echo "Streamer load failed"
 exit 1
 fi
 
-loadcsv.py -i ${PREFIX}_sample_buf_file -a ${PREFIX}_KG_SAMPLE_BUF -D '\t' > ${PREFIX}_samples_load.log 2>&1
+loadcsv.py -i ${PREFIX}_sample_buf_file -a ${PREFIX}_KG_SAMPLE_BUF -D '\t' `errors_into ${PREFIX}_KG_SAMPLE_BUF` > ${PREFIX}_samples_load.log 2>&1
+if [ "$ID_MODE" == "position" ] && [ -s ${PREFIX}_vid_side_file ]; then
+  loadcsv.py -i ${PREFIX}_vid_side_file -a ${PREFIX}_KG_VID_SIDE_BUF -D '\t' `errors_into ${PREFIX}_KG_VID_SIDE_BUF` \
+    > ${PREFIX}_vid_side_load.log 2>&1
+fi
+
+#Report the bad rows the loaders skipped; the buffers miss them, so the load is not marked as done
+BAD_ROWS=0
+for BUF in $SHADOWED; do
+  NUM_BAD=`iquery -ocsv -aq "op_count(${BUF}_SHADOW)" | tail -n 1`
+  if [ "$NUM_BAD" != "0" ]; then
+    if [ ! -s ${BUF}_bad_rows.csv ]; then
+      iquery -ocsv -aq "scan(${BUF}_SHADOW)" > ${BUF}_bad_rows.csv
+    fi
+    echo "$NUM_BAD bad rows were not loaded into $BUF; see ${BUF}_bad_rows.csv"
+    BAD_ROWS=$((BAD_ROWS + NUM_BAD))
+  fi
+done
+if [ "$BAD_ROWS" != "0" ]; then
+  echo "Streamer load skipped $BAD_ROWS bad rows; fix the input and load it again"
+  exit 1
+fi
+#No bad row: the empty shadow arrays go
+./ensure_arrays.py `for BUF in $SHADOWED; do echo -r ${BUF}_SHADOW; done` > /dev/null
 
 #So if we made it this far, chances are life is good
-rm -rf ${PREFIX}_sample_buf_file ${PREFIX}_vcf_buf_fifo ${PREFIX}_gt_buf_fifo ${PREFIX}_mv_buf_fifo
+./load_manifest.py loaded $INFILE $PREFIX
+rm -rf ${PREFIX}_sample_buf_file ${PREFIX}_vcf_buf_fifo ${PREFIX}_gt_buf_fifo ${PREFIX}_mv_buf_fifo ${PREFIX}_vid_side_file ${PREFIX}_stats_buf_fifo
+rm -rf ${PREFIX}_vcf_raw_fifo ${PREFIX}_gt_raw_fifo ${PREFIX}_mv_raw_fifo
 rm ${PREFIX}_*.log
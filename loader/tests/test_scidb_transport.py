@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Tests of scidb_transport.ShimTransport against the shim of the local SciDB stand-in.
+
+Run from the loader directory:
+  python -m unittest discover -s tests
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+LOADER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LOADER_DIR)
+sys.path.insert(0, os.path.join(LOADER_DIR, 'localdb'))
+# localdb reads its state directory when imported.
+STATE_DIR = tempfile.mkdtemp(prefix='localdb_test_')
+os.environ['LOCALDB_DIR'] = STATE_DIR
+
+import localdb
+from scidblib import scidb_afl
+from scidblib import scidb_transport
+
+class ClosingShimHandler(localdb.ShimHandler):
+    """The shim of the stand-in, which closes every connection after answering once closing is set,
+    as shim does with the connections idle for too long."""
+    closing = False
+
+    def do_GET(self):
+        localdb.ShimHandler.do_GET(self)
+        if ClosingShimHandler.closing:
+            self.close_connection = 1
+
+class ShimTransportTest(unittest.TestCase):
+    def setUp(self):
+        ClosingShimHandler.closing = False
+        self.server = localdb.ShimServer(('localhost', 0))
+        self.server.RequestHandlerClass = ClosingShimHandler
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.transport = scidb_transport.ShimTransport('http://localhost:%d' % self.server.server_address[1])
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        for name in os.listdir(STATE_DIR):
+            path = os.path.join(STATE_DIR, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def count_arrays(self):
+        """@return the number of arrays named A..., from list('arrays') through the transport."""
+        return len([row for row in scidb_afl.afl_rows(self.transport, "list('arrays')") if row.name.startswith('A')])
+
+    def executed(self, query):
+        """@return how many times the stand-in ran a query."""
+        path = os.path.join(STATE_DIR, 'queries.log')
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return sum(1 for line in f if json.loads(line)['query'] == query)
+
+    def test_reuses_the_connection_and_session(self):
+        for n in range(3):
+            self.transport.afl("create array A%d <a:int64> [i=0:*,10,0]" % n)
+        self.assertEqual(3, self.count_arrays())
+        self.assertEqual(1, self.transport.connections_opened)
+        self.assertEqual(1, self.transport.sessions_opened)
+
+    def test_resends_once_after_an_idle_close(self):
+        self.transport.afl('create array A <a:int64> [i=0:*,10,0]')
+        # The connection is idle in the transport; shim closes it once it answered the next request.
+        ClosingShimHandler.closing = True
+        self.transport.afl('create array B <a:int64> [i=0:*,10,0]')
+        query = 'create array C <a:int64> [i=0:*,10,0]'
+        self.transport.afl(query)
+        self.assertEqual(1, self.executed(query))
+        self.assertEqual(2, self.transport.connections_opened)
+        self.assertEqual(1, self.transport.sessions_opened)
+
+    def test_opens_a_new_session_when_shim_expired_it(self):
+        self.transport.afl('create array A <a:int64> [i=0:*,10,0]')
+        self.server.sessions.clear()
+        query = 'create array B <a:int64> [i=0:*,10,0]'
+        self.transport.afl(query)
+        self.assertEqual(1, self.executed(query))
+        self.assertEqual(1, self.transport.connections_opened)
+        self.assertEqual(2, self.transport.sessions_opened)
+
+    def test_closing_lines_early_cancels_and_releases_the_session(self):
+        for n in range(3):
+            self.transport.afl("create array A%d <a:int64> [i=0:*,10,0]" % n)
+        lines = self.transport.lines("list('arrays')", 'csv')
+        self.assertTrue(lines.next().startswith('name,'))
+        lines.close()
+        self.assertEqual({}, self.server.sessions)
+        # The connection still had the rest of the result on it: the next query gets a new one, after the
+        # connection of the cancel.
+        self.assertEqual(3, self.count_arrays())
+        self.assertEqual(3, self.transport.connections_opened)
+        self.assertEqual(2, self.transport.sessions_opened)
+
+def tearDownModule():
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""Record, merge and summarize the Chrome traces of a load (see scidblib/scidb_trace.py).
+
+With SCIDB_TRACE=<dir>, loadcsv_express.py, load_scheduler.py and the scidb_afl queries
+write trace files to <dir>, and the shell scripts run their commands through 'run'.
+
+Examples:
+  - Run a command as one event of the trace, grouped under the calling script:
+      ./trace_tool.py run -g redim:FILE_1 -- iquery -anq "remove(X)"
+  - Merge all the trace files of a load into one file for chrome://tracing or Perfetto:
+      ./trace_tool.py merge -o load_trace.json /tmp/trace
+  - Print the busy time of a load and the gaps when nothing was running:
+      ./trace_tool.py gaps --min-gap 5 /tmp/trace
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+from scidblib import scidb_trace
+
+def command_name(cmd):
+    """A short name of a command: its program, and for iquery the outer AFL operators of its query."""
+    name = os.path.basename(cmd[0])
+    if name == 'iquery':
+        for i in range(1, len(cmd) - 1):
+            if cmd[i].startswith('-') and not cmd[i].startswith('--') and cmd[i].endswith('q'):
+                return scidb_trace.iquery_name(cmd[i + 1])
+    return name
+
+def run(cmd, name, group):
+    """Run a command, and record it as one event if tracing is on.
+
+    The event goes in the row group of the parent process, i.e. the calling script.
+    @return the exit status of the command.
+    """
+    tracer = scidb_trace.tracer()
+    if tracer is None:
+        return subprocess.call(cmd)
+    start = scidb_trace.now_us()
+    p = subprocess.Popen(cmd)
+    code = p.wait()
+    parent = os.getppid()
+    if group:
+        tracer.process_name(parent, group)
+    tracer.complete(name or command_name(cmd), 'command', start, scidb_trace.now_us(), parent, p.pid,
+                    {'cmd': ' '.join(cmd), 'exit_status': code})
+    return code
+
+def read_events(paths):
+    """Read the events of trace files, skipping a line cut short by a crash.
+
+    @param paths  trace files, and directories whose *.trace files to read.
+    @return the list of events.
+    """
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.trace'))) if os.path.isdir(path) else [path])
+    events = []
+    for path in files:
+        with open(path) as f:
+            for line in f:
+                line = line.strip().rstrip(',')
+                if line in ('', '[', ']'):
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    print >> sys.stderr, 'Skipping a truncated event in %s.' % path
+    return events
+
+def merge(events):
+    """Drop duplicate metadata and the names of empty row groups, and sort by time.
+
+    @return the events of one trace.
+    """
+    busy_pids = set(e['pid'] for e in events if e['ph'] != 'M')
+    meta = {}
+    for e in events:
+        if e['ph'] == 'M' and e['pid'] in busy_pids:
+            meta[(e['name'], e['pid'], e['tid'])] = e
+    return [meta[key] for key in sorted(meta)] + sorted([e for e in events if e['ph'] != 'M'], key=lambda e: e['ts'])
+
+def gaps(events, min_gap_us):
+    """Find the intervals when no event was in progress.
+
+    @return (first start, last end, busy microseconds, list of (gap start, gap end, last event, next event)).
+    """
+    intervals = sorted((e['ts'], e['ts'] + e['dur'], e['name']) for e in events if e['ph'] == 'X')
+    if not intervals:
+        return None
+    found = []
+    busy = 0
+    cur_start, cur_end, cur_name = intervals[0]
+    for start, end, name in intervals[1:]:
+        if start > cur_end:
+            busy += cur_end - cur_start
+            if start - cur_end >= min_gap_us:
+                found.append((cur_end, start, cur_name, name))
+            cur_start, cur_end, cur_name = start, end, name
+        elif end > cur_end:
+            cur_end, cur_name = end, name
+    busy += cur_end - cur_start
+    return intervals[0][0], cur_end, busy, found
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    parser = argparse.ArgumentParser(description='Record, merge and summarize the Chrome traces of a load.')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Run a command as one event of the trace, if SCIDB_TRACE is set.')
+    run_parser.add_argument('-n', '--name', help='The name of the event. Default is the program, and the AFL operators for iquery.')
+    run_parser.add_argument('-g', '--group', help='The name of the row group of the calling script.')
+    run_parser.add_argument('cmd', nargs=argparse.REMAINDER, help='The command, after --.')
+    merge_parser = subparsers.add_parser('merge', help='Merge trace files into one Chrome trace.')
+    merge_parser.add_argument('-o', '--output', default='trace.json', help='The merged trace. Default is trace.json.')
+    merge_parser.add_argument('paths', nargs='+', help='Trace files, or directories of *.trace files.')
+    gaps_parser = subparsers.add_parser('gaps', help='Print the busy time and the idle gaps of a trace.')
+    gaps_parser.add_argument('--min-gap', type=float, default=1.0, help='The shortest gap to print, in seconds. Default is 1.')
+    gaps_parser.add_argument('paths', nargs='+', help='Trace files, or directories of *.trace files.')
+    args = parser.parse_args(argv[1:])
+
+    if args.command == 'run':
+        cmd = args.cmd[1:] if args.cmd and args.cmd[0] == '--' else args.cmd
+        if not cmd:
+            run_parser.error('Please provide a command.')
+        return run(cmd, args.name, args.group)
+
+    events = read_events(args.paths)
+    if args.command == 'merge':
+        with open(args.output, 'w') as f:
+            json.dump({'traceEvents': merge(events), 'displayTimeUnit': 'ms'}, f)
+        print 'Wrote %d events to %s.' % (len(events), args.output)
+        return 0
+
+    summary = gaps(events, args.min_gap * 1e6)
+    if summary is None:
+        print 'No events.'
+        return 0
+    first, last, busy, found = summary
+    print 'Span %.1f s, busy %.1f s (%.0f%%), %d gaps of at least %g s:' % (
+        (last - first) / 1e6, busy / 1e6, busy * 100.0 / max(last - first, 1), len(found), args.min_gap)
+    for start, end, before, after in found:
+        print '  %8.1f s .. %8.1f s  %6.1f s idle, after %s, before %s' % (
+            (start - first) / 1e6, (end - first) / 1e6, (end - start) / 1e6, before, after)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# This file is part of SciDB.
+# Copyright (C) 2008-2014 SciDB, Inc.
+#
+# SciDB is free software: you can redistribute it and/or modify
+# it under the terms of the AFFERO GNU General Public License as published by
+# the Free Software Foundation.
+#
+# SciDB is distributed "AS-IS" AND WITHOUT ANY WARRANTY OF ANY KIND,
+# INCLUDING ANY IMPLIED WARRANTY OF MERCHANTABILITY,
+# NON-INFRINGEMENT, OR FITNESS FOR A PARTICULAR PURPOSE. See
+# the AFFERO GNU General Public License for the complete license terms.
+#
+# You should have received a copy of the AFFERO GNU General Public License
+# along with SciDB.  If not, see <http://www.gnu.org/licenses/agpl-3.0.html>
+#
+# END_COPYRIGHT
+
+"""A minimal pure-Python VCF reader, for the tools that need to look at VCF input without vcfstreamer.
+
+Only the subset of VCF produced by 1000 Genomes is understood: a '##' meta section,
+one '#CHROM' header line with the sample names, then one tab-separated line per site.
+"""
+
+import gzip
+import os
+
+# Column positions of a VCF data line.
+CHROM, POS, ID, REF, ALT, QUAL, FILTER, INFO, FORMAT = range(9)
+NUM_FIXED_COLUMNS = 9
+
+def open_vcf(path):
+    """Open a VCF file, transparently decompressing gzip or BGZF input.
+
+    @param path  the file path.
+    @return a file-like object yielding text lines.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == '\x1f\x8b':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+def compressed_fraction_read(f, path):
+    """Estimate which fraction of a (possibly compressed) VCF file has been consumed.
+
+    @param f     a file object returned by open_vcf().
+    @param path  the path it was opened from.
+    @return a number in (0, 1].
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return 1.0
+    raw = f.fileobj if isinstance(f, gzip.GzipFile) else f
+    return min(1.0, max(raw.tell(), 1) * 1.0 / size)
+
+def read_header(f):
+    """Consume the meta and header lines of a VCF file.
+
+    @param f  a file object positioned at the start of the VCF.
+    @return (meta_lines, sample_names)
+    @exception ValueError if there is no '#CHROM' header line.
+    """
+    meta = []
+    for line in f:
+        if line.startswith('##'):
+            meta.append(line.rstrip('\n'))
+        elif line.startswith('#'):
+            columns = line.rstrip('\n').split('\t')
+            return meta, columns[NUM_FIXED_COLUMNS:]
+        else:
+            break
+    raise ValueError('VCF input has no #CHROM header line.')
+
+def records(f, limit=None):
+    """Iterate over the data lines of a VCF file whose header was already consumed.
+
+    @param f      a file object positioned after the header.
+    @param limit  the maximum number of records to produce. Default is no limit.
+    @return a generator of lists of column strings.
+    """
+    n = 0
+    for line in f:
+        if limit is not None and n >= limit:
+            return
+        if len(line) <= 1:
+            continue
+        yield line.rstrip('\n').split('\t')
+        n += 1
+
+def parse_info(info):
+    """Split an INFO column into a dict; flags map to True.
+
+    @param info  the INFO string, e.g. 'NS=3;AF=0.5;DB'.
+    @return a dict mapping keys to string values.
+    """
+    result = {}
+    if info == '.' or not info:
+        return result
+    for item in info.split(';'):
+        key, sep, value = item.partition('=')
+        result[key] = value if sep else True
+    return result
+
+def signature(fields):
+    """The variant signature used by redim_with_prefix.sh, e.g. '21:10435894 C>T'.
+
+    @param fields  a record as produced by records().
+    @return the signature string.
+    """
+    return '%s:%s %s>%s' % (fields[CHROM], fields[POS], fields[REF], fields[ALT])
@@ -16,6 +16,12 @@
  * 3) Stream VCF_MV buffer:
  * variant_idx, mv_idx, ac, af
  * i          , i     , i , f
+ *
+ * With -d SIDE_FILE, every VCF buffer line also ends with a deterministic variant id:
+ *   vid = chrom_code << 40 | pos << 8 | slot
+ * where chrom_code follows kg_layout.py, and slot is a hash of "ref>alt" in [0, 255].
+ * Alleles at the same position whose slots collide are probed to the next free slot,
+ * and written to SIDE_FILE as (vid, signature), so that redim can keep their ids stable.
  */
 
 #ifdef _MSC_VER
@@ -26,10 +32,12 @@
 #include <cstdlib>
 #include <cstdio>
 #include <cstring>
+#include <cctype>
 #include <vector>
 #include <string>
 #include <map>
 #include <sstream>
+#include <stdint.h>
 
 // Is 10MB a large enough buffer for a VCF line?
 // One hopes, but VCF is pathological
@@ -45,6 +53,7 @@ char* _outputSamplesName = NULL;
 char* _outputVarName     = NULL;
 char* _outputGtName      = NULL;
 char* _outputMvName      = NULL;
+char* _outputSideName    = NULL;
 
 FILE* _inputFile         = NULL;
 
@@ -52,15 +61,27 @@ FILE* _outputSamplesFile = NULL;
 FILE* _outputVarFile     = NULL;
 FILE* _outputGtFile      = NULL;
 FILE* _outputMvFile      = NULL;
+FILE* _outputSideFile    = NULL;
 
 size_t _variantNo  = 0;
 size_t _numSamples = 0;
 
+// Deterministic variant ids; see kg_layout.py for the layout.
+#define VID_CHROM_SHIFT 40
+#define VID_POS_SHIFT   8
+#define VID_MAX_POS     ((int64_t(1) << (VID_CHROM_SHIFT - VID_POS_SHIFT)) - 1)
+#define VID_NUM_SLOTS   256
+string _slotChrom;
+int64_t _slotPos = -1;
+bool _usedSlots[VID_NUM_SLOTS];
+
 void usage()
 {
     printf("Utility to split a VCF file into two CSV files.\n"
-           "USAGE: vcf2csv [-i INPUT] samples_output var_output, gt_output, mv_output\n"
-           "\t-i INPUT\tInput file. (Default = stdin).\n");
+           "USAGE: vcf2csv [-i INPUT] [-d SIDE_OUTPUT] samples_output var_output, gt_output, mv_output\n"
+           "\t-i INPUT\tInput file. (Default = stdin).\n"
+           "\t-d SIDE_OUTPUT\tAppend a position-derived variant id to each variant line, and write\n"
+           "\t\t\tthe ids of co-located alleles that had to be probed to SIDE_OUTPUT.\n");
 }
 
 template <class Type>
@@ -86,6 +107,7 @@ void closeFiles()
     closeFile(_outputVarFile);
     closeFile(_outputGtFile);
     closeFile(_outputMvFile);
+    closeFile(_outputSideFile);
 }
 
 void haltOnError(const char* errStr)
@@ -109,6 +131,10 @@ void parseArgs(int argc, char* argv[])
         {
             _inputName = argv[++i];
         }
+        else if (strcmp(argv[i], "-d") == 0)
+        {
+            _outputSideName = argv[++i];
+        }
         else
         {
             break;
@@ -148,6 +174,76 @@ void openFiles()
     if (_outputMvFile == NULL) {
         haltOnError("Failed to open multival output file.");
     }
+
+    if (_outputSideName != NULL) {
+        _outputSideFile = fopen(_outputSideName, "w");
+        if (_outputSideFile == NULL) {
+            haltOnError("Failed to open variant id side output file.");
+        }
+    }
+}
+
+// Must agree with kg_layout.chrom_code().
+int64_t chromCode(const char* chrom)
+{
+    if ((chrom[0]=='c' || chrom[0]=='C') && (chrom[1]=='h' || chrom[1]=='H') && (chrom[2]=='r' || chrom[2]=='R'))
+    {
+        chrom += 3;
+    }
+    // The partition name: every other character than a letter or digit becomes '_'.
+    string name(chrom);
+    for (size_t i=0; i<name.size(); ++i) { name[i] = isalnum((unsigned char) name[i]) ? toupper(name[i]) : '_'; }
+    char* end = NULL;
+    long n = strtol(name.c_str(), &end, 10);
+    if (name.size() > 0 && *end == '\0' && n >= 1 && n <= 22) { return n; }
+    if (name == "X")                 { return 23; }
+    if (name == "Y")                 { return 24; }
+    if (name == "MT" || name == "M") { return 25; }
+    uint32_t h = 0;
+    for (size_t i=0; i<name.size(); ++i) { h = h * 31 + (unsigned char) name[i]; }
+    return 26 + h % ((1 << (63 - VID_CHROM_SHIFT)) - 26);
+}
+
+// FNV-1a of "ref>alt", folded into a slot number.
+size_t alleleSlot(const char* ref, const char* alt)
+{
+    uint32_t h = 2166136261u;
+    for (const char* p = ref; *p; ++p) { h = (h ^ (unsigned char)(*p)) * 16777619u; }
+    h = (h ^ (unsigned char)'>') * 16777619u;
+    for (const char* p = alt; *p; ++p) { h = (h ^ (unsigned char)(*p)) * 16777619u; }
+    return (h ^ (h >> 8) ^ (h >> 16) ^ (h >> 24)) & (VID_NUM_SLOTS - 1);
+}
+
+int64_t variantId(const char* chrom, const char* pos, const char* ref, const char* alt)
+{
+    int64_t p = strtoll(pos, NULL, 10);
+    if (p < 0 || p > VID_MAX_POS)
+    {
+        haltOnError("Position does not fit in a position-derived variant id.");
+    }
+    if (p != _slotPos || _slotChrom != chrom)
+    {
+        _slotPos = p;
+        _slotChrom = chrom;
+        memset(_usedSlots, 0, sizeof(_usedSlots));
+    }
+    size_t home = alleleSlot(ref, alt);
+    size_t slot = home;
+    while (_usedSlots[slot])
+    {
+        slot = (slot + 1) % VID_NUM_SLOTS;
+        if (slot == home)
+        {
+            haltOnError("More than 256 alleles at one position.");
+        }
+    }
+    _usedSlots[slot] = true;
+    int64_t vid = (chromCode(chrom) << VID_CHROM_SHIFT) | (p << VID_POS_SHIFT) | int64_t(slot);
+    if (slot != home)
+    {
+        fprintf(_outputSideFile, "%lld\t%s:%s %s>%s\n", (long long) vid, chrom, pos, ref, alt);
+    }
+    return vid;
 }
 
 vector<string> parseHeader(char* head)
@@ -253,7 +349,7 @@ inline void parseInfo(char* info)
 {
     if (info[0]=='\0')
     {
-        fprintf(_outputVarFile, "\t\t\n");
+        fprintf(_outputVarFile, "\t\t");
         return;
     }
     char nil = '\0';
@@ -287,7 +383,7 @@ inline void parseInfo(char* info)
         }
         token = strtok(NULL, ";");
     }
-    fprintf(_outputVarFile, "%s\t%s\t%s\n", ns, an, infoBuf.str().c_str());
+    fprintf(_outputVarFile, "%s\t%s\t%s", ns, an, infoBuf.str().c_str());
     writeMultVals(ac, af);
 }
 
@@ -303,11 +399,18 @@ void parseLine(char* line)
     if (strcmp(id,  ".") == 0)    { id[0]    ='\0'; }
     if (strcmp(qual,".") == 0)    { qual[0]  ='\0'; }
     if (strcmp(filter,".") == 0)  { filter[0]='\0'; }
+    int64_t vid = 0;
+    if (_outputSideFile != NULL)
+    {
+        vid = variantId(chrom, pos, ref, alt);
+    }
     fprintf(_outputVarFile, "%lu\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t", _variantNo, chrom, pos, id, ref, alt, qual, filter);
     char* info   = strtok(NULL, "\t");
     if (strcmp(info,".") == 0)    { info[0]  ='\0'; }
     char* nextToken = info + strlen(info) + 1;
     parseInfo(info);
+    if (_outputSideFile != NULL) { fprintf(_outputVarFile, "\t%lld\n", (long long) vid); }
+    else                         { fprintf(_outputVarFile, "\n");                       }
     strtok(nextToken, "\t"); //format
     char* gt = strtok(NULL, "\t");
     size_t gtIdx = 0;